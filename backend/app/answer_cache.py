@@ -0,0 +1,158 @@
+"""
+Per-tenant semantic answer cache
+Visitors ask the same few questions over and over. Each client gets a Chroma
+collection of (question embedding -> answer); a new message whose embedding is
+close enough to a cached question is answered without an LLM call or RAG.
+
+Entries carry a fingerprint of everything that shapes the answer (prompt,
+model, tier) plus a timestamp for the TTL. The whole collection is dropped when
+the client's config, documents or FAQs change.
+"""
+import hashlib
+import time
+import uuid
+from typing import List, Optional
+from uuid import UUID
+
+from .config import get_settings
+from .executors import vector_pool
+
+settings = get_settings()
+
+# client_id -> invalidation count; a store started before an invalidation is discarded
+_generations: dict = {}
+
+_stats = {"hits": 0, "misses": 0, "stores": 0, "stale_stores": 0, "invalidations": 0}
+
+
+def get_answer_collection_name(client_id: UUID) -> str:
+    """Answer cache collection for a client (next to its document collection)"""
+    return f"answers_{str(client_id).replace('-', '_')}"
+
+
+def answer_fingerprint(client, config, model: str) -> str:
+    """Hash of the inputs that change what the LLM would answer"""
+    tier = getattr(client.tier, "value", client.tier)
+    raw = "\n".join(str(part) for part in (
+        client.company_name, tier, config.bot_name, config.system_prompt or "", model
+    ))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerLookup:
+    """Result of a cache lookup; handed back to store_answer() after a miss"""
+
+    __slots__ = ("client_id", "question", "embedding", "fingerprint", "generation", "answer")
+
+    def __init__(self, client_id: UUID, question: str, embedding: List[float], fingerprint: str):
+        self.client_id = client_id
+        self.question = question
+        self.embedding = embedding
+        self.fingerprint = fingerprint
+        self.generation = _generations.get(str(client_id), 0)
+        self.answer: Optional[str] = None
+
+
+def _get_collection(client_id: UUID, create: bool):
+    from .rag import chroma_client
+
+    name = get_answer_collection_name(client_id)
+    if create:
+        return chroma_client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+    try:
+        return chroma_client.get_collection(name)
+    except Exception:
+        return None
+
+
+def _find_answer(lookup: AnswerLookup) -> Optional[str]:
+    """Closest live entry within the similarity threshold (blocking Chroma calls)"""
+    collection = _get_collection(lookup.client_id, create=False)
+    size = collection.count() if collection is not None else 0
+    if not size:
+        return None
+    results = collection.query(
+        query_embeddings=[lookup.embedding],
+        n_results=min(3, size),
+        where={"fingerprint": lookup.fingerprint},
+        include=["metadatas", "distances"]
+    )
+    ids = results["ids"][0] if results.get("ids") else []
+    metadatas = results["metadatas"][0] if results.get("metadatas") else []
+    distances = results["distances"][0] if results.get("distances") else []
+
+    max_distance = 1.0 - settings.answer_cache_similarity_threshold  # Cosine distance
+    now = time.time()
+    expired = []
+    answer = None
+    for entry_id, metadata, distance in zip(ids, metadatas, distances):
+        if now - float(metadata.get("created_at", 0)) > settings.answer_cache_ttl_seconds:
+            expired.append(entry_id)
+        elif answer is None and distance <= max_distance:
+            answer = metadata.get("answer")
+    if expired:
+        collection.delete(ids=expired)
+    return answer
+
+
+def _add_answer(lookup: AnswerLookup, answer: str):
+    collection = _get_collection(lookup.client_id, create=True)
+    collection.add(
+        ids=[uuid.uuid4().hex],
+        embeddings=[lookup.embedding],
+        documents=[lookup.question],
+        metadatas=[{"answer": answer, "fingerprint": lookup.fingerprint, "created_at": time.time()}]
+    )
+    # Bound each tenant's cache: drop the oldest tenth once over the cap
+    if collection.count() > settings.answer_cache_max_entries:
+        entries = collection.get(include=["metadatas"])
+        by_age = sorted(zip(entries["ids"], entries["metadatas"]), key=lambda e: float(e[1].get("created_at", 0)))
+        collection.delete(ids=[entry_id for entry_id, _ in by_age[:max(1, len(by_age) // 10)]])
+
+
+def cacheable_question(question: str) -> bool:
+    """Long, one-off messages are not worth caching (or matching)"""
+    return settings.answer_cache_enabled and len(question) <= settings.answer_cache_max_question_chars
+
+
+async def lookup_answer(client, config, model: str, question: str, embedding: List[float]) -> AnswerLookup:
+    """Look up a cached answer; lookup.answer is None on a miss"""
+    lookup = AnswerLookup(client.id, question, embedding, answer_fingerprint(client, config, model))
+    try:
+        lookup.answer = await vector_pool.run(_find_answer, lookup)
+    except Exception as e:
+        print(f"[Answer Cache] Lookup failed (non-fatal): {e}")
+    _stats["hits" if lookup.answer else "misses"] += 1
+    return lookup
+
+
+async def store_answer(lookup: Optional[AnswerLookup], answer: str):
+    """Cache a freshly generated answer, unless the client's knowledge changed meanwhile"""
+    if lookup is None or not answer.strip():
+        return
+    if _generations.get(str(lookup.client_id), 0) != lookup.generation:
+        _stats["stale_stores"] += 1
+        return
+    try:
+        await vector_pool.run(_add_answer, lookup, answer)
+        _stats["stores"] += 1
+    except Exception as e:
+        print(f"[Answer Cache] Store failed (non-fatal): {e}")
+
+
+def invalidate_answers(client_id: UUID):
+    """Forget every cached answer for a client (config, documents or FAQs changed)"""
+    from .rag import chroma_client
+
+    key = str(client_id)
+    _generations[key] = _generations.get(key, 0) + 1
+    _stats["invalidations"] += 1
+    try:
+        chroma_client.delete_collection(get_answer_collection_name(client_id))
+    except Exception:
+        pass  # Nothing cached yet
+
+
+def stats() -> dict:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {**_stats, "hit_rate": round(_stats["hits"] / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,119 @@
+"""
+API key cache
+Dashboard requests authenticate by SHA-256 of the X-API-Key header. Resolved
+keys are kept in a TTL-bounded LRU (key hash -> client id plus snapshots of
+the client and its config), so repeat requests skip the lookup: read-only
+endpoints use the snapshots as they are, write endpoints load the client by
+primary key.
+
+Only successful lookups are cached; an unknown key always goes to the
+(indexed) api_key_hash lookup. Entries are dropped when a client's key is
+rotated (resend, Stripe checkout) or its config or subscription changes.
+Across workers, write endpoints re-check the freshly loaded row's key hash and
+active flag on every hit; read-only endpoints serve the snapshot without a
+query, so they only take entries younger than API_KEY_CACHE_SNAPSHOT_TTL_SECONDS,
+which bounds how long another worker can accept a rotated-out key there.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from uuid import UUID
+
+from .config import get_settings
+from .tenant_gate import _snapshot
+
+settings = get_settings()
+
+
+class CachedApiKey:
+    """A resolved API key"""
+
+    __slots__ = ("client_id", "permanent", "client", "loaded_at")
+
+    def __init__(self, client, permanent: bool):
+        self.client_id = client.id
+        self.permanent = permanent
+        # Detached copies; the config rides along as client.config like on the ORM row
+        self.client = _snapshot(client)
+        self.client.config = _snapshot(client.config) if client.config is not None else None
+        self.loaded_at = time.monotonic()
+
+
+class ApiKeyCache:
+    """LRU of resolved key hashes, invalidated per client"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, CachedApiKey]" = OrderedDict()
+        self._generation = 0  # Bumped on every invalidation; lookups racing one are not stored
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def lookup(self, key_hash: str, max_age: Optional[float] = None) -> Tuple[Optional[CachedApiKey], int]:
+        """Fresh entry (or None) and the generation to store a lookup under; max_age tightens the TTL"""
+        ttl = self.ttl_seconds if max_age is None else min(max_age, self.ttl_seconds)
+        with self._lock:
+            entry = self._entries.get(key_hash)
+            age = time.monotonic() - entry.loaded_at if entry is not None else None
+            if entry is not None and age < ttl:
+                self._entries.move_to_end(key_hash)
+                self.hits += 1
+                return entry, self._generation
+            if entry is not None and age >= self.ttl_seconds:
+                del self._entries[key_hash]
+            self.misses += 1
+            return None, self._generation
+
+    def store(self, key_hash: str, generation: int, client, permanent: bool) -> CachedApiKey:
+        """Cache a resolved key unless an invalidation happened since the lookup"""
+        entry = CachedApiKey(client, permanent)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key_hash] = entry
+                self._entries.move_to_end(key_hash)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, client_id: UUID):
+        """Forget every key resolved to this client"""
+        client_id = str(client_id)
+        with self._lock:
+            for key_hash in [k for k, e in self._entries.items() if str(e.client_id) == client_id]:
+                del self._entries[key_hash]
+            self._generation += 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+api_keys = ApiKeyCache(
+    max_entries=settings.api_key_cache_max_entries,
+    ttl_seconds=settings.api_key_cache_ttl_seconds,
+)
+
+
+def invalidate_api_key(client_id: UUID):
+    """Drop cached keys after a client's key, config or subscription changed"""
+    api_keys.invalidate(client_id)
+
+
+def stats() -> dict:
+    return api_keys.stats()
@@ -0,0 +1,166 @@
+"""
+TTS audio cache
+Content-addressed on (voice, normalized text): a size-bounded in-memory LRU in
+front of an on-disk tier with TTL eviction. Values are raw 24kHz PCM, so the
+same entry serves WAV, streamed and re-encoded responses.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from .config import get_settings
+
+settings = get_settings()
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_tts_text(text: str) -> str:
+    """Collapse whitespace and Unicode variants; case is kept since it can change pronunciation"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def tts_cache_key(voice: str, text: str) -> str:
+    """Cache key for one utterance in one voice"""
+    return hashlib.sha256(f"{voice}\n{normalize_tts_text(text)}".encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """Two-tier PCM cache with hit/miss counters"""
+
+    def __init__(self, max_memory_bytes: int, directory: str, ttl_seconds: int):
+        self.max_memory_bytes = max_memory_bytes
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (stored_at, pcm)
+        self._memory_bytes = 0
+        self._last_sweep = 0.0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    # ----- memory tier -----
+
+    def _memory_get(self, key: str, now: float) -> Optional[bytes]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        stored_at, pcm = entry
+        if now - stored_at > self.ttl_seconds:
+            self._memory_pop(key)
+            return None
+        self._memory.move_to_end(key)
+        return pcm
+
+    def _memory_put(self, key: str, pcm: bytes, stored_at: float):
+        if len(pcm) > self.max_memory_bytes:
+            return
+        self._memory_pop(key)
+        self._memory[key] = (stored_at, pcm)
+        self._memory_bytes += len(pcm)
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _memory_pop(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[1])
+
+    # ----- disk tier (blocking; always called via asyncio.to_thread) -----
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pcm")
+
+    def _disk_get(self, key: str, now: float) -> Optional[tuple]:
+        path = self._path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if now - stored_at > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                return stored_at, f.read()
+        except FileNotFoundError:
+            return None
+
+    def _disk_put(self, key: str, pcm: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pcm)
+        os.replace(tmp_path, path)  # Atomic: readers never see a partial file
+
+    def _disk_sweep(self, now: float):
+        """Delete expired files"""
+        if not os.path.isdir(self.directory):
+            return
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if now - os.path.getmtime(path) > self.ttl_seconds:
+                        os.remove(path)
+                except OSError:
+                    continue
+
+    # ----- public API -----
+
+    async def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        pcm = self._memory_get(key, now)
+        if pcm is not None:
+            self.memory_hits += 1
+            return pcm
+        try:
+            entry = await asyncio.to_thread(self._disk_get, key, now)
+        except OSError as e:
+            print(f"[TTS Cache] Disk read failed (non-fatal): {e}")
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, pcm = entry
+        self.disk_hits += 1
+        self._memory_put(key, pcm, stored_at)
+        return pcm
+
+    async def put(self, key: str, pcm: bytes):
+        now = time.time()
+        self._memory_put(key, pcm, now)
+        self.writes += 1
+        try:
+            await asyncio.to_thread(self._disk_put, key, pcm)
+            # Expired files are also dropped lazily on read; sweep at most hourly for the rest
+            if now - self._last_sweep > 3600:
+                self._last_sweep = now
+                await asyncio.to_thread(self._disk_sweep, now)
+        except OSError as e:
+            print(f"[TTS Cache] Disk write failed (non-fatal): {e}")
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+        }
+
+
+audio_cache = AudioCache(
+    max_memory_bytes=settings.tts_cache_memory_bytes,
+    directory=settings.tts_cache_directory,
+    ttl_seconds=settings.tts_cache_ttl_seconds,
+)
@@ -0,0 +1,295 @@
+"""
+Voice response encodings
+Synthesis always produces 24kHz 16-bit mono PCM; this module turns it into the
+smaller formats a client can ask for, all still wrapped in WAV:
+
+    pcm_24k / pcm_16k / pcm_8k        16-bit PCM            48 / 32 / 16 KB/s
+    mulaw_24k / mulaw_16k / mulaw_8k  G.711 mu-law, 8-bit   24 / 16 / 8 KB/s
+    adpcm_24k / adpcm_16k / adpcm_8k  IMA-ADPCM, 4-bit      ~12 / ~8 / ~4 KB/s
+
+Resampling and encoding are vectorized with NumPy. IMA-ADPCM is sequential
+within a block, so all blocks are encoded side by side (one NumPy op per sample
+position instead of one Python step per sample).
+"""
+import re
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+
+SOURCE_SAMPLE_RATE = 24000
+DEFAULT_AUDIO_FORMAT = "pcm_24k"
+AUDIO_FORMAT_PATTERN = r"^(pcm|mulaw|adpcm)_(8|16|24)k$"
+_AUDIO_FORMAT = re.compile(AUDIO_FORMAT_PATTERN)
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_MULAW = 0x0007
+WAVE_FORMAT_IMA_ADPCM = 0x0011
+
+_IMA_STEPS = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+], dtype=np.int32)
+_IMA_INDEX_SHIFT = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+_MULAW_SEGMENT_ENDS = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF], dtype=np.int32)
+
+
+def parse_audio_format(audio_format: Optional[str]) -> Tuple[str, int]:
+    """'mulaw_8k' -> ('mulaw', 8000); unknown or empty values fall back to the default"""
+    match = _AUDIO_FORMAT.match(audio_format or "") or _AUDIO_FORMAT.match(DEFAULT_AUDIO_FORMAT)
+    return match.group(1), int(match.group(2)) * 1000
+
+
+def adpcm_block_align(sample_rate: int) -> int:
+    """Conventional IMA-ADPCM block sizes: 256 bytes up to 11kHz, 512 above, 1024 above 22kHz"""
+    if sample_rate <= 11025:
+        return 256
+    if sample_rate <= 22050:
+        return 512
+    return 1024
+
+
+def adpcm_samples_per_block(block_align: int) -> int:
+    """Mono block: a 4-byte header holding the first sample, then two samples per byte"""
+    return (block_align - 4) * 2 + 1
+
+
+def wav_format(audio_format: Optional[str]) -> dict:
+    """
+    WAV fmt-chunk parameters for wav_header(): sample_rate, format_tag,
+    bits_per_sample, block_align, byte_rate and the codec-specific extra bytes
+    """
+    codec, rate = parse_audio_format(audio_format)
+    if codec == "mulaw":
+        return {"sample_rate": rate, "format_tag": WAVE_FORMAT_MULAW, "bits_per_sample": 8,
+                "block_align": 1, "byte_rate": rate, "extra": b""}
+    if codec == "adpcm":
+        block_align = adpcm_block_align(rate)
+        samples_per_block = adpcm_samples_per_block(block_align)
+        return {"sample_rate": rate, "format_tag": WAVE_FORMAT_IMA_ADPCM, "bits_per_sample": 4,
+                "block_align": block_align, "byte_rate": rate * block_align // samples_per_block,
+                "extra": samples_per_block.to_bytes(2, "little")}
+    return {"sample_rate": rate, "format_tag": WAVE_FORMAT_PCM, "bits_per_sample": 16,
+            "block_align": 2, "byte_rate": rate * 2, "extra": None}
+
+
+# ----- resampling -----
+
+@lru_cache(maxsize=8)
+def _lowpass_taps(src_rate: int, dst_rate: int) -> np.ndarray:
+    """Hamming-windowed sinc anti-aliasing filter just below the target Nyquist frequency"""
+    ratio = src_rate / dst_rate
+    num_taps = int(16 * ratio) | 1  # Odd length: integer group delay
+    cutoff = 0.45 / ratio  # Cycles per input sample
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+    return taps / taps.sum()
+
+
+class Resampler:
+    """
+    Streaming 16-bit PCM rate converter (downsampling): FIR low-pass, then linear
+    interpolation at the output positions. Filter history and the fractional read
+    position carry over between chunks, so chunked and one-shot output match.
+    """
+
+    def __init__(self, src_rate: int, dst_rate: int):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        self.passthrough = src_rate == dst_rate
+        if not self.passthrough:
+            self._taps = _lowpass_taps(src_rate, dst_rate)
+            self._delay = (len(self._taps) - 1) // 2
+            self._history = np.zeros(len(self._taps) - 1)
+            self._step = src_rate / dst_rate
+            self._filtered = 0  # Filtered samples produced so far
+            self._last = 0.0  # Last filtered sample, for interpolating across chunk edges
+            self._next = float(self._delay)  # Read position of the next output sample (skips the filter delay)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if self.passthrough or not len(samples):
+            return samples.astype(np.int16, copy=False)
+        extended = np.concatenate((self._history, samples.astype(np.float64)))
+        filtered = np.convolve(extended, self._taps, mode="valid")
+        self._history = extended[-(len(self._taps) - 1):]
+
+        first = self._filtered
+        self._filtered += len(filtered)
+        last_index = self._filtered - 1
+        if self._next > last_index:
+            self._last = filtered[-1]
+            return np.zeros(0, dtype=np.int16)
+        positions = np.arange(self._next, last_index + 1e-9, self._step)
+        self._next = positions[-1] + self._step
+        # Index first - 1 holds the previous chunk's last sample
+        out = np.interp(positions, np.arange(first - 1, last_index + 1), np.concatenate(([self._last], filtered)))
+        self._last = filtered[-1]
+        return np.clip(np.round(out), -32768, 32767).astype(np.int16)
+
+    def flush(self) -> np.ndarray:
+        """Push the filter delay's worth of silence through to emit the tail"""
+        if self.passthrough:
+            return np.zeros(0, dtype=np.int16)
+        return self.process(np.zeros(self._delay))
+
+
+def resample_pcm16(pcm: bytes, src_rate: int, dst_rate: int) -> bytes:
+    """Resample a whole 16-bit mono PCM buffer"""
+    if src_rate == dst_rate:
+        return pcm
+    resampler = Resampler(src_rate, dst_rate)
+    samples = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype="<i2")
+    return np.concatenate((resampler.process(samples), resampler.flush())).astype("<i2").tobytes()
+
+
+# ----- codecs -----
+
+def encode_mulaw(samples: np.ndarray) -> bytes:
+    """G.711 mu-law (reference 14-bit segment search): 16-bit linear -> 8-bit logarithmic"""
+    x = samples.astype(np.int32) >> 2
+    mask = np.where(x < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(x), 8159) + 0x21
+    segment = np.searchsorted(_MULAW_SEGMENT_ENDS, magnitude)
+    code = np.where(segment >= 8, 0x7F, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+    return (code ^ mask).astype(np.uint8).tobytes()
+
+
+def _initial_step_index(blocks: np.ndarray) -> np.ndarray:
+    """Per-block starting step index, sized to the block's opening sample deltas"""
+    opening = np.abs(np.diff(blocks[:, :9], axis=1)).mean(axis=1) if blocks.shape[1] > 1 else np.zeros(len(blocks))
+    return np.clip(np.searchsorted(_IMA_STEPS, opening), 0, 88).astype(np.int32)
+
+
+def _ima_codes_vectorized(blocks: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """Quantize every block side by side: one NumPy step per sample position"""
+    num_blocks, samples_per_block = blocks.shape
+    predictor = blocks[:, 0].copy()
+    codes = np.empty((num_blocks, samples_per_block - 1), dtype=np.uint8)
+    for position in range(1, samples_per_block):
+        step = _IMA_STEPS[index]
+        diff = blocks[:, position] - predictor
+        code = np.where(diff < 0, 8, 0)
+        diff = np.abs(diff)
+        vpdiff = step >> 3
+        for bit, shift in ((4, 0), (2, 1), (1, 2)):
+            part = step >> shift
+            hit = diff >= part
+            code = code | np.where(hit, bit, 0)
+            diff = np.where(hit, diff - part, diff)
+            vpdiff = vpdiff + np.where(hit, part, 0)
+        predictor = np.clip(np.where(code & 8, predictor - vpdiff, predictor + vpdiff), -32768, 32767)
+        index = np.clip(index + _IMA_INDEX_SHIFT[code], 0, 88)
+        codes[:, position - 1] = code
+    return codes
+
+
+def _ima_codes_scalar(blocks: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """Same quantizer one sample at a time; cheaper than NumPy's per-call overhead for a few blocks"""
+    steps = _IMA_STEPS.tolist()
+    shifts = _IMA_INDEX_SHIFT.tolist()
+    codes = np.empty((blocks.shape[0], blocks.shape[1] - 1), dtype=np.uint8)
+    for row, (block, step_index) in enumerate(zip(blocks.tolist(), index.tolist())):
+        predictor = block[0]
+        row_codes = []
+        for sample in block[1:]:
+            step = steps[step_index]
+            diff = sample - predictor
+            code = 8 if diff < 0 else 0
+            diff = abs(diff)
+            vpdiff = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                vpdiff += step
+            if diff >= step >> 1:
+                code |= 2
+                diff -= step >> 1
+                vpdiff += step >> 1
+            if diff >= step >> 2:
+                code |= 1
+                vpdiff += step >> 2
+            predictor = max(-32768, min(32767, predictor - vpdiff if code & 8 else predictor + vpdiff))
+            step_index = max(0, min(88, step_index + shifts[code]))
+            row_codes.append(code)
+        codes[row] = row_codes
+    return codes
+
+
+# Below this many blocks the per-sample Python loop beats one NumPy call per sample position
+_IMA_VECTORIZE_MIN_BLOCKS = 48
+
+
+def encode_ima_adpcm(samples: np.ndarray, block_align: int) -> bytes:
+    """
+    Mono IMA-ADPCM (WAV format 0x11). The last block is padded with silence.
+    Every block restarts from its own header, so blocks are independent and are
+    encoded in parallel: the loop runs once per sample position, not per sample.
+    """
+    samples_per_block = adpcm_samples_per_block(block_align)
+    if not len(samples):
+        return b""
+    num_blocks = -(-len(samples) // samples_per_block)
+    blocks = np.zeros(num_blocks * samples_per_block, dtype=np.int32)
+    blocks[:len(samples)] = samples
+    blocks = blocks.reshape(num_blocks, samples_per_block)
+
+    index = _initial_step_index(blocks)
+    if num_blocks >= _IMA_VECTORIZE_MIN_BLOCKS:
+        codes = _ima_codes_vectorized(blocks, index)
+    else:
+        codes = _ima_codes_scalar(blocks, index)
+
+    header = np.zeros((num_blocks, 4), dtype=np.uint8)
+    header[:, 0:2] = blocks[:, 0].astype("<i2").view(np.uint8).reshape(num_blocks, 2)
+    header[:, 2] = index
+    packed = codes[:, 0::2] | (codes[:, 1::2] << 4)  # Low nibble first
+    return np.concatenate((header, packed), axis=1).tobytes()
+
+
+def encode_pcm16(pcm: bytes, src_rate: int, audio_format: Optional[str]) -> Tuple[bytes, int]:
+    """Encode a whole 16-bit mono PCM buffer; returns (data chunk bytes, sample frames)"""
+    codec, rate = parse_audio_format(audio_format)
+    samples = np.frombuffer(resample_pcm16(pcm, src_rate, rate), dtype="<i2")
+    if codec == "mulaw":
+        return encode_mulaw(samples), len(samples)
+    if codec == "adpcm":
+        return encode_ima_adpcm(samples, adpcm_block_align(rate)), len(samples)
+    return samples.tobytes(), len(samples)
+
+
+class AudioStreamEncoder:
+    """
+    Chunk-at-a-time encoder for the progressive relay. PCM and mu-law output
+    each chunk as it arrives; IMA-ADPCM emits whole blocks and keeps the remainder.
+    """
+
+    def __init__(self, audio_format: Optional[str], src_rate: int = SOURCE_SAMPLE_RATE):
+        self.codec, rate = parse_audio_format(audio_format)
+        self._resampler = Resampler(src_rate, rate)
+        self._block_align = adpcm_block_align(rate)
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._carry = b""  # Odd trailing byte of a PCM chunk
+
+    def _encode(self, samples: np.ndarray, final: bool) -> bytes:
+        if self.codec == "mulaw":
+            return encode_mulaw(samples)
+        if self.codec == "adpcm":
+            samples = np.concatenate((self._pending, samples))
+            usable = len(samples) if final else len(samples) - len(samples) % adpcm_samples_per_block(self._block_align)
+            self._pending = samples[usable:]
+            return encode_ima_adpcm(samples[:usable], self._block_align)
+        return samples.astype("<i2").tobytes()
+
+    def encode(self, pcm: bytes) -> bytes:
+        pcm = self._carry + pcm
+        even = len(pcm) // 2 * 2
+        self._carry = pcm[even:]
+        return self._encode(self._resampler.process(np.frombuffer(pcm[:even], dtype="<i2")), final=False)
+
+    def flush(self) -> bytes:
+        return self._encode(self._resampler.flush(), final=True)
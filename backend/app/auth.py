@@ -6,12 +6,14 @@ import secrets
 import hashlib
 from fastapi import HTTPException, Security, Depends, Request
 from fastapi.security import APIKeyHeader
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func, select
 
 from .config import get_settings
-from .database import get_db
+from .database import get_async_db, get_db
 from .models import Client
+from .api_key_cache import api_keys
 
 # API Key header
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
@@ -32,6 +34,28 @@ def verify_api_key(api_key: str, hashed: str) -> bool:
     return hash_api_key(api_key) == hashed
 
 
+def _lookup_plan(api_key: str, key_hash: str) -> list:
+    """(filter criteria, is_permanent_key) lookups to try in order"""
+    settings = get_settings()
+    plan = []
+    # Permanent demo key bypass: exact key match → use designated client and grant full access
+    if settings.permanent_api_key and api_key.strip() == settings.permanent_api_key.strip():
+        email = (settings.permanent_api_key_client_email or "").strip().lower()
+        if email:
+            plan.append(((func.lower(Client.email) == email,), True))
+        # Fallback: look up by key hash without is_active so key can work even if client was deactivated
+        plan.append(((Client.api_key_hash == key_hash,), True))
+    # Normal lookup: hash + is_active (api_key_hash is indexed)
+    plan.append(((Client.api_key_hash == key_hash, Client.is_active == True), False))
+    return plan
+
+
+def _authenticated(request: Request, client, permanent: bool):
+    if permanent:
+        request.state.used_permanent_key = True
+    return client
+
+
 async def get_client_from_api_key(
     request: Request,
     api_key: str = Security(api_key_header),
@@ -41,43 +65,68 @@ async def get_client_from_api_key(
     Dependency to get client from API key
     Used for authenticated endpoints (dashboard)
     Permanent demo key: when PERMANENT_API_KEY matches, return client by PERMANENT_API_KEY_CLIENT_EMAIL with full access.
+    A cached key costs one primary-key load instead of the hash lookup(s).
     """
-    settings = get_settings()
     if not api_key:
         raise HTTPException(
             status_code=401,
             detail="API key required"
         )
 
-    # Permanent demo key bypass: exact key match → use designated client and grant full access
-    if settings.permanent_api_key and api_key.strip() == settings.permanent_api_key.strip():
-        email = (settings.permanent_api_key_client_email or "").strip().lower()
-        if email:
-            client = db.query(Client).filter(func.lower(Client.email) == email).first()
-            if client:
-                request.state.used_permanent_key = True
-                return client
-        # Fallback: look up by key hash without is_active so key can work even if client was deactivated
-        key_hash = hash_api_key(api_key)
-        client = db.query(Client).filter(Client.api_key_hash == key_hash).first()
+    key_hash = hash_api_key(api_key)
+    cached, generation = api_keys.lookup(key_hash)
+    if cached is not None:
+        client = db.get(Client, cached.client_id)
+        # The fresh row shows a key rotated or a client deactivated by another worker
+        if client and (cached.permanent or (client.is_active and client.api_key_hash == key_hash)):
+            return _authenticated(request, client, cached.permanent)
+        api_keys.invalidate(cached.client_id)
+
+    for criteria, permanent in _lookup_plan(api_key, key_hash):
+        client = db.query(Client).filter(*criteria).first()
         if client:
-            request.state.used_permanent_key = True
-            return client
+            api_keys.store(key_hash, generation, client, permanent)
+            return _authenticated(request, client, permanent)
 
-    # Normal lookup: hash + is_active
-    key_hash = hash_api_key(api_key)
-    client = db.query(Client).filter(
-        Client.api_key_hash == key_hash,
-        Client.is_active == True
-    ).first()
+    raise HTTPException(
+        status_code=401,
+        detail="Invalid API key"
+    )
 
-    if not client:
+
+async def get_client_from_api_key_async(
+    request: Request,
+    api_key: str = Security(api_key_header),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    get_client_from_api_key for read-only endpoints: returns a detached snapshot of
+    the client (with .config), straight from the key cache when possible.
+    """
+    if not api_key:
         raise HTTPException(
             status_code=401,
-            detail="Invalid API key"
+            detail="API key required"
         )
 
-    return client
+    key_hash = hash_api_key(api_key)
+    # No row is loaded on a hit, so only recent snapshots are served (see api_key_cache)
+    cached, generation = api_keys.lookup(key_hash, max_age=get_settings().api_key_cache_snapshot_ttl_seconds)
+    if cached is not None:
+        return _authenticated(request, cached.client, cached.permanent)
+
+    for criteria, permanent in _lookup_plan(api_key, key_hash):
+        # Config loaded eagerly (no lazy loads on AsyncSession)
+        result = await db.execute(select(Client).options(selectinload(Client.config)).where(*criteria))
+        client = result.scalars().first()
+        if client:
+            cached = api_keys.store(key_hash, generation, client, permanent)
+            return _authenticated(request, cached.client, permanent)
+
+    raise HTTPException(
+        status_code=401,
+        detail="Invalid API key"
+    )
 
 
 async def get_client_from_client_id(
@@ -0,0 +1,135 @@
+"""
+Per-client chunk registry
+Chunks are stored in the client's Chroma collection under the SHA-256 of their
+text, so a chunk shared by several documents (or by two versions of the same
+handbook) is embedded once. document_chunks has a row per document and chunk;
+a chunk's reference count is its number of rows, and its vector is deleted when
+the last document referencing it is.
+
+Changes to a client's registry are serialized with a transaction-level advisory
+lock, and vectors are dropped while it is held, so a chunk is never deleted
+between another document finding it and taking its reference. Documents are
+deleted in the same transaction as their release, and add_references checks
+under the lock that the document still exists, so a document deleted while
+its job runs cannot leave references behind.
+
+Functions take the caller's sync Session (run them via asyncio.to_thread from
+async code); the caller commits.
+"""
+import hashlib
+from typing import Callable, Iterable, List, Set
+from uuid import UUID
+
+from sqlalchemy import delete, literal, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import Document, DocumentChunk
+
+# Hashes per IN (...) / INSERT statement
+BATCH_SIZE = 1000
+
+_counters = {"chunks_new": 0, "chunks_reused": 0, "chunks_dropped": 0, "documents_reused": 0}
+
+
+class DocumentGone(Exception):
+    """The document was deleted before its chunks were registered"""
+
+
+def chunk_id(chunk: str) -> str:
+    """Content-addressed chunk id (the Chroma id and registry key)"""
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+def _batches(items: List[str]) -> Iterable[List[str]]:
+    for start in range(0, len(items), BATCH_SIZE):
+        yield items[start:start + BATCH_SIZE]
+
+
+def _lock(db, client_id: UUID):
+    db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"chunks:{client_id}"})
+
+
+def _referenced(db, client_id: UUID, ids: Iterable[str], exclude_doc: UUID = None) -> Set[str]:
+    """Those of `ids` some document (other than exclude_doc) references"""
+    found: Set[str] = set()
+    for batch in _batches(list(ids)):
+        query = select(DocumentChunk.chunk_hash).distinct().where(
+            DocumentChunk.client_id == client_id, DocumentChunk.chunk_hash.in_(batch)
+        )
+        if exclude_doc is not None:
+            query = query.where(DocumentChunk.document_id != exclude_doc)
+        found.update(db.execute(query).scalars())
+    return found
+
+
+def add_references(db, client_id: UUID, doc_id: UUID, ids: Iterable[str]) -> Set[str]:
+    """
+    Reference a document's chunks; returns the ids other documents already
+    reference (their vectors are stored). The rest must be embedded.
+    Safe to repeat for a retried document. Raises DocumentGone if the
+    document no longer exists.
+    """
+    ids = list(dict.fromkeys(ids))
+    _lock(db, client_id)
+    if db.execute(select(Document.id).where(Document.id == doc_id)).first() is None:
+        raise DocumentGone(f"Document {doc_id} was deleted")
+    existing = _referenced(db, client_id, ids, exclude_doc=doc_id)
+    for batch in _batches(ids):
+        db.execute(
+            insert(DocumentChunk)
+            .values([{"document_id": doc_id, "chunk_hash": h, "client_id": client_id} for h in batch])
+            .on_conflict_do_nothing()
+        )
+    _counters["chunks_reused"] += len(existing)
+    _counters["chunks_new"] += len(ids) - len(existing)
+    return existing
+
+
+def document_chunk_ids(db, doc_id: UUID) -> List[str]:
+    return list(db.execute(select(DocumentChunk.chunk_hash).where(DocumentChunk.document_id == doc_id)).scalars())
+
+
+def copy_references(db, client_id: UUID, source_doc_id: UUID, doc_id: UUID) -> int:
+    """Give doc_id the same chunks as source_doc_id (an identical upload); 0 if the source has none"""
+    _lock(db, client_id)
+    copied = db.execute(
+        insert(DocumentChunk)
+        .from_select(
+            ["document_id", "chunk_hash", "client_id"],
+            select(literal(doc_id, DocumentChunk.document_id.type), DocumentChunk.chunk_hash, DocumentChunk.client_id)
+            .where(DocumentChunk.document_id == source_doc_id, DocumentChunk.client_id == client_id),
+        )
+        .on_conflict_do_nothing()
+    ).rowcount
+    if copied:
+        _counters["documents_reused"] += 1
+    return copied
+
+
+def release_references(
+    db,
+    client_id: UUID,
+    doc_id: UUID,
+    drop: Callable[[List[str]], None],
+    candidates: Iterable[str] = (),
+) -> int:
+    """
+    Remove a document's references and drop(ids) the vectors no document
+    references any more. `candidates` are further ids to drop if unreferenced
+    (e.g. vectors the document stored after its references were released).
+    Returns the number of ids dropped.
+    """
+    _lock(db, client_id)
+    released = set(db.execute(
+        delete(DocumentChunk).where(DocumentChunk.document_id == doc_id).returning(DocumentChunk.chunk_hash)
+    ).scalars())
+    released.update(candidates)
+    orphans = sorted(released - _referenced(db, client_id, released))
+    if orphans:
+        drop(orphans)
+        _counters["chunks_dropped"] += len(orphans)
+    return len(orphans)
+
+
+def stats() -> dict:
+    return dict(_counters)
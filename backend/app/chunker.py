@@ -0,0 +1,158 @@
+"""
+Streaming text chunker
+iter_chunks consumes text as an extractor produces it (pages, file blocks) and
+yields chunks in one pass:
+
+- text is split into paragraphs on blank lines as it arrives; a paragraph
+  bigger than a chunk is split into sentences, a sentence bigger than a chunk
+  into words
+- segments are packed greedily up to `chunk_size`, measured in characters or
+  tokens (pass `measure`, e.g. prompt_budget.count_tokens)
+- the next chunk starts with the trailing segments of the previous one that
+  fit in `overlap`, chosen by walking back over the segment sizes already
+  measured; chunk text is joined once, when the chunk is emitted
+
+Only the current chunk's segments and one unfinished paragraph are held, so
+memory stays flat however large the document is.
+"""
+import re
+from collections import deque
+from typing import Callable, Iterable, Iterator, Tuple, Union
+
+PARAGRAPH_BREAK = re.compile(r"\n[ \t\r\f\v]*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# Chunks this short are extraction artifacts (page numbers, stray headers)
+MIN_CHUNK_CHARS = 50
+# An unfinished paragraph longer than this is cut at its last sentence boundary
+MAX_PENDING_CHARS = 64 * 1024
+
+Measure = Callable[[str], int]
+
+
+def _last_boundary(text: str) -> int:
+    """Cut position for an over-long unfinished paragraph: after a sentence, else a space"""
+    cut = max(text.rfind(". "), text.rfind("! "), text.rfind("? "))
+    if cut > 0:
+        return cut + 2
+    cut = text.rfind(" ")
+    return cut + 1 if cut > 0 else len(text)
+
+
+def iter_paragraphs(pieces: Iterable[str]) -> Iterator[str]:
+    """Paragraphs of a text delivered in arbitrary pieces"""
+    pending = ""
+    for piece in pieces:
+        if not piece:
+            continue
+        pending = pending + piece if pending else piece
+        start = 0
+        for match in PARAGRAPH_BREAK.finditer(pending):
+            yield pending[start:match.start()]
+            start = match.end()
+        pending = pending[start:]
+        if len(pending) > MAX_PENDING_CHARS:
+            cut = _last_boundary(pending)
+            yield pending[:cut]
+            pending = pending[cut:]
+    if pending:
+        yield pending
+
+
+def _split_words(sentence: str, chunk_size: int, measure: Measure) -> Iterator[Tuple[str, int]]:
+    words, size = [], 0
+    for word in sentence.split(" "):
+        word_size = measure(word)
+        if word_size > chunk_size:
+            # No spaces to split on (URLs, base64): cut by characters in proportion
+            if words:
+                yield " ".join(words), size
+                words, size = [], 0
+            step = max(1, len(word) * chunk_size // word_size)
+            for start in range(0, len(word), step):
+                part = word[start:start + step]
+                yield part, measure(part)
+            continue
+        cost = word_size + (1 if words else 0)
+        if words and size + cost > chunk_size:
+            yield " ".join(words), size
+            words, size, cost = [], 0, word_size
+        words.append(word)
+        size += cost
+    if words:
+        yield " ".join(words), size
+
+
+def _segments(paragraph: str, chunk_size: int, measure: Measure) -> Iterator[Tuple[str, int]]:
+    """(text, size) units no bigger than a chunk: the paragraph, its sentences or their words"""
+    paragraph = " ".join(paragraph.split())
+    if not paragraph:
+        return
+    size = measure(paragraph)
+    if size <= chunk_size:
+        yield paragraph, size
+        return
+    for sentence in SENTENCE_END.split(paragraph):
+        size = measure(sentence)
+        if size <= chunk_size:
+            yield sentence, size
+        else:
+            yield from _split_words(sentence, chunk_size, measure)
+
+
+def _overlap_tail(window: deque, overlap: int, measure: Measure) -> list:
+    """Trailing segments of a finished chunk that fit in `overlap` (sentence-level for the last one)"""
+    tail, total = [], 0
+    for segment, size in reversed(window):
+        cost = size + (1 if tail else 0)
+        if total + cost <= overlap:
+            tail.append((segment, size))
+            total += cost
+            continue
+        # Segment too big to carry whole: carry its last sentences that fit
+        for sentence in reversed(SENTENCE_END.split(segment)):
+            sentence_size = measure(sentence)
+            cost = sentence_size + (1 if tail else 0)
+            if total + cost > overlap:
+                break
+            tail.append((sentence, sentence_size))
+            total += cost
+        break
+    tail.reverse()
+    return tail
+
+
+def iter_chunks(
+    pieces: Union[str, Iterable[str]],
+    chunk_size: int = 1500,
+    overlap: int = 200,
+    measure: Measure = len,
+) -> Iterator[str]:
+    """Chunks of at most chunk_size (by `measure`) from text given whole or in pieces"""
+    if isinstance(pieces, str):
+        pieces = (pieces,)
+    overlap = min(overlap, chunk_size // 2)
+    window: deque = deque()  # (segment, size) of the chunk being built
+    total = 0  # Sizes plus one per separator
+    fresh = False  # Anything beyond the carried-over overlap
+
+    for paragraph in iter_paragraphs(pieces):
+        for segment, size in _segments(paragraph, chunk_size, measure):
+            if window and total + size + 1 > chunk_size:
+                if fresh:
+                    chunk = " ".join(text for text, _ in window)
+                    if len(chunk) > MIN_CHUNK_CHARS:
+                        yield chunk
+                window = deque(_overlap_tail(window, overlap, measure))
+                total = sum(s for _, s in window) + max(0, len(window) - 1)
+                while window and total + size + 1 > chunk_size:
+                    total -= window.popleft()[1] + (1 if window else 0)
+                fresh = False
+            total += size + (1 if window else 0)
+            window.append((segment, size))
+            fresh = True
+
+    if window and fresh:
+        chunk = " ".join(text for text, _ in window)
+        if len(chunk) > MIN_CHUNK_CHARS:
+            yield chunk
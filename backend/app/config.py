@@ -19,7 +19,150 @@ class Settings(BaseSettings):
     
     # API Keys
     xai_api_key: str = ""
-    
+
+    # Shared upstream HTTP pool (all xAI calls go through one keep-alive client per process)
+    xai_http_timeout: float = 30.0
+    xai_http_connect_timeout: float = 5.0
+    xai_http_max_connections: int = 100
+    xai_http_max_keepalive_connections: int = 20
+    xai_http_keepalive_expiry: float = 60.0
+
+    # TTS delivery: "deferred" returns chat text at once and synthesizes in the background
+    # (widget fetches /api/tts/{job_id}); "inline" embeds a base64 WAV; "none" disables voice.
+    # Deferred needs a long-lived server process: without app startup (Mangum/Vercel) it
+    # synthesizes inline
+    tts_audio_mode: str = "deferred"
+    tts_job_ttl_seconds: int = 300
+    tts_job_max_jobs: int = 500
+    tts_job_max_wait_seconds: float = 30.0
+    # Voice reply encoding when neither the request nor the client config picks one:
+    # pcm_24k | pcm_16k | pcm_8k | mulaw_24k | mulaw_16k | mulaw_8k | adpcm_24k | adpcm_16k | adpcm_8k
+    tts_audio_format: str = "pcm_24k"
+    # Ephemeral voice tokens are cached per API key; never hand out one with less than
+    # the margin left, and refresh in the background once inside the refresh-ahead window
+    tts_token_default_ttl_seconds: int = 300
+    tts_token_expiry_margin_seconds: int = 15
+    tts_token_refresh_ahead_seconds: int = 60
+
+    # TTS audio cache: identical (voice, text) replies are synthesized once
+    tts_cache_enabled: bool = True
+    tts_cache_memory_bytes: int = 64 * 1024 * 1024
+    tts_cache_directory: str = "./tts_cache"
+    tts_cache_ttl_seconds: int = 7 * 24 * 3600
+
+    # Realtime voice sessions are kept open and reused per (API key, voice); a session is
+    # retired after max_age / max_uses so its conversation history stays short
+    tts_session_pool_enabled: bool = True
+    tts_session_max_sessions: int = 8
+    tts_session_idle_timeout_seconds: int = 120
+    tts_session_max_age_seconds: int = 600
+    tts_session_max_uses: int = 25
+    tts_session_acquire_timeout_seconds: float = 10.0
+    tts_session_health_check_after_seconds: float = 30.0
+
+    # Semantic answer cache: a message this similar (cosine) to a cached question of the
+    # same client reuses its answer instead of calling the LLM
+    answer_cache_enabled: bool = True
+    answer_cache_similarity_threshold: float = 0.92
+    answer_cache_ttl_seconds: int = 24 * 3600
+    answer_cache_max_entries: int = 2000  # Per client
+    answer_cache_max_question_chars: int = 500
+
+    # FAQ fast path: answer straight from the client's FAQ table when a message matches a
+    # FAQ question this well, by word overlap (Jaccard) or by embedding cosine similarity
+    faq_fast_path_enabled: bool = True
+    faq_lexical_threshold: float = 0.8
+    faq_semantic_threshold: float = 0.88
+    faq_index_ttl_seconds: int = 60  # Reload from Chroma so other workers' FAQ edits show up
+
+    # Tenant gate cache: compiled client/config/subscription checks for chat and widget
+    # config. Invalidated on config and Stripe changes in this worker; the TTL bounds
+    # staleness across workers. Unknown client ids are cached for the shorter TTL.
+    tenant_gate_cache_enabled: bool = True
+    tenant_gate_ttl_seconds: float = 30.0
+    tenant_gate_negative_ttl_seconds: float = 5.0
+    tenant_gate_max_entries: int = 10000
+
+    # Public widget config caching: browsers/CDNs revalidate with If-None-Match (304s skip
+    # the body). WIDGET_CONFIG_SNAPSHOT_DIR, when set, also gets <client_id>.json on every
+    # config change for static/CDN serving (only clients without a domain allowlist)
+    widget_config_max_age_seconds: int = 60
+    widget_config_stale_while_revalidate_seconds: int = 600
+    widget_config_snapshot_dir: str = ""
+
+    # Usage accounting: chat turns accumulate in memory and are upserted in one batch
+    # this often (and on shutdown); /api/usage adds this worker's unflushed counts
+    usage_flush_interval_seconds: float = 5.0
+
+    # Conversation logging: turns are queued and bulk-inserted by a background writer.
+    # When the queue is full, "drop" discards the turn and "block" waits up to the
+    # timeout for room (then drops); queue depth and drops are in /healthz/metrics
+    conversation_log_queue_size: int = 10000
+    conversation_log_batch_size: int = 500
+    conversation_log_full_policy: str = "drop"  # drop | block
+    conversation_log_block_timeout_seconds: float = 1.0
+
+    # Multi-turn chat: the last N messages of a conversation are sent verbatim, older turns
+    # are folded into a rolling summary of at most this many characters
+    conversation_history_max_messages: int = 8
+    conversation_summary_max_chars: int = 1200
+    conversation_memory_max_conversations: int = 5000  # Per worker
+    conversation_memory_ttl_seconds: int = 1800  # Idle conversations are reloaded from the DB
+
+    # Prompt budget: chat prompts (system prompt, summary, history, RAG chunks, message) are
+    # packed into this many tokens, counted with tiktoken. Per-model overrides as JSON,
+    # e.g. PROMPT_TOKEN_BUDGETS='{"grok-4-1-fast-non-reasoning": 8000}'
+    prompt_token_budget: int = 6000
+    prompt_token_budgets: dict[str, int] = {}
+    prompt_tokenizer_encoding: str = "cl100k_base"
+    chat_max_reply_tokens: int = 500
+
+    # Rate limiting: per-IP route limits (slowapi) and the per-client chat limit share one
+    # store. Set RATE_LIMIT_STORAGE_URI (or REDIS_URL), e.g. redis://redis:6379/0, so limits
+    # hold across workers; the default keeps counters per process
+    redis_url: str = ""
+    rate_limit_storage_uri: str = ""
+    rate_limit_strategy: str = "sliding-window-counter"  # or fixed-window, moving-window
+    chat_rate_limit_per_client: str = "120/minute"
+
+    # Blocking work runs on separately sized pools (see app/executors.py): Chroma and
+    # embeddings, document extraction (processes unless disabled) and SDK calls
+    vector_executor_workers: int = 8
+    extraction_executor_workers: int = 2
+    extraction_executor_processes: bool = True
+    sdk_executor_workers: int = 8
+
+    # Dashboard auth: resolved API keys (key hash -> client) are cached per worker; rotated
+    # keys are dropped immediately on this worker. On other workers, write endpoints reject a
+    # rotated key on the next request (they reload the client row and compare its key hash);
+    # read-only endpoints serve a cached snapshot without a query and can accept a rotated or
+    # deactivated key for up to API_KEY_CACHE_SNAPSHOT_TTL_SECONDS
+    api_key_cache_ttl_seconds: float = 30.0
+    api_key_cache_snapshot_ttl_seconds: float = 5.0
+    api_key_cache_max_entries: int = 10000
+
+    # Document ingestion: uploads are stored under INGESTION_UPLOAD_DIR and queued in
+    # ingestion_jobs. With more than one host the directory must be shared storage that every
+    # host mounts (like the Chroma directory); a job whose file is missing on the host that
+    # claims it is retried. Each process runs this many ingestion workers (0 = enqueue only;
+    # without app startup, e.g. Mangum, a nonzero value makes uploads process inline); failed
+    # jobs retry with exponential backoff, and a running job without a heartbeat for
+    # INGESTION_STALE_AFTER_SECONDS is picked up again
+    ingestion_upload_dir: str = "./uploads"
+    ingestion_workers: int = 2
+    ingestion_max_attempts: int = 5
+    ingestion_retry_base_seconds: float = 10.0
+    ingestion_retry_max_seconds: float = 600.0
+    ingestion_heartbeat_seconds: float = 15.0
+    ingestion_stale_after_seconds: float = 120.0
+    ingestion_poll_interval_seconds: float = 10.0  # Fallback when LISTEN/NOTIFY is unavailable
+
+    # Document chunking: size and overlap in CHUNK_SIZE_UNIT ("chars", or "tokens" counted
+    # with the prompt tokenizer, e.g. CHUNK_SIZE=350 CHUNK_OVERLAP=50)
+    chunk_size_unit: str = "chars"
+    chunk_size: int = 1500
+    chunk_overlap: int = 200
+
     # Stripe
     stripe_secret_key: str = ""
     stripe_webhook_secret: str = ""
@@ -43,6 +186,18 @@ class Settings(BaseSettings):
     
     # ChromaDB
     chroma_persist_directory: str = "./chroma_data"
+
+    # Embeddings (see app/embeddings.py): a sentence-transformers model, loaded from
+    # EMBEDDING_MODEL_DIR when set (no download; hosts without egress), else by name
+    # from the Hugging Face cache. Documents are encoded EMBEDDING_BATCH_SIZE texts at a
+    # time on EMBEDDING_THREADS torch threads (0 = torch's default). Document embeddings
+    # are cached in SQLite at EMBEDDING_CACHE_PATH, keyed by model and text hash (empty
+    # disables); put it on the same volume as CHROMA_PERSIST_DIRECTORY
+    embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"
+    embedding_model_dir: str = ""
+    embedding_batch_size: int = 32
+    embedding_threads: int = 0
+    embedding_cache_path: str = "./embedding_cache.sqlite3"
     
     # White-label URLs in snippet (no Railway in data-api-url). Override with env if needed.
     # widget_cdn_url default kept so existing installs keep working; set WIDGET_CDN_URL for white-label.
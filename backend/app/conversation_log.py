@@ -0,0 +1,192 @@
+"""
+Asynchronous conversation logging
+Chat turns are put on a bounded in-process queue and a writer task stores
+them in batches: one multi-row INSERT for the conversations and one for their
+messages, so logging adds nothing to the visitor-facing response time.
+
+Conversation ids are generated in process (follow-up turns reuse theirs, and
+the conversation row is upserted), so a turn can be queued without a flush.
+When the queue is full the configured policy applies: "drop" discards the turn
+at once, "block" waits up to CONVERSATION_LOG_BLOCK_TIMEOUT_SECONDS for room
+and then drops it.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+from uuid import UUID
+
+from .config import get_settings
+
+settings = get_settings()
+
+
+class ChatTurn:
+    """One visitor message and the assistant's reply, waiting to be written"""
+
+    __slots__ = ("conversation_id", "client_id", "user_message", "response_text", "created_at")
+
+    def __init__(self, client_id: UUID, user_message: str, response_text: str, conversation_id: Optional[UUID] = None):
+        self.conversation_id = conversation_id or uuid.uuid4()
+        self.client_id = client_id
+        self.user_message = user_message
+        self.response_text = response_text
+        self.created_at = datetime.utcnow()
+
+
+def write_turns(turns: List[ChatTurn]):
+    """Bulk-insert a batch of turns in one transaction (blocking)"""
+    from sqlalchemy.dialects.postgresql import insert
+    from .database import engine
+    from .models import Conversation, ConversationMessage
+
+    # One row per conversation: a batch can hold several turns of the same chat
+    conversations = {}
+    messages = []
+    for turn in turns:
+        row = conversations.get(turn.conversation_id)
+        if row is None:
+            conversations[turn.conversation_id] = {
+                "id": turn.conversation_id,
+                "client_id": turn.client_id,
+                "started_at": turn.created_at,
+                "last_message_at": turn.created_at,
+                "message_count": 2,  # User + assistant
+            }
+        else:
+            row["last_message_at"] = turn.created_at
+            row["message_count"] += 2
+        # Messages are ordered by created_at; keep the reply after the question
+        messages.append({
+            "id": uuid.uuid4(),
+            "conversation_id": turn.conversation_id,
+            "role": "user",
+            "content": turn.user_message,
+            "created_at": turn.created_at,
+        })
+        messages.append({
+            "id": uuid.uuid4(),
+            "conversation_id": turn.conversation_id,
+            "role": "assistant",
+            "content": turn.response_text,
+            "created_at": turn.created_at + timedelta(microseconds=1),
+        })
+
+    # Follow-up turns of an existing conversation add to its row
+    table = Conversation.__table__
+    statement = insert(table).values(list(conversations.values()))
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={
+            "message_count": table.c.message_count + statement.excluded.message_count,
+            "last_message_at": statement.excluded.last_message_at,
+        },
+    )
+    with engine.begin() as conn:
+        conn.execute(statement)
+        conn.execute(ConversationMessage.__table__.insert().values(messages))
+
+
+class ConversationLogWriter:
+    """Bounded queue of chat turns drained by a single batching writer task"""
+
+    def __init__(self, max_queue: int, batch_size: int, full_policy: str, block_timeout: float):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    def _running(self) -> bool:
+        if self._task is None or self._task.done():
+            return False
+        try:
+            return self._task.get_loop() is asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+    async def log(self, turn: ChatTurn):
+        """Queue a turn for the writer (or write it inline if the writer isn't running)"""
+        if not self._running():
+            # No writer on this loop (e.g. scripts and tests without app startup)
+            await asyncio.to_thread(self._write, [turn])
+            return
+        try:
+            self._queue.put_nowait(turn)
+        except asyncio.QueueFull:
+            if self.full_policy != "block":
+                self.dropped += 1
+                return
+            try:
+                await asyncio.wait_for(self._queue.put(turn), timeout=self.block_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                return
+        self.enqueued += 1
+
+    def _write(self, turns: List[ChatTurn]):
+        try:
+            write_turns(turns)
+            self.written += len(turns)
+            self.batches += 1
+        except Exception as e:
+            # Don't fail chat if conversation logging fails
+            self.failed_batches += 1
+            self.dropped += len(turns)
+            print(f"[Conversation] Failed to store {len(turns)} conversation(s): {e}")
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            await asyncio.to_thread(self._write, batch)
+
+    def start(self):
+        """Start the writer task (app startup)"""
+        if not self._running():
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the writer and store whatever is still queued (app shutdown)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        for start in range(0, len(remaining), self.batch_size):
+            await asyncio.to_thread(self._write, remaining[start:start + self.batch_size])
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "policy": self.full_policy,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+        }
+
+
+conversation_log = ConversationLogWriter(
+    max_queue=settings.conversation_log_queue_size,
+    batch_size=settings.conversation_log_batch_size,
+    full_policy=settings.conversation_log_full_policy,
+    block_timeout=settings.conversation_log_block_timeout_seconds,
+)
@@ -0,0 +1,223 @@
+"""
+Multi-turn conversation memory
+A chat request may carry a conversation_id; its recent messages are kept in an
+in-process LRU so follow-up turns don't re-read conversation_messages. Only the
+last CONVERSATION_HISTORY_MAX_MESSAGES messages are sent verbatim. Older turns
+are folded into a rolling summary in the background (by the LLM, with an
+extractive fallback), so prompt size stays bounded however long a chat runs.
+The summary is saved on the conversation row when a compaction finishes, so a
+conversation reloaded after eviction, a restart or on another worker resumes
+from it rather than from its last few messages alone.
+
+A conversation id that is unknown or belongs to another client starts a new
+conversation; the id actually used is returned to the widget.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+from uuid import UUID
+
+from .config import get_settings
+
+settings = get_settings()
+
+# (summary, messages to fold in) -> new summary
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+
+
+class ConversationMemory:
+    """Rolling summary plus the most recent messages of one conversation"""
+
+    __slots__ = ("conversation_id", "client_id", "summary", "summarized", "recent", "last_used", "compacting")
+
+    def __init__(self, conversation_id: UUID, client_id: UUID, summary: str = "", recent: Optional[List[dict]] = None,
+                 summarized: int = 0):
+        self.conversation_id = conversation_id
+        self.client_id = client_id
+        self.summary = summary
+        self.summarized = summarized  # Messages (oldest first) the summary covers
+        self.recent = recent or []
+        self.last_used = time.monotonic()
+        self.compacting = False
+
+    def has_history(self) -> bool:
+        return bool(self.summary or self.recent)
+
+    def prompt_messages(self) -> List[dict]:
+        """Verbatim history for the chat payload (the summary goes in the system prompt)"""
+        return [{"role": m["role"], "content": m["content"]} for m in self.recent]
+
+
+def extractive_summary(summary: str, messages: List[dict]) -> str:
+    """LLM-free fallback: keep the start of each older message, newest last, within the cap"""
+    lines = [summary] if summary else []
+    for m in messages:
+        text = " ".join(m["content"].split())
+        lines.append(f"{m['role']}: {text[:160]}{'...' if len(text) > 160 else ''}")
+    combined = "\n".join(lines)
+    cap = settings.conversation_summary_max_chars
+    return combined if len(combined) <= cap else "..." + combined[-cap:]
+
+
+def save_summary(memory: ConversationMemory):
+    """Store a conversation's summary on its row (blocking); the row may not be logged yet"""
+    from sqlalchemy.dialects.postgresql import insert
+    from .database import engine
+    from .models import Conversation
+
+    table = Conversation.__table__
+    statement = insert(table).values(
+        id=memory.conversation_id,
+        client_id=memory.client_id,
+        message_count=0,  # The log writer adds the messages
+        summary=memory.summary,
+        summarized_messages=memory.summarized,
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={"summary": statement.excluded.summary, "summarized_messages": statement.excluded.summarized_messages},
+        where=table.c.summarized_messages < statement.excluded.summarized_messages,  # Never go back to an older one
+    )
+    with engine.begin() as conn:
+        conn.execute(statement)
+
+
+class ConversationStore:
+    """LRU of conversation memories with an idle TTL"""
+
+    def __init__(self, max_conversations: int, ttl_seconds: float):
+        self.max_conversations = max_conversations
+        self.ttl_seconds = ttl_seconds
+        self._memories: "OrderedDict[str, ConversationMemory]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.created = 0
+        self.compactions = 0
+        self.summary_fallbacks = 0
+
+    def _get(self, conversation_id: UUID) -> Optional[ConversationMemory]:
+        key = str(conversation_id)
+        with self._lock:
+            memory = self._memories.get(key)
+            if memory is None:
+                return None
+            if time.monotonic() - memory.last_used > self.ttl_seconds:
+                del self._memories[key]
+                return None
+            self._memories.move_to_end(key)
+            return memory
+
+    def _put(self, memory: ConversationMemory):
+        with self._lock:
+            self._memories[str(memory.conversation_id)] = memory
+            self._memories.move_to_end(str(memory.conversation_id))
+            while len(self._memories) > self.max_conversations:
+                self._memories.popitem(last=False)
+
+    async def _load(self, db, client_id: UUID, conversation_id: UUID) -> Optional[ConversationMemory]:
+        """Rebuild a conversation from the database (other worker, restart or evicted)"""
+        from sqlalchemy import select
+        from .models import Conversation, ConversationMessage
+
+        row = (await db.execute(select(
+            Conversation.message_count, Conversation.summary, Conversation.summarized_messages
+        ).where(
+            Conversation.id == conversation_id,
+            Conversation.client_id == client_id
+        ))).first()
+        if not row:
+            return None
+        # Resume from the saved summary; only messages it doesn't cover are read
+        summary, summarized = row.summary or "", row.summarized_messages or 0
+        unsummarized = max(0, row.message_count - summarized)
+        window = settings.conversation_history_max_messages
+        rows = []
+        if unsummarized:
+            rows = (await db.execute(select(ConversationMessage.role, ConversationMessage.content).where(
+                ConversationMessage.conversation_id == conversation_id
+            ).order_by(ConversationMessage.created_at.desc()).limit(min(window * 2, unsummarized)))).all()
+        messages = [{"role": role, "content": content} for role, content in reversed(rows)]
+        older, recent = messages[:-window], messages[-window:]
+        if older:
+            summary = extractive_summary(summary, older)
+        # Anything between the saved summary and the rows read is skipped
+        return ConversationMemory(conversation_id, client_id, summary, recent, max(summarized, row.message_count - len(recent)))
+
+    async def open(self, db, client_id: UUID, conversation_id: Optional[UUID]) -> ConversationMemory:
+        """The conversation to append this turn to (a new one unless a valid id was given; db is an AsyncSession)"""
+        if conversation_id is not None:
+            memory = self._get(conversation_id)
+            if memory is not None and memory.client_id == client_id:
+                memory.last_used = time.monotonic()
+                self.hits += 1
+                return memory
+            if memory is None:
+                memory = await self._load(db, client_id, conversation_id)
+                if memory is not None:
+                    self.loads += 1
+                    self._put(memory)
+                    return memory
+        self.created += 1
+        memory = ConversationMemory(uuid.uuid4(), client_id)
+        self._put(memory)
+        return memory
+
+    def remember(self, memory: ConversationMemory, user_message: str, response_text: str, summarize: Optional[Summarizer] = None):
+        """Append a finished turn; start a compaction once the window overflows"""
+        memory.recent.append({"role": "user", "content": user_message})
+        memory.recent.append({"role": "assistant", "content": response_text})
+        memory.last_used = time.monotonic()
+        if len(memory.recent) > settings.conversation_history_max_messages and not memory.compacting:
+            memory.compacting = True
+            asyncio.get_running_loop().create_task(self._compact(memory, summarize))
+
+    async def _compact(self, memory: ConversationMemory, summarize: Optional[Summarizer]):
+        """Fold everything but the newest window into the summary (off the request path)"""
+        try:
+            # Fold whole turns so the window always starts with a user message
+            overflow = len(memory.recent) - settings.conversation_history_max_messages
+            count = overflow + (overflow % 2)
+            older = memory.recent[:count]
+            summary = None
+            if summarize is not None:
+                try:
+                    summary = (await summarize(memory.summary, older)).strip()
+                except Exception as e:
+                    print(f"[Conversation] Summary failed, using extractive fallback: {e}")
+            if summary:
+                cap = settings.conversation_summary_max_chars
+                summary = summary if len(summary) <= cap else summary[:cap] + "..."
+            else:
+                self.summary_fallbacks += 1
+                summary = extractive_summary(memory.summary, older)
+            # Only appends happened meanwhile, so the first `count` messages are the ones summarized
+            memory.summary = summary
+            memory.summarized += count
+            del memory.recent[:count]
+            self.compactions += 1
+        finally:
+            memory.compacting = False
+        try:
+            await asyncio.to_thread(save_summary, memory)
+        except Exception as e:
+            print(f"[Conversation] Failed to save summary (non-fatal): {e}")
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._memories),
+            "hits": self.hits,
+            "loads": self.loads,
+            "created": self.created,
+            "compactions": self.compactions,
+            "summary_fallbacks": self.summary_fallbacks,
+        }
+
+
+conversation_store = ConversationStore(
+    max_conversations=settings.conversation_memory_max_conversations,
+    ttl_seconds=settings.conversation_memory_ttl_seconds,
+)
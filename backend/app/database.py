@@ -1,7 +1,15 @@
 """
 Database connection and session management
+Synchronous engine/sessions (psycopg2) for dashboard writes, migrations and
+background work; an asyncpg engine/sessions for the request hot paths (chat,
+widget config, API-key auth, usage) so queries don't block the event loop.
 """
+import asyncio
+import weakref
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
 from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import get_settings
@@ -30,6 +38,55 @@ def get_db():
         db.close()
 
 
+def async_database_url(url: str) -> str:
+    """DATABASE_URL for the asyncpg driver (libpq's sslmode becomes asyncpg's ssl)"""
+    parts = urlsplit(url)
+    scheme = parts.scheme.split("+", 1)[0]
+    if scheme in ("postgres", "postgresql"):
+        scheme = "postgresql+asyncpg"
+    query = [("ssl" if k == "sslmode" else k, v) for k, v in parse_qsl(parts.query)]
+    return urlunsplit((scheme, parts.netloc, parts.path, urlencode(query), parts.fragment))
+
+
+# asyncpg connections belong to the event loop that opened them, so each loop gets its
+# own engine (the server runs one loop; test clients may start several)
+_async_engines: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def get_async_engine():
+    loop = asyncio.get_running_loop()
+    async_engine = _async_engines.get(loop)
+    if async_engine is None:
+        async_engine = create_async_engine(
+            async_database_url(settings.database_url),
+            pool_pre_ping=True,
+            pool_size=10,
+            max_overflow=20
+        )
+        _async_engines[loop] = async_engine
+    return async_engine
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    return AsyncSession(bind=get_async_engine(), expire_on_commit=False, autoflush=False)
+
+
+async def get_async_db():
+    """Dependency for getting async database sessions (hot paths)"""
+    db = AsyncSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+async def dispose_async_engine():
+    """Close this loop's async connection pool (app shutdown)"""
+    async_engine = _async_engines.pop(asyncio.get_running_loop(), None)
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
 def init_db():
     """Initialize database tables and run migrations"""
     # Create all tables first - this will create tables with all columns defined in models
@@ -127,6 +184,69 @@ def init_db():
                     END IF;
                 END $$;
             """
+        },
+        {
+            "name": "TTS audio format column",
+            "sql": """
+                DO $$ 
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns 
+                                   WHERE table_name = 'client_configs' AND column_name = 'tts_audio_format') THEN
+                        ALTER TABLE client_configs ADD COLUMN tts_audio_format VARCHAR(20) NULL;
+                    END IF;
+                END $$;
+            """
+        },
+        {
+            "name": "Usage records unique (client_id, date)",
+            "sql": """
+                DO $$ 
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM pg_indexes 
+                                   WHERE tablename = 'usage_records' AND indexname = 'uq_usage_records_client_date') THEN
+                        -- Fold duplicate rows (from the old read-then-insert race) into one per day
+                        UPDATE usage_records u
+                        SET message_count = d.message_count, token_count = d.token_count, rag_query_count = d.rag_query_count
+                        FROM (
+                            SELECT client_id, date, MIN(id::text) AS keep_id,
+                                   SUM(message_count) AS message_count, SUM(token_count) AS token_count,
+                                   SUM(rag_query_count) AS rag_query_count
+                            FROM usage_records GROUP BY client_id, date HAVING COUNT(*) > 1
+                        ) d
+                        WHERE u.id::text = d.keep_id;
+                        DELETE FROM usage_records a USING usage_records b
+                        WHERE a.client_id = b.client_id AND a.date = b.date AND a.id::text > b.id::text;
+                        CREATE UNIQUE INDEX uq_usage_records_client_date ON usage_records (client_id, date);
+                    END IF;
+                END $$;
+            """
+        },
+        {
+            "name": "Clients api_key_hash index",
+            "sql": """
+                CREATE INDEX IF NOT EXISTS ix_clients_api_key_hash ON clients (api_key_hash);
+            """
+        },
+        {
+            "name": "Document ingestion progress columns",
+            "sql": """
+                ALTER TABLE documents ADD COLUMN IF NOT EXISTS progress_stage VARCHAR(50) NULL;
+                ALTER TABLE documents ADD COLUMN IF NOT EXISTS progress_percent INTEGER NOT NULL DEFAULT 0;
+            """
+        },
+        {
+            "name": "Document content hash",
+            "sql": """
+                ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64) NULL;
+                CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents (content_hash);
+            """
+        },
+        {
+            "name": "Conversation summary columns",
+            "sql": """
+                ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary TEXT NULL;
+                ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summarized_messages INTEGER NOT NULL DEFAULT 0;
+            """
         }
     ]
     
@@ -0,0 +1,222 @@
+"""
+Embedding engine
+Every embedding (document chunks, FAQ questions, chat messages) comes from one
+sentence-transformers model instead of Chroma's implicit default embedder, so
+batch size and threads are ours to set and nothing is fetched at runtime when
+EMBEDDING_MODEL_DIR points at a local copy of the model:
+
+- document texts are encoded EMBEDDING_BATCH_SIZE at a time, one batch at a
+  time per process, each on EMBEDDING_THREADS torch threads; a chat message is
+  encoded on its own and never waits behind an ingestion batch
+- document embeddings are cached on disk (SQLite, EMBEDDING_CACHE_PATH) keyed
+  by (model, SHA-256 of the text), so a text is only ever encoded once per model
+- if the model cannot be loaded, embedding fails (loudly) rather than quietly
+  switching models; only the default model, with no EMBEDDING_MODEL_DIR, may
+  fall back to Chroma's ONNX build of it (downloaded on first use), and its
+  vectors are cached under their own key
+
+All calls block; run them on executors.vector_pool. Reported under
+"embeddings" in /healthz/metrics.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .config import get_settings
+
+settings = get_settings()
+
+# Hashes per SQLite IN (...) lookup (older SQLite builds allow 999 variables)
+CACHE_LOOKUP_BATCH = 500
+
+# The model Chroma's ONNX embedder builds; the only one it may stand in for
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Embeddings on disk (SQLite), keyed by model and text hash"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")  # Other app processes read while one writes
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+            )
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(hashes), CACHE_LOOKUP_BATCH):
+                batch = hashes[start:start + CACHE_LOOKUP_BATCH]
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        self.hits += len(found)
+        self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, Sequence[float]]):
+        rows = [(model, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()]
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+        self.writes += len(rows)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+class EmbeddingEngine:
+    """Batched sentence-transformers encoder with an optional on-disk cache"""
+
+    def __init__(self, model: str, model_dir: str = "", batch_size: int = 32, threads: int = 0,
+                 cache: Optional[EmbeddingCache] = None):
+        self.model = model
+        self.model_dir = model_dir
+        self.batch_size = max(1, batch_size)
+        self.threads = threads
+        self.cache = cache
+        self.backend: Optional[str] = None
+        self.cache_model = model  # Cache key: the model whose vectors are actually produced
+        self._encode: Optional[Callable[[List[str]], np.ndarray]] = None
+        self._load_lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+        self.texts = 0
+        self.encoded = 0
+        self.batches = 0
+        self.encode_seconds = 0.0
+
+    def _load_encoder(self) -> Callable[[List[str]], np.ndarray]:
+        try:
+            from sentence_transformers import SentenceTransformer
+            import torch
+            if self.threads > 0:
+                torch.set_num_threads(self.threads)
+            model = SentenceTransformer(self.model_dir or self.model, device="cpu")
+            self.backend = "sentence-transformers"
+            print(f"[Embeddings] Loaded {self.model_dir or self.model} ({torch.get_num_threads()} threads)")
+            return lambda texts: model.encode(
+                texts, batch_size=len(texts), normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False
+            )
+        except Exception as e:
+            if self.model_dir or self.model != DEFAULT_MODEL:
+                print(f"[Embeddings] Failed to load {self.model_dir or self.model}: {e}")
+                raise RuntimeError(f"Embedding model {self.model_dir or self.model} could not be loaded") from e
+            print(f"[Embeddings] sentence-transformers unavailable, using Chroma's ONNX build of {self.model}: {e}")
+            from chromadb.utils import embedding_functions
+            onnx = embedding_functions.DefaultEmbeddingFunction()
+            self.backend = "onnx"
+            self.cache_model = f"onnx:{self.model}"
+            return lambda texts: np.asarray(onnx(texts), dtype=np.float32)
+
+    def _encoder(self) -> Callable[[List[str]], np.ndarray]:
+        if self._encode is None:
+            with self._load_lock:
+                if self._encode is None:
+                    self._encode = self._load_encoder()
+        return self._encode
+
+    def warm(self):
+        """Load the model ahead of the first request (blocking)"""
+        self._encoder()
+
+    def _run(self, texts: List[str]) -> List[List[float]]:
+        encode = self._encoder()
+        started = time.perf_counter()
+        vectors = encode(texts)
+        self.encode_seconds += time.perf_counter() - started
+        self.encoded += len(texts)
+        self.batches += 1
+        return [[float(x) for x in vector] for vector in vectors]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embeddings of document texts: cached ones from disk, the rest encoded in batches and cached"""
+        self.texts += len(texts)
+        self._encoder()  # Settles cache_model before the cache is read
+        hashes = [text_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.cache_model, list(dict.fromkeys(hashes))) if self.cache else {}
+        pending = list({key: text for key, text in zip(hashes, texts) if key not in vectors}.items())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            with self._batch_lock:  # One batch at a time: EMBEDDING_THREADS is the whole budget
+                encoded = dict(zip((key for key, _ in batch), self._run([text for _, text in batch])))
+            if self.cache:
+                self.cache.put_many(self.cache_model, encoded)
+            vectors.update(encoded)
+        return [vectors[key] for key in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embedding of one chat message (not cached; not queued behind document batches)"""
+        self.texts += 1
+        return self._run([text])[0]
+
+    def close(self):
+        if self.cache:
+            self.cache.close()
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_dir or self.model,
+            "backend": self.backend,
+            "batch_size": self.batch_size,
+            "threads": self.threads,
+            "texts": self.texts,
+            "encoded": self.encoded,
+            "batches": self.batches,
+            "texts_per_second": round(self.encoded / self.encode_seconds, 1) if self.encode_seconds else None,
+            "cache": self.cache.stats() if self.cache else None,
+        }
+
+
+embedding_engine = EmbeddingEngine(
+    settings.embedding_model,
+    settings.embedding_model_dir,
+    settings.embedding_batch_size,
+    settings.embedding_threads,
+    EmbeddingCache(settings.embedding_cache_path) if settings.embedding_cache_path else None,
+)
+
+
+def stats() -> dict:
+    return embedding_engine.stats()
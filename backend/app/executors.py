@@ -0,0 +1,126 @@
+"""
+Executors for blocking work
+Async handlers must not call blocking code directly: one PDF extraction or
+Stripe round-trip would stall chat for every tenant on the worker. Blocking
+calls go to one of three separately sized pools so each kind of work can only
+exhaust its own workers:
+
+- vector_pool: Chroma queries/writes and embeddings (threads; the heavy parts
+  release the GIL)
+- extraction_pool: document text extraction and chunking (processes, CPU bound;
+  EXTRACTION_EXECUTOR_PROCESSES=false switches to threads)
+- sdk_pool: outbound SDK calls (Stripe, email)
+
+Each pool counts in-flight calls; saturation is in_flight / workers, so a value
+above 1 means calls are queueing. Reported under "executors" in /healthz/metrics.
+"""
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .config import get_settings
+
+settings = get_settings()
+
+
+class BlockingPool:
+    """A named executor with in-flight and latency counters"""
+
+    def __init__(self, name: str, max_workers: int, processes: bool = False):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.processes = processes
+        self._executor = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _get_executor(self):
+        # Created on first use so importing the app doesn't start workers
+        with self._lock:
+            if self._executor is None:
+                if self.processes:
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on this pool (fn and args must pickle for process pools)"""
+        executor = self._get_executor()
+        call = functools.partial(fn, *args, **kwargs) if kwargs else functools.partial(fn, *args)
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.monotonic()
+        ok = False
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(executor, call)
+            ok = True
+            return result
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault in a parser); start a fresh pool for the next call
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            print(f"[Executors] {self.name} process pool broken, restarting")
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.in_flight -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        calls = self.completed + self.failed
+        return {
+            "kind": "process" if self.processes else "thread",
+            "workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.max_workers),
+            "saturation": round(self.in_flight / self.max_workers, 2),
+            "peak_in_flight": self.peak_in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_ms": round(self.total_seconds / calls * 1000, 1) if calls else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 1),
+        }
+
+
+vector_pool = BlockingPool("vector", settings.vector_executor_workers)
+extraction_pool = BlockingPool(
+    "extraction",
+    settings.extraction_executor_workers,
+    processes=settings.extraction_executor_processes,
+)
+sdk_pool = BlockingPool("sdk", settings.sdk_executor_workers)
+
+_pools = (vector_pool, extraction_pool, sdk_pool)
+
+
+def shutdown_executors():
+    for pool in _pools:
+        pool.shutdown()
+
+
+def stats() -> dict:
+    return {pool.name: pool.stats() for pool in _pools}
@@ -0,0 +1,220 @@
+"""
+FAQ fast path
+Tenants write exact answers in the FAQ table; a chat message that clearly asks
+one of those questions is answered from it directly, with no LLM call.
+
+Each client's FAQ questions are embedded into a Chroma collection (kept in step
+with /api/faqs create/update/delete, backfilled from the table on first use).
+Matching runs in memory: an exact/lexical score over question tokens plus the
+cosine similarity of the chat message's embedding, so a lookup takes well
+under a millisecond once the client's index is loaded.
+"""
+import re
+import time
+import unicodedata
+from typing import List, Optional
+from uuid import UUID
+
+import numpy as np
+
+from .config import get_settings
+from .executors import vector_pool
+
+settings = get_settings()
+
+_TOKEN = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be can do does for from how i in is it me my of on or our the to we what when "
+    "where which who why will with you your".split()
+)
+
+# client_id -> ClientFAQIndex (in-memory view of the client's Chroma FAQ collection)
+_indexes: dict = {}
+_stats = {"hits": 0, "misses": 0, "loads": 0}
+
+
+def get_faq_collection_name(client_id: UUID) -> str:
+    return f"faqs_{str(client_id).replace('-', '_')}"
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(_TOKEN.findall(unicodedata.normalize("NFKC", text).lower()))
+
+
+def question_tokens(text: str) -> frozenset:
+    tokens = _TOKEN.findall(unicodedata.normalize("NFKC", text).lower())
+    return frozenset(t for t in tokens if t not in _STOPWORDS) or frozenset(tokens)
+
+
+class ClientFAQIndex:
+    """One client's FAQs: normalized questions, token sets and unit-length embeddings"""
+
+    def __init__(self, ids: List[str], questions: List[str], metadatas: List[dict], embeddings):
+        self.loaded_at = time.monotonic()
+        self.ids = ids
+        self.answers = [m.get("answer", "") for m in metadatas]
+        self.priorities = [int(m.get("priority") or 0) for m in metadatas]
+        self.normalized = [normalize_question(q) for q in questions]
+        self.tokens = [question_tokens(q) for q in questions]
+        matrix = np.asarray(embeddings, dtype=np.float32) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True) if len(ids) else None
+        self.embeddings = matrix / np.maximum(norms, 1e-12) if len(ids) else matrix
+
+    def match(self, question: str, embedding: Optional[List[float]]) -> Optional[str]:
+        """
+        Best FAQ answer if one is a confident match. Candidates are ranked by
+        match strength (verbatim, then lexical, then semantic score); FAQ
+        priority only breaks ties between equally strong matches.
+        """
+        if not self.ids:
+            return None
+        normalized = normalize_question(question)
+        tokens = question_tokens(question)
+        lexical = np.array([
+            1.0 if normalized == n else (len(tokens & t) / len(tokens | t) if tokens and t else 0.0)
+            for n, t in zip(self.normalized, self.tokens)
+        ], dtype=np.float32)
+
+        exact = lexical >= 1.0
+        lexical_hit = lexical >= settings.faq_lexical_threshold
+        semantic = np.zeros_like(lexical)
+        if embedding is not None and self.embeddings.shape[1] == len(embedding):
+            query = np.asarray(embedding, dtype=np.float32)
+            semantic = self.embeddings @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        # Without an embedding only near-verbatim questions qualify
+        confident = lexical_hit | (semantic >= settings.faq_semantic_threshold)
+
+        candidates = np.nonzero(confident)[0]
+        if not len(candidates):
+            return None
+
+        def strength(i):
+            score = lexical[i] if lexical_hit[i] else semantic[i]
+            return (bool(exact[i]), bool(lexical_hit[i]), round(float(score), 2), self.priorities[i], float(score))
+
+        best = max(candidates, key=strength)
+        return self.answers[best]
+
+
+def _collection(client_id: UUID, create: bool):
+    from .rag import chroma_client
+
+    name = get_faq_collection_name(client_id)
+    if create:
+        return chroma_client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+    try:
+        return chroma_client.get_collection(name)
+    except Exception:
+        return None
+
+
+def _faq_metadata(faq) -> dict:
+    return {"answer": faq.answer, "priority": int(faq.priority or 0), "category": faq.category or ""}
+
+
+def _backfill(client_id: UUID, faqs: list):
+    """Embed every FAQ of a client into a fresh collection (first use after deploy)"""
+    from .rag import embed_texts
+
+    collection = _collection(client_id, create=True)
+    if faqs:
+        questions = [faq.question for faq in faqs]
+        collection.upsert(
+            ids=[str(faq.id) for faq in faqs],
+            embeddings=embed_texts(questions),
+            documents=questions,
+            metadatas=[_faq_metadata(faq) for faq in faqs]
+        )
+
+
+def _load(client_id: UUID) -> Optional[ClientFAQIndex]:
+    collection = _collection(client_id, create=False)
+    if collection is None:
+        return None
+    entries = collection.get(include=["documents", "metadatas", "embeddings"])
+    _stats["loads"] += 1
+    return ClientFAQIndex(entries["ids"], entries["documents"], entries["metadatas"], entries["embeddings"])
+
+
+async def _get_index(db, client_id: UUID) -> Optional[ClientFAQIndex]:
+    key = str(client_id)
+    index = _indexes.get(key)
+    if index is not None and time.monotonic() - index.loaded_at < settings.faq_index_ttl_seconds:
+        return index
+    index = await vector_pool.run(_load, client_id)
+    if index is None:
+        from sqlalchemy import select
+        from .models import FAQ
+        faqs = (await db.execute(select(FAQ).where(FAQ.client_id == client_id))).scalars().all()
+        await vector_pool.run(_backfill, client_id, faqs)
+        index = await vector_pool.run(_load, client_id)
+    if index is not None:
+        _indexes[key] = index
+    return index
+
+
+async def match_faq(db, client_id: UUID, question: str, embedding: Optional[List[float]]) -> Optional[str]:
+    """FAQ answer for a chat message, or None to fall through to the LLM"""
+    if not settings.faq_fast_path_enabled:
+        return None
+    try:
+        index = await _get_index(db, client_id)
+        answer = index.match(question, embedding) if index is not None else None
+    except Exception as e:
+        print(f"[FAQ] Match failed (non-fatal): {e}")
+        answer = None
+    _stats["hits" if answer else "misses"] += 1
+    return answer
+
+
+async def index_faq(client_id: UUID, faq):
+    """Add or refresh one FAQ after create/update"""
+    from .rag import embed_query
+
+    def upsert():
+        collection = _collection(client_id, create=False)
+        if collection is None:
+            return  # Not built yet; the first chat backfills from the table
+        collection.upsert(
+            ids=[str(faq.id)],
+            embeddings=[embed_query(faq.question)],
+            documents=[faq.question],
+            metadatas=[_faq_metadata(faq)]
+        )
+
+    try:
+        await vector_pool.run(upsert)
+    except Exception as e:
+        print(f"[FAQ] Index update failed (non-fatal): {e}")
+        drop_faq_index(client_id)  # Rebuild from the table on next use
+    _indexes.pop(str(client_id), None)
+
+
+async def remove_faq(client_id: UUID, faq_id: UUID):
+    """Drop one FAQ after delete"""
+    def delete():
+        collection = _collection(client_id, create=False)
+        if collection is not None:
+            collection.delete(ids=[str(faq_id)])
+
+    try:
+        await vector_pool.run(delete)
+    except Exception as e:
+        print(f"[FAQ] Index delete failed (non-fatal): {e}")
+        drop_faq_index(client_id)
+    _indexes.pop(str(client_id), None)
+
+
+def drop_faq_index(client_id: UUID):
+    """Forget a client's FAQ index entirely; it is rebuilt from the table on next use"""
+    from .rag import chroma_client
+
+    _indexes.pop(str(client_id), None)
+    try:
+        chroma_client.delete_collection(get_faq_collection_name(client_id))
+    except Exception:
+        pass
+
+
+def stats() -> dict:
+    return {**_stats, "clients_loaded": len(_indexes)}
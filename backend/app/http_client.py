@@ -0,0 +1,62 @@
+"""
+Shared upstream HTTP client
+One pooled, keep-alive httpx.AsyncClient per process for all xAI traffic
+"""
+from typing import Optional
+
+import httpx
+
+from .config import get_settings
+
+settings = get_settings()
+
+XAI_API_BASE = "https://api.x.ai"
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the process-wide client.
+    Created lazily so serverless entrypoints (no startup hook) still share one pool.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=_http2_available(),
+            timeout=httpx.Timeout(settings.xai_http_timeout, connect=settings.xai_http_connect_timeout),
+            limits=httpx.Limits(
+                max_connections=settings.xai_http_max_connections,
+                max_keepalive_connections=settings.xai_http_max_keepalive_connections,
+                keepalive_expiry=settings.xai_http_keepalive_expiry,
+            ),
+        )
+    return _client
+
+
+async def start_http_client():
+    """Create the pool and warm one connection to api.x.ai so the first chat skips TCP+TLS"""
+    client = get_http_client()
+    try:
+        await client.get(XAI_API_BASE, timeout=5.0)
+        print(f"✅ Upstream HTTP client ready (http2={_http2_available()})")
+    except httpx.HTTPError as e:
+        # Not fatal - the connection will be opened on first use instead
+        print(f"⚠️ Upstream HTTP warm-up failed (non-fatal): {e}")
+
+
+async def close_http_client():
+    """Close pooled connections on shutdown"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
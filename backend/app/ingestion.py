@@ -0,0 +1,466 @@
+"""
+Document ingestion queue
+POST /api/documents streams the upload to INGESTION_UPLOAD_DIR in fixed-size
+chunks (size limit enforced and SHA-256 computed as it is copied) and inserts an
+ingestion_jobs row in the same transaction as the document, then returns. Each
+app process runs INGESTION_WORKERS workers that:
+
+- claim the oldest runnable job with UPDATE ... WHERE id = (SELECT ... FOR
+  UPDATE SKIP LOCKED), so any number of workers share the queue without
+  handing out a job twice
+- wake on NOTIFY ingestion_jobs (sent when an enqueue commits), with polling
+  as the fallback
+- heartbeat while a job runs; a running job whose heartbeat is older than
+  INGESTION_STALE_AFTER_SECONDS (worker crashed or redeployed) is claimed again.
+  A worker whose job was taken over stops processing it, and its progress and
+  status writes only apply while it still owns the job
+- retry failures with exponential backoff up to the job's max_attempts.
+  Documents that cannot be read (ValueError from extraction) fail at once; a
+  job whose upload is not on this host is retried like any other failure, so
+  a host that has it can pick it up. With more than one host, put
+  INGESTION_UPLOAD_DIR on storage they all mount.
+
+When no worker was started in this process (e.g. Mangum with lifespan off)
+and INGESTION_WORKERS is not 0, the upload request processes its own job
+inline with process_job_inline().
+
+Progress (stage and percent) is written to the document row as it goes.
+"""
+import asyncio
+import hashlib
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+from uuid import UUID
+
+from sqlalchemy import and_, exists, or_, select, text, update
+
+from .chunk_registry import DocumentGone
+from .config import get_settings
+from .database import SessionLocal
+from .models import Document, DocumentStatus, IngestionJob, IngestionJobStatus
+
+settings = get_settings()
+
+NOTIFY_CHANNEL = "ingestion_jobs"
+
+# Bytes copied per read when spooling an upload (peak memory per upload)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+QUEUED = IngestionJobStatus.QUEUED.value
+RUNNING = IngestionJobStatus.RUNNING.value
+SUCCEEDED = IngestionJobStatus.SUCCEEDED.value
+FAILED = IngestionJobStatus.FAILED.value
+
+
+# ----- stored uploads -----
+
+def upload_path(doc_id: UUID) -> str:
+    return os.path.join(settings.ingestion_upload_dir, f"{doc_id}.upload")
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadMissing(Exception):
+    """The job's upload is not readable on this host (retryable: another host may have it)"""
+
+
+class JobReclaimed(Exception):
+    """Another worker took the job over (this one missed its heartbeats)"""
+
+
+def spool_upload(doc_id: UUID, source, max_bytes: int) -> tuple:
+    """
+    Copy an upload (file object) to where every worker can read it, chunk by chunk (blocking).
+    Returns (path, size, sha256 hex); raises UploadTooLarge as soon as max_bytes is passed.
+    """
+    os.makedirs(settings.ingestion_upload_dir, exist_ok=True)
+    path = upload_path(doc_id)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_upload(tmp_path)
+        raise
+    return path, size, digest.hexdigest()
+
+
+def remove_upload(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"[Ingestion] Could not remove {path} (non-fatal): {e}")
+
+
+# ----- queue operations (sync Session; run via asyncio.to_thread) -----
+
+def enqueue_document(db, doc: Document, file_path: str) -> IngestionJob:
+    """Queue a document in the caller's transaction; workers are notified when it commits"""
+    job = IngestionJob(
+        document_id=doc.id,
+        client_id=doc.client_id,
+        file_path=file_path,
+        file_type=doc.file_type,
+        filename=doc.filename,
+        max_attempts=settings.ingestion_max_attempts,
+    )
+    db.add(job)
+    doc.progress_stage = "queued"
+    doc.progress_percent = 0
+    db.execute(text("SELECT pg_notify(:channel, '')"), {"channel": NOTIFY_CHANNEL})
+    return job
+
+
+def claim_job(db, worker_id: str, job_id: Optional[UUID] = None) -> Optional[SimpleNamespace]:
+    """
+    Claim the oldest runnable (or abandoned) job, or only job_id if given;
+    a plain snapshot, or None if there is nothing to claim
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=settings.ingestion_stale_after_seconds)
+    candidate = (
+        select(IngestionJob.id)
+        .where(or_(
+            and_(IngestionJob.status == QUEUED, IngestionJob.run_after <= now),
+            and_(IngestionJob.status == RUNNING, IngestionJob.heartbeat_at < stale_before),
+        ))
+        .order_by(IngestionJob.run_after)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    if job_id is not None:
+        candidate = candidate.where(IngestionJob.id == job_id)
+    candidate = candidate.scalar_subquery()
+    row = db.execute(
+        update(IngestionJob)
+        .where(IngestionJob.id == candidate)
+        .values(status=RUNNING, attempts=IngestionJob.attempts + 1, locked_by=worker_id, heartbeat_at=now)
+        .returning(*IngestionJob.__table__.columns)
+        .execution_options(synchronize_session=False)
+    ).mappings().first()
+    db.commit()
+    return SimpleNamespace(**row) if row else None
+
+
+def _owned(job) -> tuple:
+    return (IngestionJob.id == job.id, IngestionJob.locked_by == job.locked_by, IngestionJob.status == RUNNING)
+
+
+def _heartbeat(job) -> bool:
+    """Refresh the job's heartbeat; False if another worker has taken it over"""
+    with SessionLocal() as db:
+        updated = db.execute(
+            update(IngestionJob).where(*_owned(job)).values(heartbeat_at=datetime.utcnow())
+        ).rowcount
+        db.commit()
+        return bool(updated)
+
+
+def _set_progress(job, stage: str, percent: int):
+    with SessionLocal() as db:
+        updated = db.execute(
+            update(Document).where(
+                Document.id == job.document_id, exists(select(IngestionJob.id).where(*_owned(job)))
+            ).values(status=DocumentStatus.PROCESSING, progress_stage=stage, progress_percent=percent)
+        ).rowcount
+        db.commit()
+    if not updated and not _owns(job):
+        raise JobReclaimed(f"Job {job.id} was reclaimed by another worker")
+
+
+def _owns(job) -> bool:
+    with SessionLocal() as db:
+        return db.execute(select(IngestionJob.id).where(*_owned(job))).first() is not None
+
+
+def _complete(job, chunk_count: int) -> bool:
+    """Mark job and document done; False if the document was deleted meanwhile"""
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        owned = db.execute(
+            update(IngestionJob).where(*_owned(job)).values(status=SUCCEEDED, finished_at=now, last_error=None)
+        ).rowcount
+        if not owned:
+            raise JobReclaimed(f"Job {job.id} was reclaimed by another worker")
+        updated = db.execute(
+            update(Document).where(Document.id == job.document_id).values(
+                status=DocumentStatus.COMPLETED, chunk_count=chunk_count, processed_at=now,
+                error_message=None, progress_stage="completed", progress_percent=100,
+            )
+        ).rowcount
+        db.commit()
+        return bool(updated)
+
+
+def retry_delay_seconds(attempts: int) -> float:
+    """Backoff before the next attempt after `attempts` failed ones"""
+    delay = settings.ingestion_retry_base_seconds * (2 ** max(0, attempts - 1))
+    return min(delay, settings.ingestion_retry_max_seconds)
+
+
+def _fail(job, error: str, retryable: bool) -> bool:
+    """Requeue with backoff, or fail job and document for good; True if final"""
+    now = datetime.utcnow()
+    final = not retryable or job.attempts >= job.max_attempts
+    with SessionLocal() as db:
+        if final:
+            owned = db.execute(
+                update(IngestionJob).where(*_owned(job)).values(status=FAILED, finished_at=now, last_error=error)
+            ).rowcount
+            if not owned:
+                raise JobReclaimed(f"Job {job.id} was reclaimed by another worker")
+            db.execute(
+                update(Document).where(Document.id == job.document_id).values(
+                    status=DocumentStatus.FAILED, error_message=error[:500], progress_stage="failed"
+                )
+            )
+        else:
+            owned = db.execute(
+                update(IngestionJob).where(*_owned(job)).values(
+                    status=QUEUED, locked_by=None, last_error=error,
+                    run_after=now + timedelta(seconds=retry_delay_seconds(job.attempts)),
+                )
+            ).rowcount
+            if not owned:
+                raise JobReclaimed(f"Job {job.id} was reclaimed by another worker")
+            db.execute(
+                update(Document).where(Document.id == job.document_id).values(progress_stage="retrying")
+            )
+        db.commit()
+    return final
+
+
+def _release(job):
+    """Put a job back without using up an attempt (worker shutting down)"""
+    with SessionLocal() as db:
+        db.execute(
+            update(IngestionJob).where(*_owned(job)).values(
+                status=QUEUED, locked_by=None, attempts=IngestionJob.attempts - 1
+            )
+        )
+        db.commit()
+
+
+def _claim_next(worker_id: str, job_id: Optional[UUID] = None) -> Optional[SimpleNamespace]:
+    with SessionLocal() as db:
+        return claim_job(db, worker_id, job_id)
+
+
+def _listen_dsn() -> str:
+    """DATABASE_URL for a raw asyncpg connection (no SQLAlchemy driver suffix)"""
+    parts = urlsplit(settings.database_url)
+    return urlunsplit(("postgresql", parts.netloc, parts.path, parts.query, parts.fragment))
+
+
+# ----- worker -----
+
+class IngestionWorker:
+    """Runs up to `concurrency` ingestion jobs at a time in this process"""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: list = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._listener = None
+        self.running = 0
+        self.claimed = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+        self.lost = 0
+        self.reclaimed = 0
+
+    def started(self) -> bool:
+        """True if this process's workers are running on the current event loop"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return any(not task.done() and task.get_loop() is loop for task in self._tasks)
+
+    async def start(self):
+        if self.concurrency <= 0 or self._tasks:
+            return
+        try:
+            os.makedirs(settings.ingestion_upload_dir, exist_ok=True)
+            if not os.access(settings.ingestion_upload_dir, os.W_OK | os.R_OK):
+                raise PermissionError(f"{settings.ingestion_upload_dir} is not readable and writable")
+        except OSError as e:
+            print(f"[Ingestion] INGESTION_UPLOAD_DIR unusable, workers not started: {e}")
+            return
+        self._wakeup = asyncio.Event()
+        self._listener = await self._listen()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def _listen(self):
+        try:
+            import asyncpg
+            connection = await asyncpg.connect(_listen_dsn())
+            await connection.add_listener(NOTIFY_CHANNEL, lambda *args: self._wakeup.set())
+            return connection
+        except Exception as e:
+            print(f"[Ingestion] LISTEN unavailable, polling every {settings.ingestion_poll_interval_seconds}s: {e}")
+            return None
+
+    async def stop(self):
+        """Stop claiming; jobs in progress go back to the queue"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._listener is not None:
+            try:
+                await self._listener.close()
+            except Exception:
+                pass
+            self._listener = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()  # Before claiming, so a NOTIFY during the claim is not missed
+            try:
+                job = await asyncio.to_thread(_claim_next, self.worker_id)
+            except Exception as e:
+                print(f"[Ingestion] Claim failed: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.ingestion_poll_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.process(job)
+
+    async def _heartbeat(self, job, work: asyncio.Task):
+        """Keep the job claimed; cancel `work` if another worker has taken it over"""
+        while True:
+            await asyncio.sleep(settings.ingestion_heartbeat_seconds)
+            try:
+                if not await asyncio.to_thread(_heartbeat, job):
+                    print(f"[Ingestion] Job {job.id} was reclaimed by another worker, stopping")
+                    work.cancel()
+                    return True
+            except Exception as e:
+                print(f"[Ingestion] Heartbeat failed for job {job.id}: {e}")
+
+    async def process(self, job):
+        """Run one claimed job to success, retry or failure"""
+        self.claimed += 1
+        self.running += 1
+        work = asyncio.create_task(self._process(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job, work))
+        try:
+            await work
+        except asyncio.CancelledError:
+            reclaimed = heartbeat.done() and not heartbeat.cancelled() and heartbeat.result()
+            if reclaimed and not asyncio.current_task().cancelling():
+                self.reclaimed += 1  # The job, its document and its upload are the new owner's now
+                return
+            work.cancel()
+            await asyncio.to_thread(_release, job)
+            raise
+        finally:
+            heartbeat.cancel()
+            self.running -= 1
+
+    async def _process(self, job):
+        from .rag import delete_document_embeddings, process_document
+
+        async def on_progress(stage: str, percent: int):
+            await asyncio.to_thread(_set_progress, job, stage, percent)
+
+        try:
+            if job.attempts > job.max_attempts:
+                raise ValueError(f"Gave up after {job.max_attempts} attempts: {job.last_error}")
+            if not os.access(job.file_path, os.R_OK):
+                raise UploadMissing(f"Upload {job.file_path} not found on {socket.gethostname()}")
+            chunk_count = await process_document(
+                client_id=job.client_id,
+                doc_id=job.document_id,
+                file_path=job.file_path,
+                file_type=job.file_type,
+                filename=job.filename,
+                on_progress=on_progress,
+            )
+            if await asyncio.to_thread(_complete, job, chunk_count):
+                self.succeeded += 1
+                print(f"[Ingestion] Document {job.document_id} processed: {chunk_count} chunks")
+            else:
+                self.lost += 1
+                await delete_document_embeddings(job.client_id, job.document_id)  # Deleted while processing
+            remove_upload(job.file_path)
+        except JobReclaimed:
+            self.reclaimed += 1
+            print(f"[Ingestion] Job {job.id} was reclaimed by another worker, stopped")
+        except DocumentGone:
+            # Deleted while its chunks were being registered; the job went with it. Drop
+            # what earlier batches stored (their references were released by the delete)
+            self.lost += 1
+            try:
+                await delete_document_embeddings(job.client_id, job.document_id)
+            except Exception as e:
+                print(f"[Ingestion] Cleanup of deleted document {job.document_id} failed: {e}")
+            remove_upload(job.file_path)
+        except Exception as e:
+            # An unreadable document will not get better on retry; a missing upload may be on another host
+            retryable = not isinstance(e, ValueError)
+            error = str(e) or type(e).__name__
+            try:
+                final = await asyncio.to_thread(_fail, job, error, retryable)
+            except JobReclaimed:
+                self.reclaimed += 1
+                return
+            except Exception as db_error:
+                print(f"[Ingestion] Could not record failure of job {job.id}: {db_error}")
+                return
+            if final:
+                self.failed += 1
+                remove_upload(job.file_path)
+            else:
+                self.retried += 1
+            print(f"[Ingestion] Document {job.document_id} attempt {job.attempts} failed ({'final' if final else 'will retry'}): {error}")
+
+    async def process_job_inline(self, job_id: UUID) -> bool:
+        """Claim and run one job in the caller (no worker in this process); False if it was already claimed"""
+        job = await asyncio.to_thread(_claim_next, self.worker_id, job_id)
+        if job is None:
+            return False
+        await self.process(job)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.concurrency if self._tasks else 0,
+            "listening": self._listener is not None,
+            "running": self.running,
+            "claimed": self.claimed,
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "failed": self.failed,
+            "deleted_while_processing": self.lost,
+            "reclaimed": self.reclaimed,
+        }
+
+
+ingestion_worker = IngestionWorker(settings.ingestion_workers)
@@ -2,25 +2,24 @@
 Snip - Multi-tenant Chatbot Snippet Service
 Main FastAPI Application
 """
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Header, Request
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Header, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy import select
 from typing import Optional
 from datetime import date, datetime
-import os
-import time
-import threading
-import requests
+import asyncio
 import httpx
-import websockets
 import json
 import base64
-import asyncio
-from uuid import UUID
+import functools
+from uuid import UUID, uuid4
 
 from .config import get_settings
-from .database import get_db, init_db
+from .database import get_async_db, get_db, init_db, dispose_async_engine
 from .models import Client, ClientConfig, Document, UsageRecord, TierEnum, DocumentStatus, Conversation, ConversationMessage, FAQ
 from .schemas import (
     ClientCreate, ClientResponse, ClientWithApiKey,
@@ -34,276 +33,34 @@ from .schemas import (
 )
 from .auth import (
     generate_api_key, hash_api_key,
-    get_client_from_api_key, get_client_from_client_id
+    get_client_from_api_key, get_client_from_api_key_async, get_client_from_client_id
 )
 from .email import send_api_key_email
+from .http_client import get_http_client, start_http_client, close_http_client
+from .tts import generate_tts_audio, convert_pcm_to_wav, wav_header, resolve_tts_voice, resolve_tts_audio_format
+from .audio_codec import AUDIO_FORMAT_PATTERN, AudioStreamEncoder, wav_format
+from .voice_pool import voice_pool
+from .faq_index import match_faq, index_faq, remove_faq, stats as faq_index_stats
+from .tenant_gate import get_tenant_gate, refresh_tenant_gate, stats as tenant_gate_stats
+from .api_key_cache import invalidate_api_key, stats as api_key_cache_stats
+from .usage_aggregator import usage_aggregator
+from .conversation_log import ChatTurn, conversation_log
+from .conversation_memory import conversation_store
+from .prompt_budget import build_chat_messages, prompt_budget, count_tokens, message_tokens, warm_tokenizer
+from .answer_cache import cacheable_question, lookup_answer, store_answer, invalidate_answers, stats as answer_cache_stats
+from .tts_jobs import create_tts_job, deferred_available, get_tts_job, wait_for_tts_job, iter_tts_job_pcm, JOB_READY, JOB_FAILED
+from .tts_jobs import start as tts_jobs_start
 from .stripe_routes import router as stripe_router
+from .rate_limit import limiter, check_chat_rate_limit, stats as rate_limit_stats
+from .chunk_registry import copy_references, stats as chunk_registry_stats
+from .embeddings import embedding_engine, stats as embedding_stats
+from .executors import sdk_pool, vector_pool, shutdown_executors, stats as executor_stats
+from .ingestion import UploadTooLarge, enqueue_document, ingestion_worker, remove_upload, spool_upload, upload_path
 from pydantic import BaseModel as PydanticBaseModel
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 
 settings = get_settings()
-limiter = Limiter(key_func=get_remote_address)
-
-# Per-client_id rate limit for /api/chat (Issue 6) - in-memory, 120/min per client
-_chat_rate_cache: dict = {}
-_chat_rate_lock = threading.Lock()
-CHAT_RATE_LIMIT = 120
-CHAT_RATE_WINDOW_SEC = 60.0
-
-
-def _check_chat_rate_limit(client_id: UUID) -> bool:
-    """Return True if allowed, False if over limit (120/min per client_id)."""
-    now = time.time()
-    key = str(client_id)
-    with _chat_rate_lock:
-        if key not in _chat_rate_cache:
-            _chat_rate_cache[key] = []
-        times = _chat_rate_cache[key]
-        times[:] = [t for t in times if now - t < CHAT_RATE_WINDOW_SEC]
-        if len(times) >= CHAT_RATE_LIMIT:
-            return False
-        times.append(now)
-    return True
-
-
-# TTS Configuration (Voice API endpoints)
-TTS_REALTIME_WS = "wss://api.x.ai/v1/realtime"
-TTS_EPHEMERAL_TOKEN_ENDPOINT = "https://api.x.ai/v1/realtime/client_secrets"
-
-
-async def get_ephemeral_token(api_key: str, retries: int = 3) -> str:
-    """
-    Get ephemeral token for Voice API
-    Uses API key to get a short-lived token for WebSocket connection
-    Includes retry logic for resilience
-    """
-    last_error = None
-    
-    for attempt in range(retries):
-        try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(
-                    TTS_EPHEMERAL_TOKEN_ENDPOINT,
-                    headers={
-                        "Authorization": f"Bearer {api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={}  # Empty JSON body
-                )
-                response.raise_for_status()
-                data = response.json()
-                return data["value"]  # API returns "value" not "token"
-        except httpx.TimeoutException as e:
-            last_error = e
-            if attempt < retries - 1:
-                wait_time = (attempt + 1) * 0.5  # Exponential backoff
-                print(f"[TTS] Ephemeral token timeout (attempt {attempt + 1}/{retries}), retrying in {wait_time}s...")
-                await asyncio.sleep(wait_time)
-                continue
-        except httpx.HTTPStatusError as e:
-            # Don't retry on auth errors (401/403) or client errors (4xx)
-            if e.response.status_code in [401, 403, 400]:
-                print(f"[TTS] Ephemeral token auth/client error: {e.response.status_code}")
-                raise
-            last_error = e
-            if attempt < retries - 1:
-                wait_time = (attempt + 1) * 0.5
-                print(f"[TTS] Ephemeral token HTTP error (attempt {attempt + 1}/{retries}), retrying in {wait_time}s...")
-                await asyncio.sleep(wait_time)
-                continue
-        except Exception as e:
-            last_error = e
-            if attempt < retries - 1:
-                wait_time = (attempt + 1) * 0.5
-                print(f"[TTS] Ephemeral token error (attempt {attempt + 1}/{retries}), retrying in {wait_time}s...")
-                await asyncio.sleep(wait_time)
-                continue
-    
-    # All retries exhausted
-    print(f"[TTS] Failed to get ephemeral token after {retries} attempts: {last_error}")
-    raise last_error or Exception("Failed to get ephemeral token")
-
-
-async def generate_tts_audio(text: str, api_key: str, voice: str = "Ara") -> Optional[bytes]:
-    """
-    Generate TTS audio via WebSocket (Voice API)
-    
-    Args:
-        text: Text to convert to speech
-        api_key: API key for voice generation
-        voice: Voice name (Ara, Leo, Rex, Sal, Eve)
-    
-    Returns:
-        Audio bytes (PCM format at 24kHz) or None if failed
-    """
-    try:
-        # Step 1: Get ephemeral token
-        token = await get_ephemeral_token(api_key)
-        
-        # Step 2: Connect via WebSocket
-        async with websockets.connect(
-            TTS_REALTIME_WS,
-            extra_headers={"Authorization": f"Bearer {token}"},
-            ping_interval=20,
-            ping_timeout=10
-        ) as ws:
-            
-            # Step 3: Send session configuration
-            # CRITICAL: Voice Agent is conversational (user says X → assistant says Y). We send our
-            # bot's reply as "user" input and force repeat via instruction + message framing.
-            session_update = {
-                "type": "session.update",
-                "session": {
-                    "voice": voice,
-                    "instructions": (
-                        "You are a text-to-speech engine. The user will send a line that starts with "
-                        "'SPEAK:' followed by the exact words to speak. Your ONLY output is to speak "
-                        "those words—the part after 'SPEAK:'. Do not say 'SPEAK:' or anything else. "
-                        "No greetings, no questions, no comment. Just the words after SPEAK:."
-                    ),
-                    "audio": {
-                        "input": {"format": {"type": "audio/pcm", "rate": 24000}},
-                        "output": {"format": {"type": "audio/pcm", "rate": 24000}}
-                    }
-                }
-            }
-            await ws.send(json.dumps(session_update))
-            
-            # Wait for session.updated
-            session_ready = False
-            for _ in range(5):
-                try:
-                    msg = await asyncio.wait_for(ws.recv(), timeout=2.0)
-                    obj = json.loads(msg)
-                    if obj.get("type") == "session.updated":
-                        session_ready = True
-                        print(f"[TTS] Session configured with voice: {voice}")
-                        break
-                except asyncio.TimeoutError:
-                    continue
-            
-            if not session_ready:
-                print(f"[TTS] Warning: Session update not confirmed")
-            
-            # Step 4: Send our bot's reply with SPEAK: prefix so the model speaks only the content
-            # (Voice Agent has no true TTS-only mode; instruction says output = words after SPEAK:).
-            tts_user_message = f"SPEAK: {text}"
-            item_message = {
-                "type": "conversation.item.create",
-                "item": {
-                    "type": "message",
-                    "role": "user",
-                    "content": [{"type": "input_text", "text": tts_user_message}]
-                }
-            }
-            await ws.send(json.dumps(item_message))
-            print(f"[TTS] Sent text input (say exactly): {text[:50]}...")
-            
-            # Wait for conversation.item.added
-            item_added = False
-            for _ in range(5):
-                try:
-                    msg = await asyncio.wait_for(ws.recv(), timeout=2.0)
-                    obj = json.loads(msg)
-                    if obj.get("type") == "conversation.item.added":
-                        item_added = True
-                        break
-                except asyncio.TimeoutError:
-                    continue
-            
-            if not item_added:
-                print(f"[TTS] Warning: Conversation item not confirmed")
-            
-            # Step 5: Request audio only so the model doesn't "reply" in text first
-            response_message = {
-                "type": "response.create",
-                "response": {
-                    "modalities": ["audio"]
-                }
-            }
-            await ws.send(json.dumps(response_message))
-            
-            # Step 6: Collect audio deltas
-            audio_chunks = []
-            timeout = 30
-            start_time = time.time()
-            
-            async for msg in ws:
-                if time.time() - start_time > timeout:
-                    print(f"[TTS] Timeout waiting for audio")
-                    break
-                
-                try:
-                    obj = json.loads(msg)
-                    msg_type = obj.get("type")
-                    
-                    if msg_type in ["response.output_audio.delta", "response.audio.delta"]:
-                        # Audio comes in delta field as base64 (some APIs use "audio" instead)
-                        delta = obj.get("delta") or obj.get("audio") or obj.get("data")
-                        if isinstance(delta, str) and delta:
-                            audio_bytes = base64.b64decode(delta)
-                            audio_chunks.append(audio_bytes)
-                            print(f"[TTS] Received audio delta: {len(audio_bytes)} bytes")
-                    
-                    elif msg_type in ["response.output_audio.done", "response.audio.done", "response.done"]:
-                        print(f"[TTS] Audio generation complete")
-                        break
-                    
-                    elif msg_type == "error":
-                        error_msg = obj.get("error", {}).get("message", "Unknown error")
-                        print(f"[TTS] Error: {error_msg}")
-                        break
-                        
-                except json.JSONDecodeError:
-                    continue
-                except Exception as e:
-                    print(f"[TTS] Error processing message: {e}")
-                    continue
-            
-            if audio_chunks:
-                combined_audio = b"".join(audio_chunks)
-                print(f"[TTS] Generated {len(combined_audio)} bytes of audio")
-                return combined_audio
-            else:
-                print(f"[TTS] No audio chunks received")
-                return None
-                
-    except Exception as e:
-        print(f"[TTS] Failed to generate audio: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
-
-
-def convert_pcm_to_wav(pcm_audio: bytes, sample_rate: int = 24000, channels: int = 1, sample_width: int = 2) -> bytes:
-    """
-    Convert PCM audio to WAV format for browser playback
-    """
-    import struct
-    
-    # WAV header constants
-    fmt_size = 16
-    data_size = len(pcm_audio)
-    file_size = 36 + data_size
-    
-    # Create WAV header
-    header = b'RIFF'
-    header += struct.pack('<I', file_size)
-    header += b'WAVE'
-    header += b'fmt '
-    header += struct.pack('<I', fmt_size)
-    header += struct.pack('<H', 1)  # PCM format
-    header += struct.pack('<H', channels)
-    header += struct.pack('<I', sample_rate)
-    header += struct.pack('<I', sample_rate * channels * sample_width)  # byte rate
-    header += struct.pack('<H', channels * sample_width)  # block align
-    header += struct.pack('<H', sample_width * 8)  # bits per sample
-    header += b'data'
-    header += struct.pack('<I', data_size)
-    
-    return header + pcm_audio
 
 
 app = FastAPI(
@@ -329,9 +86,18 @@ app.add_middleware(
 )
 
 
+def _warm_in_background(name: str, warm):
+    """Run a blocking warmup off the event loop; a failure is logged rather than lost"""
+    def done(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"[Startup] {name} warmup failed: {future.exception()!r}")
+
+    asyncio.get_running_loop().run_in_executor(None, warm).add_done_callback(done)
+
+
 @app.on_event("startup")
 async def startup():
-    """Initialize database on startup"""
+    """Initialize the database, the upstream HTTP pool and the background workers"""
     try:
         init_db()
     except Exception as e:
@@ -340,6 +106,27 @@ async def startup():
         logger = logging.getLogger(__name__)
         logger.error(f"Failed to initialize database: {e}")
         # In production, you might want to fail fast, but this allows app to start
+    await start_http_client()
+    _warm_in_background("Tokenizer", warm_tokenizer)  # May download the encoding
+    _warm_in_background("Embedding model", embedding_engine.warm)
+    tts_jobs_start()
+    voice_pool.start()
+    usage_aggregator.start()
+    conversation_log.start()
+    await ingestion_worker.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Requeue running ingestion jobs, flush pending logs and usage, then close pools and caches"""
+    await ingestion_worker.stop()
+    await conversation_log.stop()
+    await usage_aggregator.stop()
+    await voice_pool.close_all()
+    await close_http_client()
+    await dispose_async_engine()
+    shutdown_executors()
+    embedding_engine.close()
 
 
 # ============== Health Check ==============
@@ -395,6 +182,30 @@ async def healthz_db(db: Session = Depends(get_db)):
         }
 
 
+@app.get("/healthz/metrics")
+async def healthz_metrics():
+    """In-process cache/queue counters for this worker"""
+    from .audio_cache import audio_cache
+    return {
+        "status": "ok",
+        "service": "snip",
+        "tenant_gates": tenant_gate_stats(),
+        "api_keys": api_key_cache_stats(),
+        "rate_limits": rate_limit_stats(),
+        "usage": usage_aggregator.stats(),
+        "conversation_log": conversation_log.stats(),
+        "conversation_memory": conversation_store.stats(),
+        "tts_audio_cache": audio_cache.stats(),
+        "tts_voice_sessions": voice_pool.stats(),
+        "answer_cache": answer_cache_stats(),
+        "faq_fast_path": faq_index_stats(),
+        "executors": executor_stats(),
+        "embeddings": embedding_stats(),
+        "ingestion": ingestion_worker.stats(),
+        "chunk_registry": chunk_registry_stats(),
+    }
+
+
 @app.get("/healthz/ready")
 async def healthz_ready(db: Session = Depends(get_db)):
     """
@@ -474,6 +285,7 @@ async def create_client(
         
         db.commit()
         db.refresh(client)
+        refresh_tenant_gate(db, client.id)
         
         # Return with full API key (only time it's shown)
         return ClientWithApiKey(
@@ -530,14 +342,15 @@ async def resend_api_key(
     client.api_key = api_key[:16] + "..."
     client.api_key_hash = hash_api_key(api_key)
     db.commit()
+    invalidate_api_key(client.id)  # The old key stops working on this worker now
     tier_str = client.tier.value if hasattr(client.tier, "value") else str(client.tier)
-    send_api_key_email(client.email, api_key, tier_str)
+    await sdk_pool.run(send_api_key_email, client.email, api_key, tier_str)
     return {"status": "success", "message": "If an account exists for this email, a new API key has been sent."}
 
 
 @app.get("/api/clients/me", response_model=ClientResponse)
 async def get_current_client(
-    client: Client = Depends(get_client_from_api_key)
+    client: Client = Depends(get_client_from_api_key_async)
 ):
     """Get current client info (requires API key)"""
     return client
@@ -547,8 +360,7 @@ async def get_current_client(
 
 @app.get("/api/config", response_model=ConfigResponse)
 async def get_config(
-    client: Client = Depends(get_client_from_api_key),
-    db: Session = Depends(get_db)
+    client: Client = Depends(get_client_from_api_key_async)
 ):
     """Get client configuration (requires API key)"""
     if not client.config:
@@ -575,6 +387,9 @@ async def update_config(
     
     db.commit()
     db.refresh(client.config)
+    invalidate_answers(client.id)
+    invalidate_api_key(client.id)  # Cached snapshots carry the config
+    refresh_tenant_gate(db, client.id)
     
     # Use from_orm to hide actual API key
     return ConfigResponse.from_orm(client.config)
@@ -584,318 +399,522 @@ async def update_config(
 async def get_widget_config(
     client_id: UUID,
     origin: Optional[str] = Header(None),
-    db: Session = Depends(get_db)
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get widget configuration (public endpoint)
-    Called by the embedded widget to get branding
+    Called by the embedded widget to get branding. The body is pre-serialized per
+    client; a matching If-None-Match gets a 304 (both come from the gate cache).
     """
-    # Allow permanent demo client: lookup without is_active filter when client_id matches
-    permanent_client_id = (settings.permanent_api_key_client_id or "").strip()
-    if permanent_client_id and str(client_id) == permanent_client_id:
-        client = db.query(Client).filter(Client.id == client_id).first()
-    else:
-        client = db.query(Client).filter(
-            Client.id == client_id,
-            Client.is_active == True
-        ).first()
-
-    if not client or not client.config:
-        raise HTTPException(status_code=404, detail="Client not found")
-
-    # Gate: only active or grace-period subscriptions (Issue 1); skip for permanent demo client
-    if not (permanent_client_id and str(client_id) == permanent_client_id):
-        if not client.is_active:
-            raise HTTPException(status_code=403, detail="Account inactive")
-        if client.stripe_subscription_status and client.stripe_subscription_status.lower() not in ("active", "trialing", "past_due"):
-            raise HTTPException(status_code=403, detail="Subscription not active")
-    
-    # Check domain allowlist; reject when allowlist set but no Origin (Issue 2)
-    config = client.config
-    origin_val = (origin or "").strip()
-    if config.allowed_domains:
-        if not origin_val:
-            raise HTTPException(status_code=403, detail="Origin required")
-        allowed = any(
-            (d.strip() in origin_val) for d in config.allowed_domains if d and isinstance(d, str)
-        )
-        if not allowed:
-            raise HTTPException(status_code=403, detail="Domain not allowed")
-    
-    # Use to_widget_config method which includes all new fields
-    widget_config_dict = config.to_widget_config()
-    return WidgetConfig(**widget_config_dict)
+    gate = await get_tenant_gate(db, client_id)
+    gate.check()
+    gate.check_origin((origin or "").strip())
+
+    headers = {
+        "ETag": gate.widget_etag,
+        "Cache-Control": (
+            f"public, max-age={settings.widget_config_max_age_seconds}, "
+            f"stale-while-revalidate={settings.widget_config_stale_while_revalidate_seconds}"
+        ),
+        "Vary": "Origin",  # The allowlist check depends on it
+    }
+    if gate.etag_matches(if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(content=gate.widget_json, media_type="application/json", headers=headers)
 
 
 # ============== Chat Endpoint ==============
 
-@app.post("/api/chat", response_model=ChatResponse)
-@limiter.limit("120/minute")
-async def chat(
-    request: Request,
-    body: ChatRequest,
-    db: Session = Depends(get_db)
-):
-    """
-    Multi-tenant chat endpoint
-    Called by widget with client_id
-    """
-    # Allow permanent demo client: lookup without is_active filter when client_id matches
-    permanent_client_id = (settings.permanent_api_key_client_id or "").strip()
-    if permanent_client_id and str(body.client_id) == permanent_client_id:
-        client = db.query(Client).filter(Client.id == body.client_id).first()
-    else:
-        client = db.query(Client).filter(
-            Client.id == body.client_id,
-            Client.is_active == True
-        ).first()
-
-    if not client:
-        raise HTTPException(status_code=404, detail="Client not found")
-
-    # Gate: only active or grace-period subscriptions (Issue 1); skip for permanent demo client
-    if not (permanent_client_id and str(body.client_id) == permanent_client_id):
-        if not client.is_active:
-            raise HTTPException(status_code=403, detail="Account inactive")
-        if client.stripe_subscription_status and client.stripe_subscription_status.lower() not in ("active", "trialing", "past_due"):
-            raise HTTPException(status_code=403, detail="Subscription not active")
-    
-    if not _check_chat_rate_limit(client.id):
-        raise HTTPException(status_code=429, detail="Too many requests")
-    
-    config = client.config
-    if not config:
-        raise HTTPException(status_code=500, detail="Client config missing")
-    
-    # Enforce allowed_domains if configured; reject when allowlist set but no Origin (Issue 2)
-    origin = (request.headers.get("origin") or request.headers.get("referer") or "").strip()
-    if config.allowed_domains:
-        if not origin:
-            raise HTTPException(status_code=403, detail="Origin required")
-        allowed = any(
-            (d.strip() in origin) for d in config.allowed_domains if d and isinstance(d, str)
-        )
-        if not allowed:
-            raise HTTPException(status_code=403, detail="Domain not allowed")
-    
-    # Build system prompt with client customization
-    base_prompt = f"""You are {config.bot_name}, an AI assistant for {client.company_name}.
-
-{config.system_prompt or "Be helpful, friendly, and professional."}
+XAI_CHAT_COMPLETIONS_URL = "https://api.x.ai/v1/chat/completions"
+DEFAULT_CHAT_MODEL = "grok-4-1-fast-non-reasoning"
 
-Guidelines:
-- Be concise and helpful
-- Stay on topic for {client.company_name}
-- If you don't know something, say so
-"""
-    
-    # For standard+ clients with RAG, add document context
-    rag_context = ""
-    if client.tier != TierEnum.BASIC:
-        try:
-            from .rag import retrieve_context
-            rag_context = await retrieve_context(client.id, body.message) or ""
-            
-            # Track RAG query
-            if rag_context:
-                today = date.today()
-                usage = db.query(UsageRecord).filter(
-                    UsageRecord.client_id == client.id,
-                    UsageRecord.date == today
-                ).first()
-                if usage:
-                    usage.rag_query_count = (usage.rag_query_count or 0) + 1
-                    db.commit()
-        except Exception as e:
-            print(f"RAG retrieval error: {e}")
-            rag_context = ""
-    
-    if rag_context:
-        base_prompt += f"""
-
-RELEVANT CONTEXT FROM COMPANY DOCUMENTS:
-{rag_context}
 
-Use this context to answer questions when relevant.
-"""
-    
-    # Get AI provider configuration - use client's settings if set, otherwise fallback to global
-    # White-labeled: Always use xAI in background, don't expose provider to clients
+def _resolve_ai_credentials(config: ClientConfig) -> tuple:
+    """
+    Return (api_key, model) for the chat completion.
+    White-labeled: Always use xAI in background, don't expose provider to clients
+    """
     api_key = None
-    provider = 'xai'  # Always xAI for white-labeled solution
     model = None
-    
+
     # Check client's AI configuration first (if they provided their own key)
     if config.ai_api_key:
         api_key = config.ai_api_key
-        model = config.ai_model or 'grok-4-1-fast-non-reasoning'
+        model = config.ai_model or DEFAULT_CHAT_MODEL
     # Fallback to legacy xai_api_key if present
     elif hasattr(config, 'xai_api_key') and config.xai_api_key:
         api_key = config.xai_api_key
-        model = 'grok-4-1-fast-non-reasoning'
+        model = DEFAULT_CHAT_MODEL
     # Fallback to global settings (your xAI key)
     elif settings.xai_api_key:
         api_key = settings.xai_api_key
-        model = 'grok-4-1-fast-non-reasoning'
-    
+        model = DEFAULT_CHAT_MODEL
+
     if not api_key:
         raise HTTPException(
-            status_code=500, 
+            status_code=500,
             detail="AI service not configured. Please contact support."
         )
-    
-    # Always use xAI - white-labeled
-    api_url = "https://api.x.ai/v1/chat/completions"
-    model = model or 'grok-4-1-fast-non-reasoning'
-    
+    return api_key, model or DEFAULT_CHAT_MODEL
+
+
+async def _prepare_chat(request: Request, body: ChatRequest, db: AsyncSession) -> tuple:
+    """
+    Shared front half of /api/chat and /api/chat/stream: gate the client, check
+    rate limit and origin, try the FAQ fast path and the answer cache, build the
+    system prompt (with RAG context) and resolve the upstream credentials.
+    Returns (client, config, api_key, payload, answer_lookup, ready_answer, conversation);
+    ready_answer is set (and payload is None) when a FAQ or cached answer applies.
+    """
+    # Client, config and subscription verdict come from the in-process gate cache
+    gate = await get_tenant_gate(db, body.client_id)
+    gate.check()
+    client, config = gate.client, gate.config
+
+    if not await check_chat_rate_limit(client.id):
+        raise HTTPException(status_code=429, detail="Too many requests")
+
+    gate.check_origin((request.headers.get("origin") or request.headers.get("referer") or "").strip())
+
+    api_key, model = _resolve_ai_credentials(config)
+    conversation = await conversation_store.open(db, client.id, body.conversation_id)
+
+    # Tenant-written FAQ answers win; a verbatim question needs no embedding at all
+    faq_answer = await match_faq(db, client.id, body.message, None)
+    if faq_answer is not None:
+        return client, config, api_key, None, None, faq_answer, conversation
+
+    # Embed the message once; the FAQ matcher, answer cache and RAG retrieval share it
+    use_rag = client.tier != TierEnum.BASIC
+    # Cached answers are context-free; a follow-up question may mean something else
+    use_answer_cache = cacheable_question(body.message) and not conversation.has_history()
+    query_embedding = None
+    if use_rag or use_answer_cache or settings.faq_fast_path_enabled:
+        try:
+            from .rag import embed_query
+            query_embedding = await vector_pool.run(embed_query, body.message)
+        except Exception as e:
+            print(f"[Chat] Query embedding failed: {e}")
+
+    if query_embedding is not None:
+        faq_answer = await match_faq(db, client.id, body.message, query_embedding)
+        if faq_answer is not None:
+            return client, config, api_key, None, None, faq_answer, conversation
+
+    answer_lookup = None
+    if use_answer_cache and query_embedding is not None:
+        answer_lookup = await lookup_answer(client, config, model, body.message, query_embedding)
+        if answer_lookup.answer is not None:
+            return client, config, api_key, None, answer_lookup, answer_lookup.answer, conversation
+
+    # For standard+ clients with RAG, add document context
+    rag_chunks = []
+    if use_rag:
+        try:
+            from .rag import retrieve_chunks
+            rag_chunks = await retrieve_chunks(client.id, body.message, query_embedding=query_embedding)
+        except Exception as e:
+            print(f"RAG retrieval error: {e}")
+            rag_chunks = []
+
+    # System prompt with client customization, summary, history and RAG chunks, packed
+    # into the model's prompt token budget
+    messages, prompt_tokens, rag_chunks_used = build_chat_messages(
+        gate.prompt_header,
+        body.message,
+        prompt_budget(model),
+        rag_chunks=rag_chunks,
+        summary=conversation.summary,
+        history=conversation.prompt_messages()
+    )
+    if rag_chunks and not rag_chunks_used:
+        print(f"[Chat] No RAG chunk fits the prompt budget ({prompt_tokens} tokens already used)")
+
+    # Track RAG query (write-behind; flushed with the rest of today's usage)
+    if rag_chunks_used:
+        await usage_aggregator.log(client.id, rag_queries=1)
+
+    # Always use xAI format (white-labeled)
+    payload = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": settings.chat_max_reply_tokens,
+        "temperature": 0.7
+    }
+    return client, config, api_key, payload, answer_lookup, None, conversation
+
+
+def _xai_headers(api_key: str) -> dict:
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def _xai_error_detail(response_body: bytes) -> str:
+    """Pull the upstream error message out of an xAI error body"""
+    error_detail = "AI service error"
     try:
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Always use xAI format (white-labeled)
-        payload = {
+        error_data = json.loads(response_body)
+        error_detail = error_data.get("error", {}).get("message", error_detail)
+    except Exception:
+        pass
+    return error_detail
+
+
+def _upstream_tokens(usage: Optional[dict], payload: Optional[dict], response_text: str) -> int:
+    """Tokens billed for a completion: xAI's usage numbers, else our own count"""
+    if usage and usage.get("total_tokens") is not None:
+        return int(usage["total_tokens"])
+    if usage and (usage.get("prompt_tokens") is not None or usage.get("completion_tokens") is not None):
+        return int(usage.get("prompt_tokens") or 0) + int(usage.get("completion_tokens") or 0)
+    if payload is None:
+        return 0  # FAQ or cached answer: no upstream call
+    # No usage reported (e.g. the stream was cut off): count what was sent and received
+    return sum(message_tokens(m) for m in payload["messages"]) + count_tokens(response_text)
+
+
+async def _summarize_history(api_key: str, model: str, client_id: UUID, summary: str, messages: list) -> str:
+    """Fold older conversation turns into the rolling summary (runs in the background)"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    response = await get_http_client().post(
+        XAI_CHAT_COMPLETIONS_URL,
+        headers=_xai_headers(api_key),
+        json={
             "model": model,
             "messages": [
-                {"role": "system", "content": base_prompt},
-                {"role": "user", "content": body.message}
+                {
+                    "role": "system",
+                    "content": "Update the summary of a support chat between a visitor and an assistant. "
+                               "Keep names, facts, preferences and open questions. Reply with the summary only, "
+                               f"under {settings.conversation_summary_max_chars // 6} words."
+                },
+                {"role": "user", "content": f"Summary so far:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"}
             ],
-            "max_tokens": 500,
-            "temperature": 0.7
-        }
-        
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=payload,
-            timeout=30
+            "max_tokens": 300,
+            "temperature": 0.2
+        },
+        timeout=30.0
+    )
+    response.raise_for_status()
+    result = response.json()
+    await usage_aggregator.log(client_id, tokens=_upstream_tokens(result.get("usage"), None, ""))
+    return result["choices"][0]["message"]["content"]
+
+
+async def _record_chat_turn(conversation, config, user_message: str, response_text: str, tokens: int):
+    """Remember the turn, queue the conversation log and bump today's usage counters"""
+    api_key, model = _resolve_ai_credentials(config)
+    conversation_store.remember(
+        conversation, user_message, response_text,
+        summarize=functools.partial(_summarize_history, api_key, model, conversation.client_id)
+    )
+
+    # Store conversation (for conversation logs feature); written in batches off the request path
+    await conversation_log.log(ChatTurn(conversation.client_id, user_message, response_text, conversation.conversation_id))
+
+    # Track usage (write-behind; see usage_aggregator)
+    await usage_aggregator.log(conversation.client_id, messages=1, tokens=tokens)
+
+
+async def _record_streamed_chat_turn(conversation, config, user_message: str, stream_state: dict):
+    """Background task run once an SSE stream has finished (or the visitor went away)"""
+    response_text = "".join(stream_state["chunks"])
+    if not response_text:
+        return
+    try:
+        tokens = _upstream_tokens(stream_state["usage"], stream_state["payload"], response_text)
+        await _record_chat_turn(conversation, config, user_message, response_text, tokens)
+    except Exception as e:
+        print(f"[Chat Stream] Failed to record chat turn: {e}")
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _chat_audio(body: ChatRequest, client_id: UUID, config: ClientConfig, api_key: str, response_text: str) -> tuple:
+    """
+    Voice for a chat reply, per audio_mode (request field, else TTS_AUDIO_MODE).
+    Returns (audio_url, audio_job_id, audio_stream_url):
+      inline   - synthesize now; base64 WAV data URL (synthesis adds to chat latency)
+      deferred - start a background job; audio_url points at /api/tts/{job_id} and
+                 audio_stream_url at the progressive relay /api/tts/{job_id}/stream
+                 (inline instead without app startup, e.g. Mangum)
+      none     - no audio
+    """
+    audio_mode = body.audio_mode or settings.tts_audio_mode
+    if audio_mode == "deferred" and not deferred_available():
+        audio_mode = "inline"  # No long-lived loop to run the job, or to answer /api/tts/{job_id}
+    if audio_mode == "none" or not api_key:
+        return None, None, None
+
+    voice = resolve_tts_voice(config)
+    audio_format = resolve_tts_audio_format(body.audio_format, config)
+
+    if audio_mode == "deferred":
+        job = create_tts_job(client_id, response_text, api_key, voice, audio_format)
+        job_url = f"{settings.backend_public_url}/api/tts/{job.id}"
+        return job_url, job.id, f"{job_url}/stream"
+
+    # Generate TTS audio URL (voice responses)
+    audio_url = None
+    try:
+        print(f"[TTS] Generating audio for: {response_text[:50]}...")
+
+        # Generate audio using Voice API (white-labeled)
+        pcm_audio = await generate_tts_audio(
+            text=response_text,
+            api_key=api_key,
+            voice=voice
         )
-        
-        if response.status_code != 200:
-            error_detail = "AI service error"
-            try:
-                error_data = response.json()
-                error_detail = error_data.get("error", {}).get("message", error_detail)
-            except:
-                pass
-            raise HTTPException(
-                status_code=502,
-                detail=error_detail
-            )
-        
-        result = response.json()
-        
-        # Extract response text (always xAI format)
-        response_text = result["choices"][0]["message"]["content"]
-        
-        # Store conversation (for conversation logs feature)
-        try:
-            # Create or get conversation (simplified: one per session, or create new)
-            conversation = Conversation(
-                client_id=client.id,
-                started_at=datetime.utcnow(),
-                last_message_at=datetime.utcnow(),
-                message_count=2  # User + assistant
-            )
-            db.add(conversation)
-            db.flush()
-            
-            # Store user message
-            user_msg = ConversationMessage(
-                conversation_id=conversation.id,
-                role='user',
-                content=body.message
-            )
-            db.add(user_msg)
-            
-            # Store assistant response
-            assistant_msg = ConversationMessage(
-                conversation_id=conversation.id,
-                role='assistant',
-                content=response_text
-            )
-            db.add(assistant_msg)
-            
-            db.commit()
-        except Exception as e:
-            # Don't fail chat if conversation logging fails
-            print(f"[Conversation] Failed to store conversation: {e}")
-            db.rollback()
-        
-        # Track usage
-        today = date.today()
-        usage = db.query(UsageRecord).filter(
-            UsageRecord.client_id == client.id,
-            UsageRecord.date == today
-        ).first()
-        
-        if not usage:
-            usage = UsageRecord(
-                client_id=client.id,
-                date=today,
-                message_count=0,
-                token_count=0,
-                rag_query_count=0
-            )
-            db.add(usage)
-        
-        usage.message_count = (usage.message_count or 0) + 1
-        # Estimate tokens (rough approximation)
-        usage.token_count = (usage.token_count or 0) + len(body.message.split()) + len(response_text.split())
-        
-        db.commit()
-        
-        # Generate TTS audio URL (voice responses)
+
+        if pcm_audio:
+            # Convert PCM to WAV (resampled/compressed per audio_format) for browser compatibility
+            wav_audio = await asyncio.to_thread(convert_pcm_to_wav, pcm_audio, audio_format=audio_format)
+
+            # Convert to base64 data URL
+            audio_base64 = base64.b64encode(wav_audio).decode('utf-8')
+            audio_url = f"data:audio/wav;base64,{audio_base64}"
+            print(f"[TTS] Successfully generated audio ({len(wav_audio)} bytes)")
+        else:
+            print(f"[TTS] Failed to generate audio")
+    except Exception as e:
+        # TTS is optional - don't fail if it doesn't work
+        print(f"[TTS] TTS generation failed (non-fatal): {e}")
+        import traceback
+        traceback.print_exc()
         audio_url = None
-        try:
-            # Generate voice audio (always available)
-            if api_key:
-                print(f"[TTS] Generating audio for: {response_text[:50]}...")
-                
-                # Generate audio using Voice API (white-labeled)
-                # Voice options: Ara (default), Leo, Rex, Sal, Eve
-                # Voice is configurable per-client via ClientConfig.tts_voice field
-                voice = getattr(config, 'tts_voice', None) or os.getenv('XAI_TTS_VOICE', 'Ara')
-                if voice not in ['Ara', 'Leo', 'Rex', 'Sal', 'Eve']:
-                    voice = 'Ara'  # Fallback to safe default
-                
-                pcm_audio = await generate_tts_audio(
-                    text=response_text,
-                    api_key=api_key,
-                    voice=voice
+    return audio_url, None, None
+
+
+@app.post("/api/chat", response_model=ChatResponse)
+@limiter.limit("120/minute")
+async def chat(
+    request: Request,
+    body: ChatRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Multi-tenant chat endpoint
+    Called by widget with client_id
+    """
+    client, config, api_key, payload, answer_lookup, ready_answer, conversation = await _prepare_chat(request, body, db)
+
+    try:
+        if ready_answer is not None:
+            response_text = ready_answer
+            tokens = 0
+        else:
+            response = await get_http_client().post(
+                XAI_CHAT_COMPLETIONS_URL,
+                headers=_xai_headers(api_key),
+                json=payload,
+                timeout=30.0
+            )
+
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=502,
+                    detail=_xai_error_detail(response.content)
                 )
-                
-                if pcm_audio:
-                    # Convert PCM to WAV for browser compatibility
-                    wav_audio = convert_pcm_to_wav(pcm_audio)
-                    
-                    # Convert to base64 data URL
-                    audio_base64 = base64.b64encode(wav_audio).decode('utf-8')
-                    audio_url = f"data:audio/wav;base64,{audio_base64}"
-                    print(f"[TTS] Successfully generated audio ({len(wav_audio)} bytes)")
-                else:
-                    print(f"[TTS] Failed to generate audio")
-        except Exception as e:
-            # TTS is optional - don't fail if it doesn't work
-            print(f"[TTS] TTS generation failed (non-fatal): {e}")
-            import traceback
-            traceback.print_exc()
-            audio_url = None
-        
+
+            result = response.json()
+
+            # Extract response text (always xAI format)
+            response_text = result["choices"][0]["message"]["content"]
+            tokens = _upstream_tokens(result.get("usage"), payload, response_text)
+            await store_answer(answer_lookup, response_text)
+
+        await _record_chat_turn(conversation, config, body.message, response_text, tokens)
+
+        audio_url, audio_job_id, audio_stream_url = await _chat_audio(body, client.id, config, api_key, response_text)
+
         return ChatResponse(
             response=response_text,
             mood="neutral",
             sentiment_data={},
-            audio_url=audio_url
+            audio_url=audio_url,
+            audio_job_id=audio_job_id,
+            audio_stream_url=audio_stream_url,
+            conversation_id=conversation.conversation_id
         )
-        
-    except requests.exceptions.Timeout:
+
+    except HTTPException:
+        raise
+    except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="AI service timeout")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/chat/stream")
+@limiter.limit("120/minute")
+async def chat_stream(
+    request: Request,
+    body: ChatRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Streaming variant of /api/chat (Server-Sent Events)
+    Forwards xAI token deltas as they arrive:
+      event: delta  data: {"content": "..."}
+      event: done   data: {"response": "<full text>", "mood": "neutral", "conversation_id": "..."}
+      event: error  data: {"detail": "..."}
+    Conversation logging and usage tracking run after the stream finishes.
+    No TTS here; the widget can fall back to its own voice playback.
+    """
+    client, config, api_key, payload, answer_lookup, ready_answer, conversation = await _prepare_chat(request, body, db)
+    conversation_id = str(conversation.conversation_id)
+    stream_state = {"chunks": [], "usage": None, "payload": payload}
+
+    async def event_stream():
+        if ready_answer is not None:
+            stream_state["chunks"].append(ready_answer)
+            yield _sse_event("delta", {"content": ready_answer})
+            yield _sse_event("done", {"response": ready_answer, "mood": "neutral", "conversation_id": conversation_id})
+            return
+
+        try:
+            async with get_http_client().stream(
+                "POST",
+                XAI_CHAT_COMPLETIONS_URL,
+                headers=_xai_headers(api_key),
+                json={**payload, "stream": True, "stream_options": {"include_usage": True}},
+                timeout=httpx.Timeout(30.0, read=60.0)
+            ) as response:
+                if response.status_code != 200:
+                    yield _sse_event("error", {"detail": _xai_error_detail(await response.aread())})
+                    return
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        obj = json.loads(data)
+                    except json.JSONDecodeError:
+                        continue
+                    if obj.get("usage"):
+                        stream_state["usage"] = obj["usage"]  # Final chunk
+                    choices = obj.get("choices") or []
+                    delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                    if delta:
+                        stream_state["chunks"].append(delta)
+                        yield _sse_event("delta", {"content": delta})
+        except httpx.TimeoutException:
+            yield _sse_event("error", {"detail": "AI service timeout"})
+            return
+        except Exception as e:
+            print(f"[Chat Stream] Upstream stream failed: {e}")
+            yield _sse_event("error", {"detail": "AI service error"})
+            return
+
+        response_text = "".join(stream_state["chunks"])
+        yield _sse_event("done", {"response": response_text, "mood": "neutral", "conversation_id": conversation_id})
+        await store_answer(answer_lookup, response_text)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Don't let proxies buffer the stream
+        },
+        # Runs after the stream ends, including when the visitor disconnects mid-answer
+        background=BackgroundTask(_record_streamed_chat_turn, conversation, config, body.message, stream_state),
+    )
+
+
+async def _tts_job_wav(job, audio_format: Optional[str]) -> bytes:
+    """A finished job's WAV, re-encoded when the caller asks for another format than the job's"""
+    if not audio_format or audio_format == job.audio_format:
+        return job.audio
+    return await asyncio.to_thread(convert_pcm_to_wav, b"".join(job.pcm_chunks), audio_format=audio_format)
+
+
+@app.get("/api/tts/{job_id}")
+async def get_tts_audio(
+    job_id: str,
+    wait: float = settings.tts_job_max_wait_seconds,
+    format: Optional[str] = Query(None, pattern=AUDIO_FORMAT_PATTERN)
+):
+    """
+    Fetch audio for a deferred TTS job (public; job ids are unguessable)
+    Waits up to `wait` seconds for synthesis so a plain <audio src> just works.
+    wait=0 polls instead: 202 while pending, 200 audio/wav once ready.
+    format overrides the encoding chosen when the job was created.
+    """
+    job = get_tts_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Audio not found or expired")
+
+    await wait_for_tts_job(job, min(max(wait, 0.0), settings.tts_job_max_wait_seconds))
+
+    if job.status == JOB_READY:
+        return Response(
+            content=await _tts_job_wav(job, format),
+            media_type="audio/wav",
+            headers={"Cache-Control": f"private, max-age={settings.tts_job_ttl_seconds}"}
+        )
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=502, detail="Audio generation failed")
+    return JSONResponse(
+        status_code=202,
+        content={"status": job.status, "job_id": job.id},
+        headers={"Retry-After": "1"}
+    )
+
+
+@app.get("/api/tts/{job_id}/stream")
+async def stream_tts_job_audio(job_id: str, format: Optional[str] = Query(None, pattern=AUDIO_FORMAT_PATTERN)):
+    """
+    Relay a deferred TTS job's audio as chunked WAV while it is still being synthesized
+    Playback can start after the first PCM delta instead of after the last one.
+    Each chunk is written only once the client has taken the previous one.
+    Chunks are encoded on the fly in the job's format (or `format`).
+    """
+    job = get_tts_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Audio not found or expired")
+
+    # Already finished: plain WAV with a real length is friendlier to media elements
+    if job.status == JOB_READY:
+        return Response(
+            content=await _tts_job_wav(job, format),
+            media_type="audio/wav",
+            headers={"Cache-Control": f"private, max-age={settings.tts_job_ttl_seconds}"}
+        )
+    if job.status == JOB_FAILED and not job.pcm_chunks:
+        raise HTTPException(status_code=502, detail="Audio generation failed")
+
+    audio_format = format or job.audio_format
+
+    async def audio_stream():
+        encoder = AudioStreamEncoder(audio_format)
+        yield wav_header(None, **wav_format(audio_format))  # Unknown length: synthesis is still running
+        async for chunk in iter_tts_job_pcm(job, idle_timeout=settings.tts_job_max_wait_seconds):
+            encoded = encoder.encode(chunk)
+            if encoded:
+                yield encoded
+        tail = encoder.flush()
+        if tail:
+            yield tail
+
+    return StreamingResponse(
+        audio_stream(),
+        media_type="audio/wav",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Don't let proxies buffer the stream
+        }
+    )
+
+
 # ============== Embed Snippet ==============
 
 @app.get("/api/embed-snippet", response_model=EmbedSnippet)
@@ -921,65 +940,6 @@ async def get_embed_snippet(
 
 # ============== Documents (Premium) ==============
 
-async def process_document_background(
-    client_id: UUID,
-    doc_id: UUID,
-    content: bytes,
-    file_type: str,
-    filename: str
-):
-    """
-    Background task to process document (runs on Railway)
-    Updates document status when complete
-    """
-    from .database import SessionLocal
-    from .rag import process_document
-    
-    # Get a new database session for background task
-    db = SessionLocal()
-    try:
-        # Get document
-        doc = db.query(Document).filter(Document.id == doc_id).first()
-        if not doc:
-            print(f"[Background] Document {doc_id} not found")
-            return
-        
-        # Update status to PROCESSING
-        doc.status = DocumentStatus.PROCESSING
-        db.commit()
-        
-        # Process document
-        chunk_count = await process_document(
-            client_id=client_id,
-            doc_id=doc_id,
-            content=content,
-            file_type=file_type,
-            filename=filename
-        )
-        
-        # Update status to COMPLETED
-        doc.status = DocumentStatus.COMPLETED
-        doc.chunk_count = chunk_count
-        doc.processed_at = datetime.utcnow()
-        db.commit()
-        
-        print(f"[Background] Document {doc_id} processed successfully: {chunk_count} chunks")
-        
-    except Exception as e:
-        # Update status to FAILED
-        db.rollback()
-        doc = db.query(Document).filter(Document.id == doc_id).first()
-        if doc:
-            doc.status = DocumentStatus.FAILED
-            doc.error_message = str(e)
-            db.commit()
-        print(f"[Background] Document {doc_id} processing failed: {e}")
-        import traceback
-        traceback.print_exc()
-    finally:
-        db.close()
-
-
 @app.post("/api/documents", response_model=DocumentResponse)
 async def upload_document(
     file: UploadFile = File(...),
@@ -988,8 +948,10 @@ async def upload_document(
 ):
     """
     Upload a document for RAG (Standard+ only)
-    Processing runs in-request so documents complete on Railway (BackgroundTasks
-    often never run after response on PaaS, leaving docs stuck in PENDING).
+    The upload is stored and queued in ingestion_jobs (durable, unlike BackgroundTasks
+    on PaaS); the document comes back PENDING and its status/progress fields are
+    updated by the ingestion workers. Without a worker in this process (no app
+    startup, e.g. Mangum) the upload is processed before the response.
     """
     # Check tier
     if client.tier == TierEnum.BASIC:
@@ -1042,73 +1004,78 @@ async def upload_document(
             detail=f"File type not supported. Supported: PDF, DOCX, TXT, MD, HTML, CSV, XLSX, XLS"
         )
     
-    # Read file
-    contents = await file.read()
-    file_size = len(contents)
-    
-    # Max 500MB; very large files are processed in-request and may timeout on Railway (Issue 5)
+    # Max 500MB (Issue 5)
     MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
-    if file_size > MAX_FILE_SIZE:
+    
+    # Stream the upload to storage in fixed-size chunks (hashing it and enforcing the
+    # size limit on the way), then create the document and its job in one transaction
+    doc_id = uuid4()
+    try:
+        file_path, file_size, content_hash = await asyncio.to_thread(spool_upload, doc_id, file.file, MAX_FILE_SIZE)
+    except UploadTooLarge:
         raise HTTPException(
             status_code=400, 
-            detail=f"File too large (max {MAX_FILE_SIZE // (1024*1024)}MB). "
-                   "Large files are processed asynchronously and may take several minutes."
+            detail=f"File too large (max {MAX_FILE_SIZE // (1024*1024)}MB)."
         )
-    
-    # Create document record and process in-request (so Railway actually runs it)
     doc = Document(
+        id=doc_id,
         client_id=client.id,
         filename=file.filename,
         file_type=file_type,
         file_size=file_size,
+        content_hash=content_hash,
         status=DocumentStatus.PENDING,
     )
     db.add(doc)
-    db.commit()
-    db.refresh(doc)
-    doc_id = doc.id
-    print(f"[Documents] Created doc id={doc_id} filename={file.filename} size={file_size}")
-
-    try:
-        # Mark processing so we never leave PENDING if something fails before process_document
-        doc.status = DocumentStatus.PROCESSING
+    
+    # Same bytes as a document already processed (and still in the vector store):
+    # share its chunks, skip extraction
+    from .rag import document_chunks_stored
+    source = _processed_duplicate(db, doc)
+    if source is not None and await document_chunks_stored(client.id, source.id) and _reuse_processed_document(db, doc, source):
         db.commit()
+        remove_upload(file_path)
         db.refresh(doc)
-        print(f"[Documents] Processing doc id={doc_id} ...")
-
-        from .rag import process_document
-        chunk_count = await process_document(
-            client_id=client.id,
-            doc_id=doc_id,
-            content=contents,
-            file_type=file_type,
-            filename=file.filename,
-        )
-        doc.status = DocumentStatus.COMPLETED
-        doc.chunk_count = chunk_count
-        doc.processed_at = datetime.utcnow()
+        print(f"[Documents] Reused chunks for doc id={doc_id} filename={file.filename} size={file_size}")
+        return doc
+    try:
+        job = enqueue_document(db, doc, file_path)
         db.commit()
-        db.refresh(doc)
-        print(f"[Documents] Processed doc id={doc_id} filename={doc.filename} chunks={chunk_count}")
-    except Exception as e:
+    except Exception:
         db.rollback()
-        # Ensure doc is never left PENDING or PROCESSING; mark FAILED so UI shows error
-        doc = db.query(Document).filter(Document.id == doc_id).first()
-        if doc:
-            doc.status = DocumentStatus.FAILED
-            doc.error_message = str(e)[:500]
-            db.commit()
-            db.refresh(doc)
-        print(f"[Documents] Failed doc id={doc_id} filename={file.filename}: {e}")
-        import traceback
-        traceback.print_exc()
-        # Return doc so client gets 200 with failed status; UI can show error_message
-        if not doc:
-            raise HTTPException(status_code=500, detail=f"Document processing failed: {e}")
-
+        remove_upload(file_path)
+        raise
+    print(f"[Documents] Queued doc id={doc_id} filename={file.filename} size={file_size}")
+    if settings.ingestion_workers > 0 and not ingestion_worker.started():
+        # No worker in this process (app startup never ran, e.g. Mangum): process it now
+        await ingestion_worker.process_job_inline(job.id)
+    db.refresh(doc)
     return doc
 
 
+def _processed_duplicate(db: Session, doc: Document) -> Optional[Document]:
+    """A processed document of the same client with the same content hash"""
+    return db.query(Document).filter(
+        Document.client_id == doc.client_id,
+        Document.content_hash == doc.content_hash,
+        Document.status == DocumentStatus.COMPLETED,
+        Document.id != doc.id,
+    ).order_by(Document.processed_at.desc()).first()
+
+
+def _reuse_processed_document(db: Session, doc: Document, source: Document) -> bool:
+    """Complete `doc` with the chunks of `source` (see _processed_duplicate)"""
+    # 0 for documents processed before the chunk registry: those are processed as usual
+    if not copy_references(db, doc.client_id, source.id, doc.id):
+        return False
+    doc.status = DocumentStatus.COMPLETED
+    doc.chunk_count = source.chunk_count
+    doc.processed_at = datetime.utcnow()
+    doc.progress_stage = "completed"
+    doc.progress_percent = 100
+    return True
+
+
 @app.get("/api/documents", response_model=DocumentList)
 async def list_documents(
     client: Client = Depends(get_client_from_api_key),
@@ -1137,15 +1104,18 @@ async def delete_document(
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete from vector store
+    # Release its chunks (dropping vectors nothing else uses) in the same transaction as
+    # the delete: if that fails the document stays, so its references are never leaked
     try:
         from .rag import delete_document_embeddings
-        await delete_document_embeddings(client.id, doc.id)
+        await delete_document_embeddings(client.id, doc.id, db=db)
+        db.delete(doc)  # Cascades to its ingestion job
+        db.commit()
     except Exception as e:
-        print(f"Failed to delete embeddings: {e}")
-    
-    db.delete(doc)
-    db.commit()
+        db.rollback()
+        print(f"[Documents] Delete of doc id={doc.id} failed: {e}")
+        raise HTTPException(status_code=503, detail="Could not delete document, please retry")
+    remove_upload(upload_path(doc.id))  # Still there if it was never processed
     
     return {"status": "deleted"}
 
@@ -1155,31 +1125,39 @@ async def delete_document(
 @app.get("/api/usage", response_model=UsageSummary)
 async def get_usage(
     days: int = 30,
-    client: Client = Depends(get_client_from_api_key),
-    db: Session = Depends(get_db)
+    client: Client = Depends(get_client_from_api_key_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get usage statistics for the last N days"""
     from datetime import timedelta
     
     start_date = date.today() - timedelta(days=days)
     
-    records = db.query(UsageRecord).filter(
+    records = (await db.execute(select(UsageRecord).where(
         UsageRecord.client_id == client.id,
         UsageRecord.date >= start_date
-    ).order_by(UsageRecord.date.desc()).all()
+    ).order_by(UsageRecord.date.desc()))).scalars().all()
     
-    total_messages = sum(r.message_count for r in records)
-    total_tokens = sum(r.token_count for r in records)
-    total_rag = sum(r.rag_query_count for r in records)
+    # Flushed rows plus this worker's not-yet-flushed counts
+    by_day = {r.date: [r.message_count, r.token_count, r.rag_query_count] for r in records}
+    for day, deltas in usage_aggregator.pending_for(client.id).items():
+        if day >= start_date:
+            current = by_day.setdefault(day, [0, 0, 0])
+            for i in range(3):
+                current[i] += deltas[i]
+
+    total_messages = sum(counts[0] for counts in by_day.values())
+    total_tokens = sum(counts[1] for counts in by_day.values())
+    total_rag = sum(counts[2] for counts in by_day.values())
     
     daily = [
         UsageResponse(
-            date=str(r.date),
-            message_count=r.message_count,
-            token_count=r.token_count,
-            rag_query_count=r.rag_query_count
+            date=str(day),
+            message_count=counts[0],
+            token_count=counts[1],
+            rag_query_count=counts[2]
         )
-        for r in records
+        for day, counts in sorted(by_day.items(), reverse=True)
     ]
     
     return UsageSummary(
@@ -1209,6 +1187,8 @@ async def create_faq(
     db.add(faq)
     db.commit()
     db.refresh(faq)
+    await index_faq(client.id, faq)
+    invalidate_answers(client.id)
     return faq
 
 
@@ -1251,6 +1231,8 @@ async def update_faq(
     
     db.commit()
     db.refresh(faq)
+    await index_faq(client.id, faq)
+    invalidate_answers(client.id)
     return faq
 
 
@@ -1271,6 +1253,8 @@ async def delete_faq(
     
     db.delete(faq)
     db.commit()
+    await remove_faq(client.id, faq_id)
+    invalidate_answers(client.id)
     
     return {"status": "deleted"}
 
@@ -6,7 +6,7 @@ import uuid
 from datetime import datetime, date
 from sqlalchemy import (
     Column, String, Text, Integer, DateTime, Date, 
-    ForeignKey, JSON, Boolean, Enum as SQLEnum
+    ForeignKey, JSON, Boolean, Index, Enum as SQLEnum
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
@@ -39,7 +39,7 @@ class Client(Base):
     
     # Authentication
     api_key = Column(String(64), unique=True, nullable=False, index=True)
-    api_key_hash = Column(String(128), nullable=False)  # Hashed version for verification
+    api_key_hash = Column(String(128), nullable=False, index=True)  # Hashed version for verification (auth lookup)
     
     # Account info
     email = Column(String(255), unique=True, nullable=False, index=True)
@@ -106,6 +106,7 @@ class ClientConfig(Base):
     
     # TTS Voice Configuration (xAI Grok Voice Agent)
     tts_voice = Column(String(20), nullable=True)  # 'Ara', 'Leo', 'Rex', 'Sal', 'Eve' (default: 'Ara')
+    tts_audio_format = Column(String(20), nullable=True)  # e.g. 'pcm_24k', 'mulaw_8k', 'adpcm_16k' (default: TTS_AUDIO_FORMAT)
     
     # Widget behavior
     position = Column(String(20), default="bottom-right", nullable=False)  # bottom-right, bottom-left, top-right, top-left, center
@@ -170,6 +171,7 @@ class Document(Base):
     filename = Column(String(255), nullable=False)
     file_type = Column(String(50), nullable=False)  # pdf, docx, txt, md, html, csv, xlsx, xls
     file_size = Column(Integer, nullable=False)  # bytes
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 of the uploaded bytes
     
     # Processing status
     status = Column(
@@ -180,6 +182,10 @@ class Document(Base):
     chunk_count = Column(Integer, default=0, nullable=False)
     error_message = Column(Text, nullable=True)
     
+    # Ingestion progress (written by the ingestion worker)
+    progress_stage = Column(String(50), nullable=True)  # queued, extracting, embedding, retrying, completed, failed
+    progress_percent = Column(Integer, default=0, nullable=False)
+    
     # Timestamps
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     processed_at = Column(DateTime, nullable=True)
@@ -191,6 +197,70 @@ class Document(Base):
         return f"<Document {self.filename} ({self.status.value})>"
 
 
+class IngestionJobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class IngestionJob(Base):
+    """
+    Durable document ingestion queue (see app/ingestion.py)
+    Workers claim queued jobs with FOR UPDATE SKIP LOCKED; a running job whose
+    heartbeat goes stale is claimed again.
+    """
+    __tablename__ = "ingestion_jobs"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    client_id = Column(UUID(as_uuid=True), ForeignKey("clients.id", ondelete="CASCADE"), nullable=False)
+    
+    # Stored upload to ingest
+    file_path = Column(String(1024), nullable=False)
+    file_type = Column(String(50), nullable=False)
+    filename = Column(String(255), nullable=False)
+    
+    # Queue state
+    status = Column(String(20), default=IngestionJobStatus.QUEUED.value, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=5, nullable=False)
+    run_after = Column(DateTime, default=datetime.utcnow, nullable=False)  # Retry backoff
+    locked_by = Column(String(255), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_ingestion_jobs_claim", "status", "run_after"),
+    )
+    
+    def __repr__(self):
+        return f"<IngestionJob {self.id} ({self.status}, attempt {self.attempts})>"
+
+
+class DocumentChunk(Base):
+    """
+    Per-client chunk registry (see app/chunk_registry.py)
+    One row per document and chunk; chunks are stored in Chroma under the hash of
+    their text, and a chunk's reference count is the number of rows naming it.
+    document_id has no foreign key: rows are released explicitly, so the vectors
+    they leave unreferenced can be deleted along with them.
+    """
+    __tablename__ = "document_chunks"
+
+    document_id = Column(UUID(as_uuid=True), primary_key=True)
+    chunk_hash = Column(String(64), primary_key=True)  # SHA-256 of the chunk text; its Chroma id
+    client_id = Column(UUID(as_uuid=True), ForeignKey("clients.id", ondelete="CASCADE"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_document_chunks_client_hash", "client_id", "chunk_hash"),
+    )
+
+
 class UsageRecord(Base):
     """
     Daily usage tracking for billing and analytics
@@ -211,11 +281,10 @@ class UsageRecord(Base):
     # Relationship
     client = relationship("Client", back_populates="usage_records")
     
-    class Meta:
-        # Unique constraint on client_id + date
-        __table_args__ = (
-            {"postgresql_concurrently": True}
-        )
+    # One row per client per day; usage flushes upsert against it
+    __table_args__ = (
+        Index("uq_usage_records_client_date", "client_id", "date", unique=True),
+    )
     
     def __repr__(self):
         return f"<UsageRecord {self.client_id} on {self.date}>"
@@ -235,6 +304,10 @@ class Conversation(Base):
     last_message_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     message_count = Column(Integer, default=0, nullable=False)
     
+    # Rolling summary of the oldest `summarized_messages` messages (see app/conversation_memory.py)
+    summary = Column(Text, nullable=True)
+    summarized_messages = Column(Integer, default=0, nullable=False)
+    
     # Optional: User identifier (if tracking specific users)
     user_id = Column(String(255), nullable=True, index=True)
     
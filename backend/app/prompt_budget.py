@@ -0,0 +1,119 @@
+"""
+Token-budgeted chat prompts
+Counts tokens with tiktoken and packs the chat prompt into a per-model budget:
+the system prompt, conversation summary and visitor message always go in,
+then recent history (newest first, up to half of what is left) and RAG chunks
+in relevance order until the budget is used up.
+
+The tokenizer (PROMPT_TOKENIZER_ENCODING) is only an approximation of the
+upstream model's. tiktoken downloads its encoding file on first use; if that
+is not possible the counter falls back to a characters-per-token estimate.
+"""
+import threading
+from typing import List, Optional, Tuple
+
+from .config import get_settings
+
+settings = get_settings()
+
+# Role/separator tokens each chat message costs on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+# Fallback estimate when no tokenizer is available (English text averages ~4 chars/token)
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_failed = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is not None or _encoding_failed:
+        return _encoding
+    with _encoding_lock:
+        if _encoding is None and not _encoding_failed:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(settings.prompt_tokenizer_encoding)
+            except Exception as e:
+                _encoding_failed = True
+                print(f"[Prompt] tiktoken unavailable, estimating tokens from length: {e}")
+    return _encoding
+
+
+def warm_tokenizer():
+    """Load (and if needed download) the encoding ahead of the first chat (blocking)"""
+    _get_encoding()
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: dict) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def prompt_budget(model: str) -> int:
+    """Prompt token budget for a model (PROMPT_TOKEN_BUDGETS overrides the default)"""
+    return int(settings.prompt_token_budgets.get(model, settings.prompt_token_budget))
+
+
+def build_chat_messages(
+    system_prompt: str,
+    user_message: str,
+    budget: int,
+    rag_chunks: Optional[List[str]] = None,
+    summary: str = "",
+    history: Optional[List[dict]] = None,
+) -> Tuple[List[dict], int, int]:
+    """
+    Chat messages that fit in `budget` prompt tokens.
+    Returns (messages, prompt_tokens, rag_chunks_used).
+    """
+    if summary:
+        system_prompt += f"""
+
+SUMMARY OF THE CONVERSATION SO FAR:
+{summary}
+"""
+    user = {"role": "user", "content": user_message}
+    used = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS + message_tokens(user)
+
+    # Most recent turns first, at most half of what the fixed parts leave
+    kept_history: List[dict] = []
+    history_budget = max(0, budget - used) // 2
+    for message in reversed(history or []):
+        cost = message_tokens(message)
+        if cost > history_budget:
+            break
+        history_budget -= cost
+        used += cost
+        kept_history.append(message)
+    kept_history.reverse()
+    if kept_history and kept_history[0]["role"] == "assistant":
+        used -= message_tokens(kept_history.pop(0))  # Start the window on a visitor message
+
+    # RAG chunks in relevance order while they fit
+    kept_chunks: List[str] = []
+    if rag_chunks:
+        header = "\n\nRELEVANT CONTEXT FROM COMPANY DOCUMENTS:\n"
+        footer = "\n\nUse this context to answer questions when relevant.\n"
+        frame = count_tokens(header + footer)
+        separator = count_tokens("\n\n---\n\n")
+        for chunk in rag_chunks:
+            cost = count_tokens(chunk) + (separator if kept_chunks else frame)
+            if used + cost > budget:
+                continue  # A shorter, less relevant chunk may still fit
+            used += cost
+            kept_chunks.append(chunk)
+        if kept_chunks:
+            system_prompt += header + "\n\n---\n\n".join(kept_chunks) + footer
+
+    messages = [{"role": "system", "content": system_prompt}, *kept_history, user]
+    return messages, used, len(kept_chunks)
@@ -2,10 +2,11 @@
 RAG (Retrieval Augmented Generation) Pipeline
 Document processing, embedding, and retrieval
 """
+import asyncio
+import json
 import os
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 from uuid import UUID
-import hashlib
 
 # Document processing
 from pypdf import PdfReader
@@ -15,9 +16,23 @@ from docx import Document as DocxDocument
 import chromadb
 
 from .config import get_settings
+from .answer_cache import invalidate_answers
+from .chunk_registry import add_references, chunk_id, document_chunk_ids, release_references
+from .chunker import iter_chunks
+from .database import SessionLocal
+from .embeddings import embedding_engine
+from .executors import extraction_pool, vector_pool
 
 settings = get_settings()
 
+# Chunks read from the spool, referenced, embedded and stored at a time (progress is reported per batch)
+EMBED_BATCH_SIZE = 64
+# Characters read per piece when streaming a TXT upload into the chunker
+TEXT_BLOCK_CHARS = 1024 * 1024
+
+# on_progress(stage, percent) for process_document
+ProgressCallback = Callable[[str, int], Awaitable[None]]
+
 # Initialize ChromaDB (PersistentClient for 0.4+; old Settings/chroma_db_impl is deprecated)
 chroma_client = chromadb.PersistentClient(path=settings.chroma_persist_directory)
 
@@ -27,11 +42,27 @@ def get_collection_name(client_id: UUID) -> str:
     return f"client_{str(client_id).replace('-', '_')}"
 
 
-def extract_text_from_pdf(content: bytes) -> str:
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Embed document texts in batches, reusing cached embeddings (blocking)"""
+    return embedding_engine.embed(texts)
+
+
+def embed_query(text: str) -> List[float]:
+    """Embed one query (blocking); lets chat embed a message once for every vector lookup"""
+    return embedding_engine.embed_query(text)
+
+
+# Extractors read the stored upload from disk, so only the extracted text is held in memory
+
+def _read_text(path: str) -> str:
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        return f.read()
+
+
+def extract_text_from_pdf(path: str) -> str:
     """Extract text from PDF file with error handling"""
     try:
-        import io
-        reader = PdfReader(io.BytesIO(content))
+        reader = PdfReader(path)  # Reads pages from the file on demand
         text = ""
         for page in reader.pages:
             page_text = page.extract_text()
@@ -42,25 +73,24 @@ def extract_text_from_pdf(content: bytes) -> str:
         raise ValueError(f"Failed to extract text from PDF: {e}")
 
 
-def extract_text_from_docx(content: bytes) -> str:
+def extract_text_from_docx(path: str) -> str:
     """Extract text from DOCX file with error handling"""
     try:
-        import io
-        doc = DocxDocument(io.BytesIO(content))
+        doc = DocxDocument(path)
         paragraphs = [para.text for para in doc.paragraphs if para.text.strip()]
         return "\n".join(paragraphs) or ""
     except Exception as e:
         raise ValueError(f"Failed to extract text from DOCX: {e}")
 
 
-def extract_text_from_txt(content: bytes) -> str:
+def extract_text_from_txt(path: str) -> str:
     """Extract text from TXT file"""
-    return content.decode('utf-8', errors='ignore')
+    return _read_text(path)
 
 
-def extract_text_from_markdown(content: bytes) -> str:
+def extract_text_from_markdown(path: str) -> str:
     """Extract text from Markdown file"""
-    text = content.decode('utf-8', errors='ignore')
+    text = _read_text(path)
     # Remove markdown syntax while preserving text
     import re
     # Remove headers
@@ -77,11 +107,12 @@ def extract_text_from_markdown(content: bytes) -> str:
     return text
 
 
-def extract_text_from_html(content: bytes) -> str:
+def extract_text_from_html(path: str) -> str:
     """Extract text from HTML file"""
     try:
         from bs4 import BeautifulSoup
-        soup = BeautifulSoup(content, 'html.parser')
+        with open(path, 'rb') as f:
+            soup = BeautifulSoup(f, 'html.parser')
         # Remove script and style elements
         for script in soup(["script", "style"]):
             script.decompose()
@@ -94,7 +125,7 @@ def extract_text_from_html(content: bytes) -> str:
     except ImportError:
         # Fallback to simple regex if BeautifulSoup not available
         import re
-        text = content.decode('utf-8', errors='ignore')
+        text = _read_text(path)
         text = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.DOTALL | re.IGNORECASE)
         text = re.sub(r'<style[^>]*>.*?</style>', '', text, flags=re.DOTALL | re.IGNORECASE)
         text = re.sub(r'<[^>]+>', ' ', text)
@@ -102,32 +133,30 @@ def extract_text_from_html(content: bytes) -> str:
         return text.strip()
 
 
-def extract_text_from_csv(content: bytes) -> str:
+def extract_text_from_csv(path: str) -> str:
     """Extract text from CSV file"""
     try:
         import csv
-        import io
         text_lines = []
-        reader = csv.reader(io.StringIO(content.decode('utf-8', errors='ignore')))
-        for row in reader:
-            # Combine row into readable text
-            row_text = ' | '.join(cell.strip() for cell in row if cell.strip())
-            if row_text:
-                text_lines.append(row_text)
+        with open(path, encoding='utf-8', errors='ignore', newline='') as f:
+            for row in csv.reader(f):
+                # Combine row into readable text
+                row_text = ' | '.join(cell.strip() for cell in row if cell.strip())
+                if row_text:
+                    text_lines.append(row_text)
         return '\n'.join(text_lines)
     except Exception:
         # Fallback to simple split
-        text = content.decode('utf-8', errors='ignore')
+        text = _read_text(path)
         return text.replace(',', ' | ').replace('\n', ' ')
 
 
-def extract_text_from_excel(content: bytes) -> str:
+def extract_text_from_excel(path: str) -> str:
     """Extract text from Excel file (XLSX/XLS)"""
     try:
         import pandas as pd
-        import io
         # Try reading as Excel
-        df = pd.read_excel(io.BytesIO(content))
+        df = pd.read_excel(path)
         # Convert to text representation
         text_lines = []
         for idx, row in df.iterrows():
@@ -141,8 +170,8 @@ def extract_text_from_excel(content: bytes) -> str:
         raise ValueError(f"Failed to extract text from Excel: {e}")
 
 
-def extract_text(content: bytes, file_type: str) -> str:
-    """Extract text from file based on type - supports multiple formats"""
+def extract_text(path: str, file_type: str) -> str:
+    """Extract text from a stored file based on type - supports multiple formats"""
     extractors = {
         'pdf': extract_text_from_pdf,
         'docx': extract_text_from_docx,
@@ -163,182 +192,210 @@ def extract_text(content: bytes, file_type: str) -> str:
             f"Supported: PDF, DOCX, TXT, MD, HTML, CSV, XLSX, XLS"
         )
     
-    return extractor(content)
+    return extractor(path)
 
 
 def chunk_text(text: str, chunk_size: int = 1500, overlap: int = 200) -> List[str]:
     """
-    Enhanced semantic chunking with paragraph and section awareness
-    Uses larger chunks (1500 chars) with smart overlap (200 chars)
-    Respects document structure better than simple sentence splitting
+    Paragraph- and sentence-aware chunks of a whole text (see app/chunker.py)
+    Chunks up to chunk_size characters, each starting with up to `overlap`
+    characters of the previous one's trailing sentences
     """
-    # First, try to split by paragraphs (double newlines or section markers)
-    paragraphs = []
-    for para in text.split('\n\n'):
-        para = para.strip().replace('\n', ' ')
-        if para:
-            paragraphs.append(para)
-    
-    # If no paragraph breaks, split by single newlines
-    if len(paragraphs) == 1:
-        paragraphs = [p.strip() for p in text.split('\n') if p.strip()]
-    
-    # If still single paragraph, fall back to sentence splitting
-    if len(paragraphs) == 1:
-        sentences = text.replace('\n', ' ').split('. ')
-        paragraphs = [s.strip() + '.' for s in sentences if s.strip()]
-    
-    chunks = []
-    current_chunk = ""
-    
-    for para in paragraphs:
-        para = para.strip()
-        if not para:
-            continue
-        
-        # If paragraph fits, add it
-        if len(current_chunk) + len(para) + 1 < chunk_size:
-            current_chunk += para + " " if current_chunk else para
-        else:
-            # Save current chunk if it has content
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            
-            # Handle paragraphs larger than chunk_size
-            if len(para) > chunk_size:
-                # Split large paragraph by sentences
-                para_sentences = para.split('. ')
-                temp_chunk = ""
-                
-                for sent in para_sentences:
-                    sent = sent.strip()
-                    if not sent:
-                        continue
-                    sent = sent + '.' if not sent.endswith('.') else sent
-                    
-                    if len(temp_chunk) + len(sent) < chunk_size:
-                        temp_chunk += sent + " " if temp_chunk else sent
-                    else:
-                        if temp_chunk:
-                            chunks.append(temp_chunk.strip())
-                        temp_chunk = sent
-                
-                # Add remaining sentences
-                if temp_chunk:
-                    current_chunk = temp_chunk
-            else:
-                # Start new chunk with overlap from previous
-                if chunks and overlap > 0:
-                    last_chunk = chunks[-1]
-                    overlap_text = last_chunk[-overlap:] if len(last_chunk) > overlap else last_chunk
-                    current_chunk = overlap_text + " " + para if overlap_text else para
-                else:
-                    current_chunk = para
-    
-    # Add final chunk
-    if current_chunk.strip():
-        chunks.append(current_chunk.strip())
-    
-    # Filter out very small chunks (likely artifacts)
-    chunks = [c for c in chunks if len(c) > 50]
+    return list(iter_chunks(text, chunk_size, overlap))
+
+
+def iter_text(path: str, file_type: str):
+    """
+    A stored document's text in pieces (PDF pages, TXT blocks) so the chunker
+    never needs the whole text; other formats come as one piece
+    """
+    file_type = file_type.lower()
+    if file_type == 'pdf':
+        try:
+            pages = PdfReader(path).pages
+        except Exception as e:
+            raise ValueError(f"Failed to extract text from PDF: {e}")
+        for page in pages:
+            try:
+                page_text = page.extract_text()
+            except Exception as e:
+                raise ValueError(f"Failed to extract text from PDF: {e}")
+            if page_text:
+                yield page_text + "\n"
+    elif file_type == 'txt':
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            while True:
+                block = f.read(TEXT_BLOCK_CHARS)
+                if not block:
+                    break
+                yield block
+    else:
+        yield extract_text(path, file_type)
+
+
+def _chunk_measure():
+    if settings.chunk_size_unit == "tokens":
+        from .prompt_budget import count_tokens
+        return count_tokens
+    return len
+
+
+def spool_chunks(path: str, file_type: str, spool_path: str) -> int:
+    """
+    Extract and chunk a stored document in one streaming pass, writing the chunks
+    to spool_path (one JSON string per line); returns how many. CPU bound; runs on
+    the extraction pool, and only the count crosses the process boundary
+    """
+    count = 0
+    with open(spool_path, "w", encoding="utf-8") as spool:
+        for chunk in iter_chunks(iter_text(path, file_type), settings.chunk_size, settings.chunk_overlap, _chunk_measure()):
+            spool.write(json.dumps(chunk) + "\n")
+            count += 1
     
-    return chunks
+    if not count:
+        raise ValueError("No text content found in document")
+    return count
 
 
-def generate_chunk_id(client_id: UUID, doc_id: UUID, chunk_index: int) -> str:
-    """Generate unique ID for a chunk"""
-    raw = f"{client_id}_{doc_id}_{chunk_index}"
-    return hashlib.md5(raw.encode()).hexdigest()
+def _read_chunks(spool, limit: int) -> List[str]:
+    chunks = []
+    for line in spool:
+        chunks.append(json.loads(line))
+        if len(chunks) == limit:
+            break
+    return chunks
 
 
 async def process_document(
     client_id: UUID,
     doc_id: UUID,
-    content: bytes,
+    file_path: str,
     file_type: str,
-    filename: str
+    filename: str,
+    on_progress: Optional[ProgressCallback] = None
 ) -> int:
     """
-    Process a document: extract text, chunk it, and store embeddings
+    Process a stored document: extract text, chunk it, and store embeddings
     Returns the number of chunks created
     """
+    async def progress(stage: str, percent: int):
+        if on_progress is not None:
+            await on_progress(stage, percent)
+
     # Ensure persist directory exists (Railway/ephemeral fs)
     os.makedirs(settings.chroma_persist_directory, exist_ok=True)
-    # Extract text
-    text = extract_text(content, file_type)
-    
-    if not text.strip():
-        raise ValueError("No text content found in document")
-    
-    # Chunk the text
-    chunks = chunk_text(text)
-    
-    if not chunks:
-        raise ValueError("Failed to create chunks from document")
-    
-    # Get or create collection for this client
     collection_name = get_collection_name(client_id)
     
-    try:
-        collection = chroma_client.get_collection(collection_name)
-    except:
-        collection = chroma_client.create_collection(
-            name=collection_name,
-            metadata={"hnsw:space": "cosine"}
-        )
+    def get_or_create_collection():
+        try:
+            return chroma_client.get_collection(collection_name)
+        except:
+            return chroma_client.create_collection(
+                name=collection_name,
+                metadata={"hnsw:space": "cosine"}
+            )
     
-    # Prepare data for insertion
-    ids = []
-    documents = []
-    metadatas = []
+    def missing(candidates: List[str]) -> set:
+        # Referenced chunks whose vectors are gone (e.g. the Chroma volume was reset) are embedded again
+        if not candidates:
+            return set()
+        stored = get_or_create_collection().get(ids=candidates, include=[])["ids"]
+        return set(candidates) - set(stored)
     
-    for i, chunk in enumerate(chunks):
-        chunk_id = generate_chunk_id(client_id, doc_id, i)
-        ids.append(chunk_id)
-        documents.append(chunk)
-        metadatas.append({
-            "doc_id": str(doc_id),
-            "filename": filename,
-            "chunk_index": i
-        })
+    def store(ids: List[str], documents: List[str], metadatas: List[dict]):
+        # Embed explicitly (app/embeddings.py) and add to the collection; ids are
+        # content hashes, so a retried job overwrites what an earlier attempt stored
+        get_or_create_collection().upsert(
+            ids=ids,
+            embeddings=embed_texts(documents),
+            documents=documents,
+            metadatas=metadatas
+        )
     
-    # Add to collection (ChromaDB handles embedding generation)
-    collection.add(
-        ids=ids,
-        documents=documents,
-        metadatas=metadatas
-    )
+    # Extract text and chunk it off the event loop (and, by default, out of process)
+    # into a spool file next to the upload, then embed it EMBED_BATCH_SIZE chunks at
+    # a time, so memory stays bounded whatever the document's size
+    await progress("extracting", 5)
+    spool_path = f"{file_path}.chunks"
+    position = embedded = 0
+    try:
+        total = await extraction_pool.run(spool_chunks, file_path, file_type, spool_path)
+        with open(spool_path, encoding="utf-8") as spool:
+            while True:
+                chunks = await asyncio.to_thread(_read_chunks, spool, EMBED_BATCH_SIZE)
+                if not chunks:
+                    break
+                await progress("embedding", 20 + 75 * position // total)
+                
+                # Chunks are stored under the hash of their text (see app/chunk_registry.py):
+                # reference them all, and embed only those no other document already has
+                ids = [chunk_id(chunk) for chunk in chunks]
+                shared = await asyncio.to_thread(_add_references, client_id, doc_id, ids)
+                shared -= await vector_pool.run(missing, sorted(shared))
+                
+                # Prepare data for insertion (each new chunk once, at its first position in the batch)
+                new_ids = []
+                documents = []
+                metadatas = []
+                for i, (chunk, cid) in enumerate(zip(chunks, ids), start=position):
+                    if cid in shared:
+                        continue
+                    shared.add(cid)
+                    new_ids.append(cid)
+                    documents.append(chunk)
+                    metadatas.append({
+                        "doc_id": str(doc_id),
+                        "filename": filename,
+                        "chunk_index": i
+                    })
+                if new_ids:
+                    await vector_pool.run(store, new_ids, documents, metadatas)
+                position += len(chunks)
+                embedded += len(new_ids)
+    finally:
+        try:
+            os.remove(spool_path)
+        except OSError:
+            pass
     # PersistentClient auto-persists; no .persist() call needed
-    return len(chunks)
+    print(f"[RAG] Document {doc_id}: {position} chunks, {embedded} embedded, {position - embedded} reused")
+    invalidate_answers(client_id)  # Cached answers predate this document
+    return position
 
 
-async def retrieve_context(
+def _add_references(client_id: UUID, doc_id: UUID, ids: List[str]) -> set:
+    with SessionLocal() as db:
+        shared = add_references(db, client_id, doc_id, ids)
+        db.commit()
+        return shared
+
+
+async def retrieve_chunks(
     client_id: UUID,
     query: str,
-    n_results: int = 5  # Increased from 3 to 5 for better context
-) -> Optional[str]:
+    n_results: int = 5,  # Increased from 3 to 5 for better context
+    query_embedding: Optional[List[float]] = None
+) -> List[str]:
     """
-    Retrieve relevant context for a query with enhanced retrieval
-    Returns concatenated relevant chunks or None if no collection exists
-    Uses larger n_results for better context coverage
+    Relevant chunks for a query, most relevant first, each prefixed with its source.
+    Empty if the client has no collection or nothing relevant.
+    Pass query_embedding (see embed_query) when the query is already embedded.
     """
     collection_name = get_collection_name(client_id)
     
-    try:
-        collection = chroma_client.get_collection(collection_name)
-    except:
-        return None
-    
-    # Query the collection with more results for better context
-    results = collection.query(
-        query_texts=[query],
-        n_results=n_results
-    )
+    def search():
+        try:
+            collection = chroma_client.get_collection(collection_name)
+        except:
+            return None
+        # Query the collection with more results for better context
+        embedding = query_embedding if query_embedding is not None else embed_query(query)
+        return collection.query(query_embeddings=[embedding], n_results=n_results)
     
-    if not results['documents'] or not results['documents'][0]:
-        return None
+    results = await vector_pool.run(search)
+    if not results or not results['documents'] or not results['documents'][0]:
+        return []
     
-    # Combine relevant chunks with better formatting
     chunks = results['documents'][0]
     metadatas = results['metadatas'][0] if results['metadatas'] else []
     distances = results.get('distances', [[]])[0] if results.get('distances') else []
@@ -349,28 +406,74 @@ async def retrieve_context(
         # Only include chunks with reasonable relevance (distance < 1.5 for cosine)
         if not distances or (i < len(distances) and distances[i] < 1.5):
             context_parts.append(f"[From: {source}]\n{chunk}")
-    
+    return context_parts
+
+
+async def retrieve_context(
+    client_id: UUID,
+    query: str,
+    n_results: int = 5,
+    query_embedding: Optional[List[float]] = None
+) -> Optional[str]:
+    """
+    Retrieve relevant context for a query
+    Returns concatenated relevant chunks or None if no collection exists
+    """
+    context_parts = await retrieve_chunks(client_id, query, n_results, query_embedding)
     if not context_parts:
         return None
     
     return "\n\n---\n\n".join(context_parts)
 
 
-async def delete_document_embeddings(client_id: UUID, doc_id: UUID) -> bool:
+async def document_chunks_stored(client_id: UUID, doc_id: UUID) -> bool:
+    """True if a document has registered chunks and all of them are in the vector store"""
+    def check() -> bool:
+        with SessionLocal() as db:
+            ids = document_chunk_ids(db, doc_id)
+        if not ids:
+            return False
+        try:
+            collection = chroma_client.get_collection(get_collection_name(client_id))
+        except:
+            return False
+        return len(collection.get(ids=ids, include=[])["ids"]) == len(ids)
+    
+    return await vector_pool.run(check)
+
+
+async def delete_document_embeddings(client_id: UUID, doc_id: UUID, db=None) -> bool:
     """
-    Delete all embeddings for a specific document
+    Release a document's chunks, deleting the embeddings no other document shares.
+    With `db` the release joins the caller's transaction (the caller commits, e.g.
+    together with deleting the document); errors propagate so the caller can abort.
     """
     collection_name = get_collection_name(client_id)
     
-    try:
-        collection = chroma_client.get_collection(collection_name)
-    except:
-        return False
+    def delete() -> bool:
+        try:
+            collection = chroma_client.get_collection(collection_name)
+        except:
+            collection = None
+        # Vectors this document stored itself: also covers chunks stored under the
+        # old per-document ids and ones written after its references were released
+        stored = collection.get(where={"doc_id": str(doc_id)}, include=[])["ids"] if collection else []
+        
+        def drop(ids: List[str]):
+            if collection is not None:
+                collection.delete(ids=ids)
+        
+        if db is not None:
+            release_references(db, client_id, doc_id, drop, stored)
+        else:
+            with SessionLocal() as session:
+                release_references(session, client_id, doc_id, drop, stored)
+                session.commit()
+        return collection is not None
     
-    # Delete by metadata filter
-    collection.delete(
-        where={"doc_id": str(doc_id)}
-    )
+    if not await vector_pool.run(delete):
+        return False
+    invalidate_answers(client_id)
     return True
 
 
@@ -379,9 +482,13 @@ async def delete_client_collection(client_id: UUID) -> bool:
     Delete entire collection for a client
     """
     collection_name = get_collection_name(client_id)
+    invalidate_answers(client_id)
     
-    try:
-        chroma_client.delete_collection(collection_name)
-        return True
-    except:
-        return False
+    def delete() -> bool:
+        try:
+            chroma_client.delete_collection(collection_name)
+            return True
+        except:
+            return False
+    
+    return await vector_pool.run(delete)
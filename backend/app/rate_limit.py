@@ -0,0 +1,105 @@
+"""
+Rate limiting
+One storage backend and strategy for both the slowapi per-IP route limits and
+the per-client chat limit. RATE_LIMIT_STORAGE_URI (or REDIS_URL) selects a
+shared Redis-protocol store so the limits hold across workers; otherwise
+counters live in process ("memory://").
+
+The default "sliding-window-counter" strategy keeps two counters per key
+(O(1) per hit), and both backends expire idle keys. If the shared store
+becomes unreachable, per-client checks fall back to in-process counters
+rather than failing the request. Per-client checks against a shared store are
+network round-trips, so they run off the event loop.
+"""
+import asyncio
+import threading
+from uuid import UUID
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import STRATEGIES
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+from .config import get_settings
+
+settings = get_settings()
+
+
+def rate_limit_storage_uri() -> str:
+    return settings.rate_limit_storage_uri or settings.redis_url or "memory://"
+
+
+# Per-IP route limits (@limiter.limit on the endpoints)
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=rate_limit_storage_uri(),
+    strategy=settings.rate_limit_strategy,
+    in_memory_fallback_enabled=True,
+    key_prefix="snip",
+)
+
+
+class KeyedRateLimiter:
+    """Named limit checked per key (e.g. client id) against the shared store"""
+
+    def __init__(self, namespace: str, limit: str, storage_uri: str, strategy: str):
+        self.namespace = namespace
+        self.limit = parse(limit)
+        self.backend = storage_uri.split(":", 1)[0]
+        self._primary = STRATEGIES[strategy](storage_from_string(storage_uri, key_prefix="snip"))
+        self._fallback = STRATEGIES[strategy](storage_from_string("memory://"))
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.fallbacks = 0
+
+    def hit(self, key: str) -> bool:
+        """Count one request for key; False when it is over the limit"""
+        try:
+            allowed = self._primary.hit(self.limit, self.namespace, key)
+        except Exception as e:
+            # Shared store down: keep limiting per worker instead of failing the request
+            with self._lock:
+                self.fallbacks += 1
+            if self.fallbacks == 1 or self.fallbacks % 1000 == 0:
+                print(f"[Rate Limit] {self.backend} store unavailable, using in-process counters: {e}")
+            allowed = self._fallback.hit(self.limit, self.namespace, key)
+        with self._lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.rejected += 1
+        return allowed
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "limit": str(self.limit),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "fallbacks": self.fallbacks,
+        }
+
+
+# Per-client_id limit for /api/chat (Issue 6), on top of the per-IP route limit
+chat_client_limiter = KeyedRateLimiter(
+    "chat_client",
+    settings.chat_rate_limit_per_client,
+    rate_limit_storage_uri(),
+    settings.rate_limit_strategy,
+)
+
+
+async def check_chat_rate_limit(client_id: UUID) -> bool:
+    """Return True if allowed, False if the client is over its chat limit"""
+    if chat_client_limiter.backend == "memory":
+        return chat_client_limiter.hit(str(client_id))
+    return await asyncio.to_thread(chat_client_limiter.hit, str(client_id))
+
+
+def stats() -> dict:
+    return {
+        "strategy": settings.rate_limit_strategy,
+        "chat_client": chat_client_limiter.stats(),
+    }
@@ -6,6 +6,7 @@ from typing import Optional, List
 from datetime import datetime
 from uuid import UUID
 from .models import TierEnum, DocumentStatus
+from .audio_codec import AUDIO_FORMAT_PATTERN
 
 
 # ============== Client Schemas ==============
@@ -68,6 +69,11 @@ class ConfigUpdate(BaseModel):
     ai_api_key: Optional[str] = Field(None, description="Your AI API key (bring your own key)")
     ai_model: Optional[str] = Field(None, description="AI model to use (e.g., 'grok-3-fast', 'gpt-4', 'claude-3')")
     tts_voice: Optional[str] = Field(None, description="TTS voice for xAI: 'Ara', 'Leo', 'Rex', 'Sal', 'Eve' (default: 'Ara')")
+    tts_audio_format: Optional[str] = Field(
+        None,
+        pattern=AUDIO_FORMAT_PATTERN,
+        description="Voice reply encoding: 'pcm_24k', 'pcm_16k', 'pcm_8k', 'mulaw_*', 'adpcm_*' (default: 'pcm_24k')"
+    )
     has_completed_onboarding: Optional[bool] = None
 
 
@@ -94,6 +100,7 @@ class ConfigResponse(BaseModel):
     ai_model: Optional[str] = Field(None, description="AI model selected")
     ai_api_key_set: bool = Field(default=False, description="Whether AI API key is configured (never returns actual key)")
     tts_voice: Optional[str] = Field(None, description="TTS voice selected (only applies to xAI provider)")
+    tts_audio_format: Optional[str] = Field(None, description="Voice reply encoding selected")
     has_completed_onboarding: bool
     
     class Config:
@@ -135,6 +142,20 @@ class ChatRequest(BaseModel):
     """Chat message from widget"""
     message: str = Field(..., min_length=1, max_length=4000)
     client_id: UUID
+    conversation_id: Optional[UUID] = Field(
+        None,
+        description="Continue this conversation (from a previous response); omit to start a new one."
+    )
+    audio_mode: Optional[str] = Field(
+        None,
+        pattern=r"^(inline|deferred|none)$",
+        description="Voice delivery: 'inline' (data URL in response), 'deferred' (fetch /api/tts/{job_id}), 'none'. Defaults to TTS_AUDIO_MODE."
+    )
+    audio_format: Optional[str] = Field(
+        None,
+        pattern=AUDIO_FORMAT_PATTERN,
+        description="Voice reply encoding, e.g. 'mulaw_8k' or 'adpcm_16k' for small payloads on mobile. Defaults to the client config."
+    )
 
 
 class ChatResponse(BaseModel):
@@ -142,7 +163,10 @@ class ChatResponse(BaseModel):
     response: str
     mood: str = "neutral"
     sentiment_data: dict = {}
-    audio_url: Optional[str] = None  # TTS audio URL
+    audio_url: Optional[str] = None  # TTS audio URL (data URL when inline, /api/tts/{job_id} when deferred)
+    audio_job_id: Optional[str] = None  # Deferred TTS job id
+    audio_stream_url: Optional[str] = None  # Deferred TTS: progressive chunked-WAV relay of the same job
+    conversation_id: Optional[UUID] = None  # Send back with the next message to keep the context
 
 
 # ============== Document Schemas ==============
@@ -158,6 +182,8 @@ class DocumentResponse(BaseModel):
     created_at: datetime
     processed_at: Optional[datetime]
     error_message: Optional[str]
+    progress_stage: Optional[str] = None
+    progress_percent: int = 0
     
     class Config:
         from_attributes = True
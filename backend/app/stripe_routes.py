@@ -11,6 +11,9 @@ from .database import get_db
 from .auth import generate_api_key, hash_api_key
 from .config import get_settings
 from .email import send_api_key_email
+from .executors import sdk_pool
+from .tenant_gate import refresh_tenant_gate
+from .api_key_cache import invalidate_api_key
 
 router = APIRouter()
 settings = get_settings()
@@ -39,7 +42,8 @@ async def create_checkout_session(request: CheckoutRequest):
         raise HTTPException(status_code=400, detail="Invalid tier")
     
     try:
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = await sdk_pool.run(
+            stripe.checkout.Session.create,
             payment_method_types=["card"],
             line_items=[{
                 "price": price_map[tier],
@@ -65,8 +69,8 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
     sig_header = request.headers.get("stripe-signature")
     
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, settings.stripe_webhook_secret
+        event = await sdk_pool.run(
+            stripe.Webhook.construct_event, payload, sig_header, settings.stripe_webhook_secret
         )
     except ValueError:
         raise HTTPException(status_code=400)
@@ -131,7 +135,9 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
                 existing.stripe_subscription_id = stripe_subscription_id
             existing.stripe_subscription_status = 'active'
             db.commit()
-            email_ok = send_api_key_email(email, api_key, tier_str)
+            invalidate_api_key(existing.id)  # Key rotated
+            refresh_tenant_gate(db, existing.id)
+            email_ok = await sdk_pool.run(send_api_key_email, email, api_key, tier_str)
             if not email_ok:
                 logger.warning("Stripe checkout.session.completed: API key email failed for session_id=%s email=%s", session_id, email)
                 return {"status": "email_failed", "message": "Account created but API key email failed; check logs."}
@@ -163,8 +169,9 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
             config = ClientConfig(client_id=client.id)
             db.add(config)
             db.commit()
+            refresh_tenant_gate(db, client.id)
             
-            email_ok = send_api_key_email(email, api_key, tier_str)
+            email_ok = await sdk_pool.run(send_api_key_email, email, api_key, tier_str)
             if not email_ok:
                 return {"status": "email_failed", "message": "Account created but API key email failed; check logs."}
         
@@ -178,6 +185,8 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
             client.stripe_subscription_status = "canceled"
             client.is_active = False
             db.commit()
+            invalidate_api_key(client.id)
+            refresh_tenant_gate(db, client.id)
         return {"status": "success"}
     
     if event["type"] == "customer.subscription.updated":
@@ -199,6 +208,8 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
                     elif price_id in (settings.stripe_price_id_premium or "", settings.stripe_price_id_enterprise or ""):
                         client.tier = TierEnum.PREMIUM
             db.commit()
+            invalidate_api_key(client.id)
+            refresh_tenant_gate(db, client.id)
         return {"status": "success"}
     
     if event["type"] == "invoice.payment_failed":
@@ -211,6 +222,8 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
             if client:
                 client.stripe_subscription_status = "past_due"
                 db.commit()
+                invalidate_api_key(client.id)
+                refresh_tenant_gate(db, client.id)
         return {"status": "success"}
     
     return {"status": "ignored"}
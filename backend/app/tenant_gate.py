@@ -0,0 +1,282 @@
+"""
+Tenant gate cache
+/api/chat and /api/widget/config look up the same client, its config and its
+subscription state on every request. Each tenant is compiled once into a
+TenantGate (plain snapshots, the gate verdict, the origin allowlist and the
+prompt header) and kept in a TTL-bounded LRU, so the hot path runs no queries.
+
+The public widget config is serialized once per gate, with a strong ETag over
+the bytes, so page views cost a dict lookup (or a 304). Optionally each change
+also publishes <client_id>.json to WIDGET_CONFIG_SNAPSHOT_DIR for a CDN.
+
+Entries are dropped on PATCH /api/config and on Stripe webhooks; the TTL bounds
+how long other workers (which never see those calls) can serve a stale gate.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException
+
+from .config import get_settings
+from .schemas import WidgetConfig
+
+settings = get_settings()
+
+# Subscription states that may still use the widget (grace period included)
+ALLOWED_SUBSCRIPTION_STATUSES = ("active", "trialing", "past_due")
+
+# Bump when the widget config wire format changes so every ETag changes with it
+WIDGET_CONFIG_VERSION = "1"
+
+
+def _snapshot(row) -> SimpleNamespace:
+    """Detached copy of a row's column values (usable after the session closes)"""
+    return SimpleNamespace(**{column.key: getattr(row, column.key) for column in row.__table__.columns})
+
+
+class TenantGate:
+    """Everything the widget endpoints need to know about one client"""
+
+    __slots__ = (
+        "client", "config", "verdict", "widget_config", "widget_json", "widget_etag",
+        "prompt_header", "allowed_domains", "loaded_at",
+    )
+
+    def __init__(self, client, config, verdict: Optional[Tuple[int, str]]):
+        self.loaded_at = time.monotonic()
+        self.client = _snapshot(client) if client is not None else None
+        self.config = _snapshot(config) if config is not None else None
+        self.verdict = verdict
+        self.widget_config = config.to_widget_config() if config is not None else None
+        self.widget_json = b""
+        self.widget_etag = ""
+        self.allowed_domains = ()
+        self.prompt_header = ""
+        if config is not None:
+            # Same substring semantics as before; strip once instead of per request
+            self.allowed_domains = tuple(
+                d.strip() for d in (config.allowed_domains or []) if d and isinstance(d, str)
+            )
+            self.widget_json = WidgetConfig(**self.widget_config).model_dump_json().encode("utf-8")
+            digest = hashlib.sha256(WIDGET_CONFIG_VERSION.encode() + b"\n" + self.widget_json).hexdigest()
+            self.widget_etag = f'"{WIDGET_CONFIG_VERSION}-{digest[:32]}"'
+            self.prompt_header = f"""You are {config.bot_name}, an AI assistant for {client.company_name}.
+
+{config.system_prompt or "Be helpful, friendly, and professional."}
+
+Guidelines:
+- Be concise and helpful
+- Stay on topic for {client.company_name}
+- If you don't know something, say so
+"""
+
+    def check(self):
+        """Raise the cached 404/403 for a missing, inactive or unpaid client"""
+        if self.verdict is not None:
+            raise HTTPException(status_code=self.verdict[0], detail=self.verdict[1])
+
+    def etag_matches(self, if_none_match: Optional[str]) -> bool:
+        """True if an If-None-Match header already names the current widget config"""
+        if not if_none_match or not self.widget_etag:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*" or tag.removeprefix("W/") == self.widget_etag:
+                return True
+        return False
+
+    def public(self) -> bool:
+        """Safe to serve from a static snapshot: no origin allowlist and no gate error"""
+        return self.verdict is None and not self.allowed_domains
+
+    def check_origin(self, origin: str):
+        """Enforce allowed_domains; an allowlist without an Origin is rejected (Issue 2)"""
+        if not self.allowed_domains:
+            return
+        if not origin:
+            raise HTTPException(status_code=403, detail="Origin required")
+        if not any(d in origin for d in self.allowed_domains):
+            raise HTTPException(status_code=403, detail="Domain not allowed")
+
+
+def _is_permanent(client_id: UUID) -> bool:
+    permanent_client_id = (settings.permanent_api_key_client_id or "").strip()
+    return bool(permanent_client_id) and str(client_id) == permanent_client_id
+
+
+def _gate_statement(client_id: UUID, permanent: bool):
+    """The client with its config, in one query"""
+    from sqlalchemy import select
+    from sqlalchemy.orm import joinedload
+    from .models import Client
+
+    statement = select(Client).options(joinedload(Client.config)).where(Client.id == client_id)
+    # Allow permanent demo client: lookup without is_active filter when client_id matches
+    if not permanent:
+        statement = statement.where(Client.is_active == True)
+    return statement
+
+
+def _gate_for(client, permanent: bool) -> TenantGate:
+    """Decide the gate verdict for a loaded client (None if not found)"""
+    if not client or not client.config:
+        return TenantGate(None, None, (404, "Client not found"))
+
+    verdict = None
+    # Gate: only active or grace-period subscriptions (Issue 1); skip for permanent demo client
+    if not permanent:
+        status = client.stripe_subscription_status
+        if not client.is_active:
+            verdict = (403, "Account inactive")
+        elif status and status.lower() not in ALLOWED_SUBSCRIPTION_STATUSES:
+            verdict = (403, "Subscription not active")
+    return TenantGate(client, client.config, verdict)
+
+
+def _compile_gate(db, client_id: UUID) -> TenantGate:
+    """Build a client's gate with a sync Session"""
+    permanent = _is_permanent(client_id)
+    client = db.execute(_gate_statement(client_id, permanent)).unique().scalars().first()
+    return _gate_for(client, permanent)
+
+
+async def _compile_gate_async(db, client_id: UUID) -> TenantGate:
+    """Build a client's gate with an AsyncSession"""
+    permanent = _is_permanent(client_id)
+    result = await db.execute(_gate_statement(client_id, permanent))
+    return _gate_for(result.unique().scalars().first(), permanent)
+
+
+class TenantGateCache:
+    """LRU of compiled gates; unknown client ids are remembered for a shorter TTL"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, negative_ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._gates: "OrderedDict[str, TenantGate]" = OrderedDict()
+        self._generations: dict = {}  # client_id -> invalidation count; loads racing an invalidation are not stored
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _fresh(self, gate: TenantGate, now: float) -> bool:
+        ttl = self.negative_ttl_seconds if gate.client is None else self.ttl_seconds
+        return now - gate.loaded_at < ttl
+
+    def lookup(self, client_id: UUID) -> Tuple[Optional[TenantGate], int]:
+        """Fresh cached gate (or None) and the generation to store a reload under"""
+        key = str(client_id)
+        with self._lock:
+            gate = self._gates.get(key)
+            if gate is not None and self._fresh(gate, time.monotonic()):
+                self._gates.move_to_end(key)
+                self.hits += 1
+                return gate, 0
+            self.misses += 1
+            return None, self._generations.get(key, 0)
+
+    def store(self, client_id: UUID, generation: int, gate: TenantGate):
+        """Cache a freshly compiled gate unless the client was invalidated meanwhile"""
+        key = str(client_id)
+        with self._lock:
+            if self._generations.get(key, 0) == generation:
+                self._gates[key] = gate
+                self._gates.move_to_end(key)
+                while len(self._gates) > self.max_entries:
+                    self._gates.popitem(last=False)
+
+    def invalidate(self, client_id: UUID):
+        key = str(client_id)
+        with self._lock:
+            self._gates.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._gates.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._gates),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+tenant_gates = TenantGateCache(
+    max_entries=settings.tenant_gate_max_entries,
+    ttl_seconds=settings.tenant_gate_ttl_seconds,
+    negative_ttl_seconds=settings.tenant_gate_negative_ttl_seconds,
+)
+
+
+async def get_tenant_gate(db, client_id: UUID) -> TenantGate:
+    """Compiled gate for a client (db is an AsyncSession, only used on a miss)"""
+    if not settings.tenant_gate_cache_enabled:
+        return await _compile_gate_async(db, client_id)
+    gate, generation = tenant_gates.lookup(client_id)
+    if gate is None:
+        gate = await _compile_gate_async(db, client_id)
+        tenant_gates.store(client_id, generation, gate)
+    return gate
+
+
+def load_tenant_gate(db, client_id: UUID) -> TenantGate:
+    """Same as get_tenant_gate, for code holding a sync Session"""
+    gate, generation = tenant_gates.lookup(client_id)
+    if gate is None:
+        gate = _compile_gate(db, client_id)
+        tenant_gates.store(client_id, generation, gate)
+    return gate
+
+
+def invalidate_tenant_gate(client_id: UUID):
+    """Forget a client's gate after its config or subscription changed"""
+    tenant_gates.invalidate(client_id)
+
+
+def publish_widget_snapshot(client_id: UUID, gate: Optional[TenantGate]):
+    """
+    Write (or remove) the client's static widget config for CDN serving.
+    Clients with a domain allowlist or a failing gate never get a snapshot,
+    since a static file cannot check the Origin or the subscription.
+    """
+    directory = settings.widget_config_snapshot_dir
+    if not directory:
+        return
+    path = os.path.join(directory, f"{client_id}.json")
+    try:
+        if gate is None or not gate.public():
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(gate.widget_json)
+        os.replace(tmp_path, path)  # Atomic: the CDN never sees a half-written file
+    except OSError as e:
+        print(f"[Widget Config] Snapshot publish failed for {client_id} (non-fatal): {e}")
+
+
+def refresh_tenant_gate(db, client_id: UUID):
+    """Invalidate after a change and, if snapshots are on, republish the client's widget config"""
+    invalidate_tenant_gate(client_id)
+    if settings.widget_config_snapshot_dir:
+        publish_widget_snapshot(client_id, load_tenant_gate(db, client_id))
+
+
+def stats() -> dict:
+    return tenant_gates.stats()
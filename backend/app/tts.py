@@ -0,0 +1,385 @@
+"""
+Text-to-speech via the xAI Voice API (realtime WebSocket)
+Ephemeral tokens, audio synthesis and PCM -> WAV packaging
+"""
+import os
+import time
+import json
+import hashlib
+import base64
+import asyncio
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from .audio_cache import audio_cache, tts_cache_key
+from .audio_codec import DEFAULT_AUDIO_FORMAT, encode_pcm16, wav_format
+from .config import get_settings
+from .http_client import get_http_client
+
+settings = get_settings()
+
+# TTS Configuration (Voice API endpoints)
+TTS_REALTIME_WS = "wss://api.x.ai/v1/realtime"
+TTS_EPHEMERAL_TOKEN_ENDPOINT = "https://api.x.ai/v1/realtime/client_secrets"
+TTS_VOICES = ('Ara', 'Leo', 'Rex', 'Sal', 'Eve')
+
+# Ephemeral token cache: sha256(api key) -> (token, expires_at epoch seconds).
+# At most one upstream refresh per key is in flight; concurrent callers await it.
+_token_cache: dict = {}
+_token_refreshes: dict = {}
+
+
+def _token_cache_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+async def _fetch_ephemeral_token(api_key: str, retries: int = 3) -> tuple:
+    """
+    Fetch a fresh ephemeral token for Voice API
+    Uses API key to get a short-lived token for WebSocket connection
+    Includes retry logic for resilience
+    Returns (token, expires_at)
+    """
+    last_error = None
+    
+    for attempt in range(retries):
+        try:
+            response = await get_http_client().post(
+                TTS_EPHEMERAL_TOKEN_ENDPOINT,
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={},  # Empty JSON body
+                timeout=10.0
+            )
+            response.raise_for_status()
+            data = response.json()
+            # Fall back to a conservative lifetime when the response carries no expiry
+            expires_at = data.get("expires_at") or (time.time() + settings.tts_token_default_ttl_seconds)
+            return data["value"], float(expires_at)  # API returns "value" not "token"
+        except httpx.TimeoutException as e:
+            last_error = e
+            if attempt < retries - 1:
+                wait_time = (attempt + 1) * 0.5  # Exponential backoff
+                print(f"[TTS] Ephemeral token timeout (attempt {attempt + 1}/{retries}), retrying in {wait_time}s...")
+                await asyncio.sleep(wait_time)
+                continue
+        except httpx.HTTPStatusError as e:
+            # Don't retry on auth errors (401/403) or client errors (4xx)
+            if e.response.status_code in [401, 403, 400]:
+                print(f"[TTS] Ephemeral token auth/client error: {e.response.status_code}")
+                raise
+            last_error = e
+            if attempt < retries - 1:
+                wait_time = (attempt + 1) * 0.5
+                print(f"[TTS] Ephemeral token HTTP error (attempt {attempt + 1}/{retries}), retrying in {wait_time}s...")
+                await asyncio.sleep(wait_time)
+                continue
+        except Exception as e:
+            last_error = e
+            if attempt < retries - 1:
+                wait_time = (attempt + 1) * 0.5
+                print(f"[TTS] Ephemeral token error (attempt {attempt + 1}/{retries}), retrying in {wait_time}s...")
+                await asyncio.sleep(wait_time)
+                continue
+    
+    # All retries exhausted
+    print(f"[TTS] Failed to get ephemeral token after {retries} attempts: {last_error}")
+    raise last_error or Exception("Failed to get ephemeral token")
+
+
+async def _refresh_ephemeral_token(cache_key: str, api_key: str, retries: int) -> str:
+    token, expires_at = await _fetch_ephemeral_token(api_key, retries)
+    now = time.time()
+    # Drop expired entries so rotated/removed keys don't accumulate
+    for key, (_, entry_expires_at) in list(_token_cache.items()):
+        if entry_expires_at <= now:
+            _token_cache.pop(key, None)
+    _token_cache[cache_key] = (token, expires_at)
+    return token
+
+
+def _on_refresh_done(cache_key: str, task: asyncio.Task):
+    if _token_refreshes.get(cache_key) is task:
+        _token_refreshes.pop(cache_key, None)
+    # Retrieve the exception so background-only refreshes don't log "never retrieved"
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[TTS] Ephemeral token refresh failed: {task.exception()}")
+
+
+def _start_token_refresh(cache_key: str, api_key: str, retries: int) -> asyncio.Task:
+    """Single-flight: reuse the refresh already running for this key, if any"""
+    task = _token_refreshes.get(cache_key)
+    if task is None or task.done():
+        task = asyncio.create_task(_refresh_ephemeral_token(cache_key, api_key, retries))
+        task.add_done_callback(lambda t: _on_refresh_done(cache_key, t))
+        _token_refreshes[cache_key] = task
+    return task
+
+
+async def get_ephemeral_token(api_key: str, retries: int = 3) -> str:
+    """
+    Get ephemeral token for Voice API, cached per API key until shortly before expiry
+    Concurrent callers share one in-flight refresh; a token entering its last
+    TTS_TOKEN_REFRESH_AHEAD_SECONDS is still returned while a background refresh replaces it.
+    """
+    cache_key = _token_cache_key(api_key)
+    cached = _token_cache.get(cache_key)
+    if cached:
+        token, expires_at = cached
+        remaining = expires_at - time.time()
+        if remaining > settings.tts_token_expiry_margin_seconds:
+            if remaining < settings.tts_token_refresh_ahead_seconds:
+                _start_token_refresh(cache_key, api_key, retries)
+            return token
+
+    # Shield so one cancelled caller doesn't cancel the refresh the others are awaiting
+    return await asyncio.shield(_start_token_refresh(cache_key, api_key, retries))
+
+
+def invalidate_ephemeral_token(api_key: str):
+    """Forget the cached token (e.g. the realtime socket rejected it)"""
+    _token_cache.pop(_token_cache_key(api_key), None)
+
+
+async def stream_tts_audio(text: str, api_key: str, voice: str = "Ara") -> AsyncIterator[bytes]:
+    """
+    Generate TTS audio via WebSocket (Voice API), yielding PCM chunks as they arrive
+    
+    Args:
+        text: Text to convert to speech
+        api_key: API key for voice generation
+        voice: Voice name (Ara, Leo, Rex, Sal, Eve)
+    
+    Yields:
+        Audio bytes (PCM format at 24kHz), one chunk per response.output_audio.delta
+        (a single chunk when the utterance is served from the audio cache)
+    """
+    cache_key = tts_cache_key(voice, text) if settings.tts_cache_enabled else None
+    if cache_key:
+        cached = await audio_cache.get(cache_key)
+        if cached:
+            print(f"[TTS] Audio cache hit ({len(cached)} bytes)")
+            yield cached
+            return
+
+    from .voice_pool import voice_pool, open_realtime_session
+
+    try:
+        audio_chunks = []
+        state = {"completed": False, "settled": False}
+        if settings.tts_session_pool_enabled:
+            # Steps 1-3 (token, connect, session.update) only run when the pool has no idle session
+            async with voice_pool.session(api_key, voice) as session:
+                async for audio_bytes in _speak_on_session(session.ws, text, state):
+                    audio_chunks.append(audio_bytes)
+                    yield audio_bytes
+                # A socket with a response still in flight would leak its events into the next utterance
+                session.reusable = state["completed"] and state["settled"]
+        else:
+            ws = await open_realtime_session(api_key, voice)
+            try:
+                async for audio_bytes in _speak_on_session(ws, text, state):
+                    audio_chunks.append(audio_bytes)
+                    yield audio_bytes
+            finally:
+                await ws.close()
+
+        if audio_chunks:
+            combined_audio = b"".join(audio_chunks)
+            print(f"[TTS] Generated {len(combined_audio)} bytes of audio")
+            # Only cache complete utterances, never ones cut short by a timeout or error
+            if cache_key and state["completed"]:
+                await audio_cache.put(cache_key, combined_audio)
+        else:
+            print(f"[TTS] No audio chunks received")
+
+    except Exception as e:
+        # Partial audio may already have been yielded; callers treat the stream as finished
+        print(f"[TTS] Failed to generate audio: {e}")
+        import traceback
+        traceback.print_exc()
+
+
+async def _speak_on_session(ws, text: str, state: dict) -> AsyncIterator[bytes]:
+    """
+    Speak one utterance on a configured realtime session, yielding PCM chunks.
+    Sets state["completed"] once the audio finished and state["settled"] once
+    response.done arrived (nothing left in flight, so the socket can be reused).
+    """
+    # Step 4: Send our bot's reply with SPEAK: prefix so the model speaks only the content
+    # (Voice Agent has no true TTS-only mode; instruction says output = words after SPEAK:).
+    tts_user_message = f"SPEAK: {text}"
+    item_message = {
+        "type": "conversation.item.create",
+        "item": {
+            "type": "message",
+            "role": "user",
+            "content": [{"type": "input_text", "text": tts_user_message}]
+        }
+    }
+    await ws.send(json.dumps(item_message))
+    print(f"[TTS] Sent text input (say exactly): {text[:50]}...")
+
+    # Wait for conversation.item.added
+    item_added = False
+    for _ in range(5):
+        try:
+            msg = await asyncio.wait_for(ws.recv(), timeout=2.0)
+            obj = json.loads(msg)
+            if obj.get("type") == "conversation.item.added":
+                item_added = True
+                break
+        except asyncio.TimeoutError:
+            continue
+
+    if not item_added:
+        print(f"[TTS] Warning: Conversation item not confirmed")
+
+    # Step 5: Request audio only so the model doesn't "reply" in text first
+    response_message = {
+        "type": "response.create",
+        "response": {
+            "modalities": ["audio"]
+        }
+    }
+    await ws.send(json.dumps(response_message))
+
+    # Step 6: Relay audio deltas as they arrive
+    timeout = 30
+    settle_timeout = 2.0  # After the audio is done, wait this long for response.done
+    deadline = time.monotonic() + timeout
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            if not state["completed"]:
+                print(f"[TTS] Timeout waiting for audio")
+            break
+        try:
+            msg = await asyncio.wait_for(ws.recv(), timeout=remaining)
+        except asyncio.TimeoutError:
+            continue
+
+        try:
+            obj = json.loads(msg)
+            msg_type = obj.get("type")
+
+            if msg_type in ["response.output_audio.delta", "response.audio.delta"]:
+                # Audio comes in delta field as base64 (some APIs use "audio" instead)
+                delta = obj.get("delta") or obj.get("audio") or obj.get("data")
+                if isinstance(delta, str) and delta:
+                    yield base64.b64decode(delta)
+
+            elif msg_type in ["response.output_audio.done", "response.audio.done"]:
+                print(f"[TTS] Audio generation complete")
+                state["completed"] = True
+                deadline = min(deadline, time.monotonic() + settle_timeout)
+
+            elif msg_type == "response.done":
+                if not state["completed"]:
+                    print(f"[TTS] Audio generation complete")
+                state["completed"] = True
+                state["settled"] = True
+                break
+
+            elif msg_type == "error":
+                error_msg = obj.get("error", {}).get("message", "Unknown error")
+                print(f"[TTS] Error: {error_msg}")
+                break
+
+        except json.JSONDecodeError:
+            continue
+        except Exception as e:
+            print(f"[TTS] Error processing message: {e}")
+            continue
+
+
+async def generate_tts_audio(text: str, api_key: str, voice: str = "Ara") -> Optional[bytes]:
+    """
+    Generate TTS audio and return it in one piece
+    
+    Returns:
+        Audio bytes (PCM format at 24kHz) or None if failed
+    """
+    audio_chunks = [chunk async for chunk in stream_tts_audio(text, api_key, voice)]
+    if not audio_chunks:
+        return None
+    return b"".join(audio_chunks)
+
+
+def wav_header(data_size: Optional[int], sample_rate: int = 24000, channels: int = 1, sample_width: int = 2,
+               format_tag: int = 1, bits_per_sample: Optional[int] = None, block_align: Optional[int] = None,
+               byte_rate: Optional[int] = None, extra: Optional[bytes] = None,
+               sample_count: Optional[int] = None) -> bytes:
+    """
+    WAV header (44 bytes for plain PCM). data_size=None writes the 0xFFFFFFFF
+    "unknown length" sizes used when the audio is streamed before synthesis has
+    finished. Compressed formats (see audio_codec.wav_format) pass their format
+    tag, block layout and cbSize extra bytes, plus a fact chunk when the number
+    of sample frames is known.
+    """
+    import struct
+    
+    bits_per_sample = bits_per_sample or sample_width * 8
+    block_align = block_align or channels * sample_width
+    byte_rate = byte_rate or sample_rate * block_align
+    
+    # fmt chunk: 16 bytes for PCM, 18 + extra (cbSize-prefixed) for everything else
+    fmt = struct.pack('<HHIIHH', format_tag, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+    if extra is not None:
+        fmt += struct.pack('<H', len(extra)) + extra
+    fact = b''
+    if format_tag != 1 and sample_count is not None:
+        fact = b'fact' + struct.pack('<II', 4, sample_count)
+    
+    if data_size is None:
+        data_size = 0xFFFFFFFF - (20 + len(fmt) + len(fact))
+    file_size = 20 + len(fmt) + len(fact) + data_size
+    
+    # Create WAV header
+    header = b'RIFF'
+    header += struct.pack('<I', file_size)
+    header += b'WAVE'
+    header += b'fmt '
+    header += struct.pack('<I', len(fmt))
+    header += fmt
+    header += fact
+    header += b'data'
+    header += struct.pack('<I', data_size)
+    
+    return header
+
+
+def convert_pcm_to_wav(pcm_audio: bytes, sample_rate: int = 24000, channels: int = 1, sample_width: int = 2,
+                       audio_format: Optional[str] = None) -> bytes:
+    """
+    Convert PCM audio to WAV format for browser playback
+    audio_format (e.g. 'mulaw_8k', see audio_codec) resamples and re-encodes
+    mono 16-bit PCM first; None keeps the PCM as is.
+    """
+    if audio_format is None:
+        return wav_header(len(pcm_audio), sample_rate, channels, sample_width) + pcm_audio
+    data, frames = encode_pcm16(pcm_audio, sample_rate, audio_format)
+    return wav_header(len(data), channels=channels, sample_count=frames, **wav_format(audio_format)) + data
+
+
+def resolve_tts_voice(config) -> str:
+    """
+    Voice options: Ara (default), Leo, Rex, Sal, Eve
+    Voice is configurable per-client via ClientConfig.tts_voice field
+    """
+    voice = getattr(config, 'tts_voice', None) or os.getenv('XAI_TTS_VOICE', 'Ara')
+    if voice not in TTS_VOICES:
+        voice = 'Ara'  # Fallback to safe default
+    return voice
+
+
+def resolve_tts_audio_format(requested: Optional[str], config) -> str:
+    """
+    Output encoding for voice replies: per-request value, else the client's
+    ClientConfig.tts_audio_format, else TTS_AUDIO_FORMAT
+    """
+    return requested or getattr(config, 'tts_audio_format', None) or settings.tts_audio_format or DEFAULT_AUDIO_FORMAT
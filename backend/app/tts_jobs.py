@@ -0,0 +1,161 @@
+"""
+Deferred TTS jobs
+Chat returns text immediately; voice synthesis runs in the background and the
+widget fetches the audio from /api/tts/{job_id}, or relays it while it is still
+being synthesized from /api/tts/{job_id}/stream.
+
+Jobs live in process memory (bounded by count and TTL), so with several
+workers the audio fetch must reach the worker that ran the chat turn. They
+need a long-lived event loop to run on: until start() has run on the current
+loop (app startup; never under Mangum, whose instances may be frozen between
+requests), deferred_available() is False and chat synthesizes inline.
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
+
+from .config import get_settings
+from .tts import stream_tts_audio, convert_pcm_to_wav
+
+settings = get_settings()
+
+JOB_PENDING = "pending"
+JOB_READY = "ready"
+JOB_FAILED = "failed"
+
+
+class TTSJob:
+    """One background synthesis: text in, PCM chunks (as they arrive) and WAV bytes out"""
+
+    __slots__ = ("id", "client_id", "audio_format", "status", "pcm_chunks", "audio", "error", "created_at", "done", "changed", "task")
+
+    def __init__(self, client_id: str, audio_format: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.client_id = client_id
+        self.audio_format = audio_format  # See audio_codec; None = 24kHz PCM
+        self.status = JOB_PENDING
+        self.pcm_chunks: list = []
+        self.audio: Optional[bytes] = None
+        self.error: Optional[str] = None
+        self.created_at = time.monotonic()
+        self.done = asyncio.Event()
+        self.changed = asyncio.Condition()  # Notified on every new PCM chunk and on completion
+        self.task: Optional[asyncio.Task] = None
+
+    def expired(self, now: float) -> bool:
+        return now - self.created_at > settings.tts_job_ttl_seconds
+
+
+_jobs: "OrderedDict[str, TTSJob]" = OrderedDict()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def start():
+    """Allow deferred jobs on the running loop (app startup)"""
+    global _loop
+    _loop = asyncio.get_running_loop()
+
+
+def deferred_available() -> bool:
+    """True when jobs can outlive the request: a server that ran app startup on this loop"""
+    try:
+        return _loop is not None and _loop is asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+
+
+def _evict(now: float):
+    """Drop expired jobs, then the oldest ones while over the cap (oldest first)"""
+    while _jobs:
+        job_id, job = next(iter(_jobs.items()))
+        if job.expired(now) or len(_jobs) > settings.tts_job_max_jobs:
+            _jobs.pop(job_id)
+            if job.task and not job.task.done():
+                job.task.cancel()
+        else:
+            break
+
+
+async def _run_job(job: TTSJob, text: str, api_key: str, voice: str):
+    try:
+        async for chunk in stream_tts_audio(text=text, api_key=api_key, voice=voice):
+            async with job.changed:
+                job.pcm_chunks.append(chunk)
+                job.changed.notify_all()
+        if job.pcm_chunks:
+            # Resampling/encoding is CPU work; keep it off the event loop
+            job.audio = await asyncio.to_thread(convert_pcm_to_wav, b"".join(job.pcm_chunks), audio_format=job.audio_format)
+            job.status = JOB_READY
+            print(f"[TTS Job] {job.id} ready ({len(job.audio)} bytes)")
+        else:
+            job.status = JOB_FAILED
+            job.error = "No audio generated"
+    except asyncio.CancelledError:
+        job.status = JOB_FAILED
+        job.error = "Cancelled"
+        raise
+    except Exception as e:
+        print(f"[TTS Job] {job.id} failed: {e}")
+        job.status = JOB_FAILED
+        job.error = str(e)
+    finally:
+        job.done.set()
+        async with job.changed:
+            job.changed.notify_all()
+
+
+def create_tts_job(client_id, text: str, api_key: str, voice: str, audio_format: Optional[str] = None) -> TTSJob:
+    """Register a job and start synthesis in the background; returns immediately"""
+    now = time.monotonic()
+    job = TTSJob(str(client_id), audio_format)
+    _jobs[job.id] = job
+    _evict(now)
+    job.task = asyncio.create_task(_run_job(job, text, api_key, voice))
+    return job
+
+
+def get_tts_job(job_id: str) -> Optional[TTSJob]:
+    """Look up a live job; expired jobs are treated as unknown"""
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+    if job.expired(time.monotonic()):
+        _jobs.pop(job_id, None)
+        return None
+    return job
+
+
+async def wait_for_tts_job(job: TTSJob, timeout: float) -> TTSJob:
+    """Wait (up to timeout seconds) for a job to leave the pending state"""
+    if timeout > 0 and not job.done.is_set():
+        try:
+            await asyncio.wait_for(job.done.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+    return job
+
+
+async def iter_tts_job_pcm(job: TTSJob, idle_timeout: float) -> AsyncIterator[bytes]:
+    """
+    Yield a job's PCM chunks in order: those already synthesized, then each new
+    one as soon as it lands. Ends when the job finishes (or stalls for idle_timeout).
+    The caller pulls at its own pace, so a slow listener never holds up synthesis.
+    """
+    sent = 0
+    while True:
+        while sent < len(job.pcm_chunks):
+            yield job.pcm_chunks[sent]
+            sent += 1
+        if job.done.is_set():
+            return
+        try:
+            async with job.changed:
+                await asyncio.wait_for(
+                    job.changed.wait_for(lambda: len(job.pcm_chunks) > sent or job.done.is_set()),
+                    timeout=idle_timeout
+                )
+        except asyncio.TimeoutError:
+            print(f"[TTS Job] {job.id} relay stalled; closing stream")
+            return
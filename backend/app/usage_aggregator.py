@@ -0,0 +1,157 @@
+"""
+Write-behind usage accounting
+Chat turns add per-client/per-day deltas (messages, tokens, RAG queries) to an
+in-memory table instead of read-modify-writing a UsageRecord row each time. A
+background task flushes the deltas every USAGE_FLUSH_INTERVAL_SECONDS (and on
+shutdown) as one INSERT ... ON CONFLICT (client_id, date) DO UPDATE, which
+adds to the row, so any number of workers can flush without racing.
+
+Without a running flusher on the current loop (serverless entrypoints with
+lifespan off, scripts, tests) log() writes each turn through with the same
+UPSERT, so usage is never left in memory for a flush that will not come.
+"""
+import asyncio
+import threading
+import uuid
+from datetime import date
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+from .config import get_settings
+
+settings = get_settings()
+
+# (client_id, date) -> [message_count, token_count, rag_query_count]
+UsageKey = Tuple[str, date]
+
+
+class UsageAggregator:
+    """Accumulates usage deltas and flushes them in one batched UPSERT"""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._pending: Dict[UsageKey, list] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.flush_errors = 0
+
+    def record(self, client_id: UUID, messages: int = 0, tokens: int = 0, rag_queries: int = 0):
+        """Add one chat turn's usage (cheap; safe from threads and the event loop)"""
+        key = (str(client_id), date.today())
+        with self._lock:
+            deltas = self._pending.get(key)
+            if deltas is None:
+                deltas = self._pending[key] = [0, 0, 0]
+            deltas[0] += messages
+            deltas[1] += tokens
+            deltas[2] += rag_queries
+
+    def _running(self) -> bool:
+        if self._task is None or self._task.done():
+            return False
+        try:
+            return self._task.get_loop() is asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+    async def log(self, client_id: UUID, messages: int = 0, tokens: int = 0, rag_queries: int = 0):
+        """Record a chat turn's usage from async code (flushed inline if the flusher isn't running)"""
+        self.record(client_id, messages=messages, tokens=tokens, rag_queries=rag_queries)
+        if not self._running():
+            # No flusher on this loop (e.g. Mangum with lifespan off, scripts, tests)
+            await asyncio.to_thread(self.flush)
+
+    def pending_for(self, client_id: UUID) -> Dict[date, list]:
+        """Unflushed deltas for one client, by day (merged into /api/usage)"""
+        client_key = str(client_id)
+        with self._lock:
+            return {day: list(deltas) for (cid, day), deltas in self._pending.items() if cid == client_key}
+
+    def _restore(self, batch: Dict[UsageKey, list]):
+        """Put a failed batch back so the next flush retries it"""
+        with self._lock:
+            for key, deltas in batch.items():
+                current = self._pending.setdefault(key, [0, 0, 0])
+                for i in range(3):
+                    current[i] += deltas[i]
+
+    def flush(self) -> int:
+        """Write all pending deltas (blocking); returns the number of rows upserted"""
+        from sqlalchemy.dialects.postgresql import insert
+        from .database import engine
+        from .models import UsageRecord
+
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            rows = [
+                {
+                    "id": uuid.uuid4(),
+                    "client_id": UUID(client_id),
+                    "date": day,
+                    "message_count": deltas[0],
+                    "token_count": deltas[1],
+                    "rag_query_count": deltas[2],
+                }
+                for (client_id, day), deltas in batch.items()
+            ]
+            table = UsageRecord.__table__
+            statement = insert(table).values(rows)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.client_id, table.c.date],
+                set_={
+                    "message_count": table.c.message_count + statement.excluded.message_count,
+                    "token_count": table.c.token_count + statement.excluded.token_count,
+                    "rag_query_count": table.c.rag_query_count + statement.excluded.rag_query_count,
+                },
+            )
+            try:
+                with engine.begin() as conn:
+                    conn.execute(statement)
+            except Exception as e:
+                self.flush_errors += 1
+                self._restore(batch)
+                print(f"[Usage] Flush of {len(rows)} rows failed, will retry: {e}")
+                return 0
+            self.flushes += 1
+            self.rows_flushed += len(rows)
+            return len(rows)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self.flush)
+
+    def start(self):
+        """Start the periodic flusher (app startup)"""
+        if not self._running():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write whatever is left (app shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending_rows": pending,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "flush_errors": self.flush_errors,
+        }
+
+
+usage_aggregator = UsageAggregator(flush_interval=settings.usage_flush_interval_seconds)
@@ -0,0 +1,289 @@
+"""
+Persistent realtime voice sessions
+Pre-configured wss://api.x.ai/v1/realtime sessions, pooled per (API key, voice)
+so the WebSocket + session.update handshake is paid once per session instead of
+once per chat message.
+"""
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import websockets
+
+from .config import get_settings
+from .tts import TTS_REALTIME_WS, get_ephemeral_token, invalidate_ephemeral_token, _token_cache_key
+
+settings = get_settings()
+
+# CRITICAL: Voice Agent is conversational (user says X → assistant says Y). We send our
+# bot's reply as "user" input and force repeat via instruction + message framing.
+TTS_SESSION_INSTRUCTIONS = (
+    "You are a text-to-speech engine. The user will send a line that starts with "
+    "'SPEAK:' followed by the exact words to speak. Your ONLY output is to speak "
+    "those words—the part after 'SPEAK:'. Do not say 'SPEAK:' or anything else. "
+    "No greetings, no questions, no comment. Just the words after SPEAK:."
+)
+
+
+async def open_realtime_session(api_key: str, voice: str):
+    """Connect to the Voice API and configure voice + TTS instructions; returns the socket"""
+    # Step 1: Get ephemeral token
+    token = await get_ephemeral_token(api_key)
+
+    # Step 2: Connect via WebSocket
+    try:
+        ws = await websockets.connect(
+            TTS_REALTIME_WS,
+            extra_headers={"Authorization": f"Bearer {token}"},
+            ping_interval=20,
+            ping_timeout=10
+        )
+    except websockets.exceptions.InvalidStatusCode as e:
+        if e.status_code in (401, 403):
+            invalidate_ephemeral_token(api_key)
+        raise
+
+    # Step 3: Send session configuration
+    session_update = {
+        "type": "session.update",
+        "session": {
+            "voice": voice,
+            "instructions": TTS_SESSION_INSTRUCTIONS,
+            "audio": {
+                "input": {"format": {"type": "audio/pcm", "rate": 24000}},
+                "output": {"format": {"type": "audio/pcm", "rate": 24000}}
+            }
+        }
+    }
+    try:
+        await ws.send(json.dumps(session_update))
+
+        # Wait for session.updated
+        session_ready = False
+        for _ in range(5):
+            try:
+                msg = await asyncio.wait_for(ws.recv(), timeout=2.0)
+                obj = json.loads(msg)
+                if obj.get("type") == "session.updated":
+                    session_ready = True
+                    print(f"[TTS] Session configured with voice: {voice}")
+                    break
+            except asyncio.TimeoutError:
+                continue
+
+        if not session_ready:
+            print(f"[TTS] Warning: Session update not confirmed")
+    except Exception:
+        await ws.close()
+        raise
+    return ws
+
+
+class RealtimeSession:
+    """One configured realtime socket plus bookkeeping for reuse decisions"""
+
+    __slots__ = ("ws", "pool_key", "created_at", "last_used", "uses", "reusable")
+
+    def __init__(self, ws, pool_key: tuple):
+        self.ws = ws
+        self.pool_key = pool_key
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.uses = 0
+        self.reusable = False  # Set by the caller once an utterance finished cleanly
+
+
+class VoiceSessionPool:
+    """
+    Idle sessions are kept per (sha256(api key), voice), newest first. The total
+    number of open sessions (idle + in use) is capped per process; at the cap an
+    idle session for another key is closed to make room, otherwise callers wait.
+    """
+
+    def __init__(self, max_sessions: int, idle_timeout: float, max_age: float, max_uses: int,
+                 acquire_timeout: float, health_check_after: float):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self._idle: dict = {}  # pool_key -> [RealtimeSession]
+        self._open = 0
+        self._capacity: Optional[asyncio.Condition] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def _condition(self) -> asyncio.Condition:
+        if self._capacity is None:
+            self._capacity = asyncio.Condition()
+        return self._capacity
+
+    def _expired(self, session: RealtimeSession, now: float) -> bool:
+        return (
+            not session.ws.open
+            or now - session.last_used > self.idle_timeout
+            or now - session.created_at > self.max_age
+            or session.uses >= self.max_uses
+        )
+
+    async def _healthy(self, session: RealtimeSession) -> bool:
+        """Sessions idle for a while get a ping before reuse"""
+        now = time.monotonic()
+        if self._expired(session, now):
+            return False
+        if now - session.last_used < self.health_check_after:
+            return True
+        try:
+            pong = await session.ws.ping()
+            await asyncio.wait_for(pong, timeout=2.0)
+            return True
+        except Exception:
+            return False
+
+    async def _close(self, session: RealtimeSession):
+        try:
+            await session.ws.close()
+        except Exception:
+            pass
+        self.discarded += 1
+        condition = self._condition()
+        async with condition:
+            self._open -= 1
+            condition.notify()
+
+    def _pop_oldest_idle(self) -> Optional[RealtimeSession]:
+        oldest = None
+        for sessions in self._idle.values():
+            if sessions and (oldest is None or sessions[0].last_used < oldest.last_used):
+                oldest = sessions[0]
+        if oldest is not None:
+            self._idle[oldest.pool_key].remove(oldest)
+        return oldest
+
+    async def _acquire(self, api_key: str, voice: str) -> RealtimeSession:
+        pool_key = (_token_cache_key(api_key), voice)
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            idle = self._idle.get(pool_key)
+            while idle:
+                session = idle.pop()
+                if await self._healthy(session):
+                    self.reused += 1
+                    return session
+                await self._close(session)
+
+            condition = self._condition()
+            victim = None
+            async with condition:
+                if self._open < self.max_sessions:
+                    self._open += 1
+                    break
+                victim = self._pop_oldest_idle()
+                if victim is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("Voice session pool exhausted")
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        raise TimeoutError("Voice session pool exhausted")
+            if victim is not None:
+                await self._close(victim)
+
+        try:
+            ws = await open_realtime_session(api_key, voice)
+        except BaseException:
+            condition = self._condition()
+            async with condition:
+                self._open -= 1
+                condition.notify()
+            raise
+        self.created += 1
+        return RealtimeSession(ws, pool_key)
+
+    def _release(self, session: RealtimeSession):
+        session.uses += 1
+        session.last_used = time.monotonic()
+        session.reusable = False
+        self._idle.setdefault(session.pool_key, []).append(session)
+
+    @asynccontextmanager
+    async def session(self, api_key: str, voice: str) -> AsyncIterator[RealtimeSession]:
+        """
+        Borrow a configured session. It goes back to the pool only if the caller
+        marked it reusable (utterance finished cleanly); otherwise it is closed.
+        """
+        session = await self._acquire(api_key, voice)
+        try:
+            yield session
+        finally:
+            if session.reusable and session.ws.open:
+                self._release(session)
+            else:
+                await self._close(session)
+
+    async def sweep(self):
+        """Close idle sessions past their idle/age/use limits"""
+        now = time.monotonic()
+        for pool_key, sessions in list(self._idle.items()):
+            keep = []
+            for session in sessions:
+                if self._expired(session, now):
+                    await self._close(session)
+                else:
+                    keep.append(session)
+            if keep:
+                self._idle[pool_key] = keep
+            else:
+                self._idle.pop(pool_key, None)
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 2, 5.0))
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"[TTS Pool] Sweep failed (non-fatal): {e}")
+
+    def start(self):
+        """Start the idle reaper (called on app startup)"""
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_forever())
+
+    async def close_all(self):
+        """Stop the reaper and close every idle session (called on shutdown)"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for sessions in list(self._idle.values()):
+            for session in sessions:
+                await self._close(session)
+        self._idle.clear()
+        self._capacity = None
+
+    def stats(self) -> dict:
+        idle = sum(len(sessions) for sessions in self._idle.values())
+        return {
+            "open": self._open,
+            "idle": idle,
+            "in_use": self._open - idle,
+            "max_sessions": self.max_sessions,
+            "created": self.created,
+            "reused": self.reused,
+            "discarded": self.discarded,
+        }
+
+
+voice_pool = VoiceSessionPool(
+    max_sessions=settings.tts_session_max_sessions,
+    idle_timeout=settings.tts_session_idle_timeout_seconds,
+    max_age=settings.tts_session_max_age_seconds,
+    max_uses=settings.tts_session_max_uses,
+    acquire_timeout=settings.tts_session_acquire_timeout_seconds,
+    health_check_after=settings.tts_session_health_check_after_seconds,
+)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark the streaming chunker on a large synthetic document.
+Text is generated in pieces (like PDF pages / file blocks), so the input is
+never held in memory and peak usage reflects the chunker alone.
+
+Example (from repo root):
+  cd backend && python -m scripts.bench_chunker --mb 128
+  cd backend && python -m scripts.bench_chunker --mb 128 --unit tokens
+
+Prints chunk count, throughput (MB/s) and peak traced memory.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# Add parent so we can import app
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.chunker import iter_chunks
+
+WORDS = (
+    "refund shipping order invoice account widget support delivery returns policy "
+    "subscription billing customer warranty product tracking exchange payment"
+).split()
+
+
+def synthetic_pieces(total_bytes: int, piece_bytes: int, seed: int = 1):
+    """Paragraphs of short sentences, yielded in pieces of about piece_bytes"""
+    rng = random.Random(seed)
+    produced = 0
+    while produced < total_bytes:
+        paragraphs = []
+        size = 0
+        while size < piece_bytes:
+            sentences = (
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 14))).capitalize() + "."
+                for _ in range(rng.randint(2, 10))
+            )
+            paragraph = " ".join(sentences)
+            paragraphs.append(paragraph)
+            size += len(paragraph) + 2
+        piece = "\n\n".join(paragraphs) + "\n\n"
+        produced += len(piece)
+        yield piece
+
+
+def run(args, measure, traced: bool):
+    total = args.mb * 1024 * 1024
+    if traced:
+        tracemalloc.start()
+    started = time.perf_counter()
+    chunks = longest = 0
+    for chunk in iter_chunks(synthetic_pieces(total, args.piece_kb * 1024), args.chunk_size, args.overlap, measure):
+        chunks += 1
+        longest = max(longest, len(chunk))
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if traced:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return chunks, longest, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mb", type=int, default=128, help="Input size in MB")
+    parser.add_argument("--piece-kb", type=int, default=64, help="Size of each input piece in KB")
+    parser.add_argument("--unit", choices=("chars", "tokens"), default="chars")
+    parser.add_argument("--chunk-size", type=int, default=1500)
+    parser.add_argument("--overlap", type=int, default=200)
+    args = parser.parse_args()
+
+    measure = len
+    if args.unit == "tokens":
+        from app.prompt_budget import count_tokens
+        measure = count_tokens
+
+    chunks, longest, elapsed, _ = run(args, measure, traced=False)
+    print(f"[Bench] {args.mb}MB in {args.piece_kb}KB pieces, {args.chunk_size} {args.unit}/chunk, overlap {args.overlap}")
+    print(f"[Bench] {chunks} chunks (longest {longest} chars) in {elapsed:.1f}s = {args.mb / elapsed:.1f} MB/s")
+    # Second pass under tracemalloc (slower) for peak memory
+    _, _, _, peak = run(args, measure, traced=True)
+    print(f"[Bench] Peak traced memory: {peak / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Shared test setup
+"""
+import uuid
+
+import pytest
+
+from app.auth import hash_api_key
+from app.database import SessionLocal, init_db
+from app.models import Client, ClientConfig, TierEnum
+
+
+@pytest.fixture(scope="session", autouse=True)
+def migrated_database():
+    """Tables and startup migrations, as the app's startup hook would run them"""
+    init_db()
+
+
+@pytest.fixture
+def db():
+    """A sync session for the test, closed afterwards"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def make_client(db):
+    """
+    make_client(tier=..., config={...}) -> (client, api_key): a committed client with a
+    working API key (and a ClientConfig with those columns, if given). Deleted, with
+    everything it owns, after the test.
+    """
+    created = []
+
+    def make(tier: TierEnum = TierEnum.BASIC, config: dict = None):
+        key = "snip_" + uuid.uuid4().hex
+        client = Client(
+            email=f"test-{uuid.uuid4().hex[:8]}@example.com", company_name="Test Co",
+            api_key=key[:16] + "...", api_key_hash=hash_api_key(key), tier=tier, is_active=True,
+        )
+        db.add(client)
+        db.flush()
+        if config is not None:
+            db.add(ClientConfig(client_id=client.id, **config))
+        db.commit()
+        created.append(client.id)
+        return client, key
+
+    yield make
+    db.rollback()
+    db.expire_all()
+    for client_id in created:
+        client = db.get(Client, client_id)
+        if client is not None:
+            db.delete(client)
+    db.commit()
@@ -0,0 +1,64 @@
+"""
+Semantic answer cache tests
+"""
+import asyncio
+from types import SimpleNamespace
+from uuid import uuid4
+
+import chromadb
+import pytest
+
+from app import answer_cache, rag
+
+
+@pytest.fixture
+def memory_chroma(monkeypatch):
+    """Swap the persistent Chroma client for an in-memory one (tenants are fresh uuids per test)"""
+    client = chromadb.EphemeralClient()
+    monkeypatch.setattr(rag, "chroma_client", client)
+    return client
+
+
+def _tenant(system_prompt="Be nice"):
+    client = SimpleNamespace(id=uuid4(), company_name="Acme", tier="standard")
+    config = SimpleNamespace(bot_name="Bot", system_prompt=system_prompt)
+    return client, config
+
+
+def test_similar_question_hits_and_invalidation_clears(memory_chroma):
+    """A near-identical question reuses the answer until the client's knowledge changes"""
+    client, config = _tenant()
+
+    async def run():
+        miss = await answer_cache.lookup_answer(client, config, "grok", "What are your hours?", [1.0, 0.0, 0.0])
+        assert miss.answer is None
+        await answer_cache.store_answer(miss, "9 to 5")
+
+        hit = await answer_cache.lookup_answer(client, config, "grok", "what are your hours", [0.99, 0.05, 0.0])
+        assert hit.answer == "9 to 5"
+        unrelated = await answer_cache.lookup_answer(client, config, "grok", "Where are you?", [0.0, 1.0, 0.0])
+        assert unrelated.answer is None
+
+        answer_cache.invalidate_answers(client.id)
+        assert (await answer_cache.lookup_answer(client, config, "grok", "What are your hours?", [1.0, 0.0, 0.0])).answer is None
+
+    asyncio.run(run())
+
+
+def test_fingerprint_and_stale_store(memory_chroma):
+    """A changed prompt never sees old answers; answers computed before an invalidation are dropped"""
+    client, config = _tenant()
+
+    async def run():
+        lookup = await answer_cache.lookup_answer(client, config, "grok", "Hi", [1.0, 0.0])
+        answer_cache.invalidate_answers(client.id)  # e.g. a document upload finished mid-completion
+        await answer_cache.store_answer(lookup, "stale")
+        assert (await answer_cache.lookup_answer(client, config, "grok", "Hi", [1.0, 0.0])).answer is None
+
+        fresh = await answer_cache.lookup_answer(client, config, "grok", "Hi", [1.0, 0.0])
+        await answer_cache.store_answer(fresh, "Hello!")
+        _, changed = _tenant(system_prompt="Be terse")
+        assert (await answer_cache.lookup_answer(client, changed, "grok", "Hi", [1.0, 0.0])).answer is None
+        assert (await answer_cache.lookup_answer(client, config, "grok", "Hi", [1.0, 0.0])).answer == "Hello!"
+
+    asyncio.run(run())
@@ -69,3 +69,9 @@ def test_create_client_no_data():
     response = client.post("/api/clients", json={})
     # Should return validation error
     assert response.status_code == 422  # Unprocessable Entity
+
+
+def test_chat_stream_validates_body():
+    """Test streaming chat endpoint rejects a missing message/client_id"""
+    response = client.post("/api/chat/stream", json={})
+    assert response.status_code == 422
@@ -0,0 +1,58 @@
+"""
+API key cache tests
+"""
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app.api_key_cache import ApiKeyCache, api_keys
+from app.auth import hash_api_key
+from app.main import app
+from app.models import Client, TierEnum
+
+
+def test_lookup_racing_an_invalidation_is_not_stored():
+    cache = ApiKeyCache(max_entries=10, ttl_seconds=60)
+    client = Client(id=uuid.uuid4(), email="a@example.com", company_name="A", tier=TierEnum.BASIC)
+
+    _, generation = cache.lookup("hash")
+    cache.invalidate(client.id)  # e.g. the key was rotated while we were querying
+    cache.store("hash", generation, client, False)
+    assert cache.lookup("hash")[0] is None
+
+    _, generation = cache.lookup("hash")
+    cache.store("hash", generation, client, False)
+    cached, _ = cache.lookup("hash")
+    assert cached.client_id == client.id and cached.client.email == "a@example.com"
+    assert cache.lookup("hash", max_age=0)[0] is None  # Snapshot readers take only recent entries
+    assert cache.lookup("hash")[0] is not None
+
+
+def test_cached_key_stops_working_after_resend(make_client):
+    """Repeat requests are served from the cache; a rotated key is rejected at once"""
+    client, key = make_client(config={"bot_name": "Keybot"})
+    http = TestClient(app)
+    headers = {"X-API-Key": key}
+    hits = api_keys.hits
+    assert http.get("/api/config", headers=headers).json()["bot_name"] == "Keybot"
+    assert http.get("/api/clients/me", headers=headers).json()["email"] == client.email
+    assert http.get("/api/documents", headers=headers).status_code == 200
+    assert api_keys.hits - hits == 2
+
+    assert http.post("/api/resend-api-key", json={"email": client.email}).status_code == 200
+    assert http.get("/api/config", headers=headers).status_code == 401
+
+
+def test_key_rotated_by_another_worker(db, make_client):
+    """No local invalidation: write endpoints see the new hash at once, snapshots expire quickly"""
+    client, key = make_client(config={"bot_name": "Rotabot"})
+    http = TestClient(app)
+    headers = {"X-API-Key": key}
+    assert http.get("/api/documents", headers=headers).status_code == 200
+    assert http.get("/api/config", headers=headers).status_code == 200
+
+    client.api_key_hash = hash_api_key("snip_" + uuid.uuid4().hex)  # Rotated elsewhere
+    db.commit()
+    assert http.get("/api/config", headers=headers).status_code == 200  # Snapshot still young
+    assert http.get("/api/documents", headers=headers).status_code == 401  # Row re-checked
+    assert http.get("/api/config", headers=headers).status_code == 401  # ...and the entry dropped
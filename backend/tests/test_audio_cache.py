@@ -0,0 +1,46 @@
+"""
+TTS audio cache tests
+"""
+import asyncio
+import os
+
+from app.audio_cache import AudioCache, tts_cache_key
+
+
+def test_cache_key_normalizes_whitespace():
+    """Whitespace differences map to the same entry; voice does not"""
+    assert tts_cache_key("Ara", "Hello   there\n") == tts_cache_key("Ara", " Hello there")
+    assert tts_cache_key("Ara", "Hello there") != tts_cache_key("Leo", "Hello there")
+
+
+def test_memory_then_disk_tier(tmp_path):
+    """Entries evicted from memory are still served from disk"""
+    cache = AudioCache(max_memory_bytes=100, directory=str(tmp_path), ttl_seconds=60)
+
+    async def run():
+        await cache.put("a" * 64, b"x" * 80)
+        await cache.put("b" * 64, b"y" * 80)  # Evicts "a" from memory
+        assert await cache.get("b" * 64) == b"y" * 80
+        assert await cache.get("a" * 64) == b"x" * 80
+        assert await cache.get("c" * 64) is None
+
+    asyncio.run(run())
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["disk_hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_expired_disk_entry_is_evicted(tmp_path):
+    """Entries older than the TTL are deleted on read"""
+    cache = AudioCache(max_memory_bytes=0, directory=str(tmp_path), ttl_seconds=60)
+    key = "d" * 64
+
+    async def run():
+        await cache.put(key, b"z" * 10)
+        path = cache._path(key)
+        os.utime(path, (0, 0))
+        assert await cache.get(key) is None
+        assert not os.path.exists(path)
+
+    asyncio.run(run())
@@ -0,0 +1,90 @@
+"""
+Chunk registry and re-upload reuse tests
+"""
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import rag
+from app.chunk_registry import DocumentGone, add_references, chunk_id, copy_references, document_chunk_ids, release_references
+from app.main import _processed_duplicate, _reuse_processed_document, app
+from app.models import Document, DocumentStatus, TierEnum
+
+
+def _document(db, client, name="doc.txt") -> Document:
+    doc = Document(id=uuid.uuid4(), client_id=client.id, filename=name, file_type="txt", file_size=10)
+    db.add(doc)
+    db.commit()
+    return doc
+
+
+def test_chunks_are_shared_and_dropped_with_their_last_document(db, make_client):
+    a, b, c, d = (chunk_id(text) for text in ("returns policy", "shipping times", "warranty terms", "store hours"))
+    dropped = []
+    client, _ = make_client(tier=TierEnum.PREMIUM)
+    doc_a, doc_b = _document(db, client).id, _document(db, client).id
+    assert add_references(db, client.id, doc_a, [a, b, c, a]) == set()
+    assert add_references(db, client.id, doc_b, [b, c, d]) == {b, c}
+    assert add_references(db, client.id, doc_b, [b, c, d]) == {b, c}  # Retried job: its own rows don't count
+    db.commit()
+
+    assert release_references(db, client.id, doc_a, dropped.extend, candidates=["legacy-id"]) == 2
+    assert sorted(dropped) == sorted([a, "legacy-id"])  # b and c are still referenced by doc_b
+    release_references(db, client.id, doc_b, dropped.extend)
+    db.commit()
+    assert sorted(dropped) == sorted([a, "legacy-id", b, c, d])
+
+
+def test_identical_upload_reuses_processed_document(db, make_client):
+    """Chunk presence in Chroma (document_chunks_stored) is checked by the upload route itself"""
+    client, _ = make_client(tier=TierEnum.PREMIUM)
+    source = Document(
+        client_id=client.id, filename="handbook.pdf", file_type="pdf", file_size=10, content_hash="f" * 64,
+        status=DocumentStatus.COMPLETED, chunk_count=2,
+    )
+    db.add(source)
+    db.flush()
+    add_references(db, client.id, source.id, [chunk_id("one"), chunk_id("two")])
+    db.commit()
+
+    again = Document(id=uuid.uuid4(), client_id=client.id, filename="handbook-v2.pdf", file_type="pdf", file_size=10, content_hash="f" * 64)
+    other = Document(id=uuid.uuid4(), client_id=client.id, filename="other.pdf", file_type="pdf", file_size=10, content_hash="e" * 64)
+    db.add_all([again, other])
+    assert _processed_duplicate(db, again).id == source.id and _processed_duplicate(db, other) is None
+    assert _reuse_processed_document(db, again, source)
+    db.commit()
+    assert again.status == DocumentStatus.COMPLETED and again.chunk_count == 2 and again.progress_percent == 100
+
+    # The copy holds its own references: deleting the original drops nothing
+    dropped = []
+    release_references(db, client.id, source.id, dropped.extend)
+    assert dropped == [] and copy_references(db, client.id, uuid.uuid4(), again.id) == 0
+    db.commit()
+
+
+def test_deleted_document_leaves_no_references(monkeypatch, db, make_client):
+    """A failed release keeps the document; a deleted document cannot register chunks"""
+    client, key = make_client(tier=TierEnum.PREMIUM)
+    doc_id = _document(db, client).id
+    add_references(db, client.id, doc_id, [chunk_id("returns policy")])
+    db.commit()
+    http = TestClient(app)
+    async def broken(*args, **kwargs):
+        raise ConnectionError("chroma unavailable")
+
+    monkeypatch.setattr(rag, "delete_document_embeddings", broken)
+    assert http.delete(f"/api/documents/{doc_id}", headers={"X-API-Key": key}).status_code == 503
+    db.expire_all()
+    assert db.get(Document, doc_id) is not None and document_chunk_ids(db, doc_id) == [chunk_id("returns policy")]
+
+    monkeypatch.undo()
+    assert http.delete(f"/api/documents/{doc_id}", headers={"X-API-Key": key}).status_code == 200
+    db.expire_all()
+    assert db.get(Document, doc_id) is None and document_chunk_ids(db, doc_id) == []
+
+    # Its ingestion job reaching the registry afterwards registers nothing
+    with pytest.raises(DocumentGone):
+        add_references(db, client.id, doc_id, [chunk_id("store hours")])
+    db.rollback()
+    assert document_chunk_ids(db, doc_id) == []
@@ -0,0 +1,49 @@
+"""
+Streaming chunker tests
+"""
+import random
+
+from app.chunker import SENTENCE_END, iter_chunks
+
+
+def _document(paragraphs: int) -> str:
+    rng = random.Random(7)
+    words = "refund shipping order invoice account widget support delivery returns policy".split()
+    return "\n\n".join(
+        " ".join(" ".join(rng.choice(words) for _ in range(rng.randint(4, 9))).capitalize() + "." for _ in range(rng.randint(1, 12)))
+        for _ in range(paragraphs)
+    )
+
+
+def _pieces(text: str, rng: random.Random):
+    i = 0
+    while i < len(text):
+        step = rng.randint(1, 200)
+        yield text[i:i + step]
+        i += step
+
+
+def test_chunks_are_bounded_overlapping_and_independent_of_piece_boundaries():
+    text = _document(200)
+    whole = list(iter_chunks(text, chunk_size=300, overlap=80))
+    assert whole == list(iter_chunks(_pieces(text, random.Random(1)), chunk_size=300, overlap=80))
+    assert len(whole) > 20 and all(len(chunk) <= 300 for chunk in whole)
+    # Chunks open with the previous chunk's last sentence(s), unless none fit in the overlap
+    carried = 0
+    for previous, chunk in zip(whole, whole[1:]):
+        sentences = SENTENCE_END.split(chunk)
+        carried += any(previous.endswith(" ".join(sentences[:k])) for k in range(1, len(sentences)))
+    assert carried >= 0.9 * (len(whole) - 1)
+
+
+def test_unbroken_text_and_token_sizing():
+    """No paragraph or sentence breaks (and a huge 'word') still yields bounded chunks, losing nothing"""
+    blob = "x" * 5000
+    text = " ".join(["lorem ipsum dolor sit amet"] * 4000) + " " + blob + " tail" * 40
+    chunks = list(iter_chunks(_pieces(text, random.Random(2)), chunk_size=500, overlap=0))
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert "".join(chunks).replace(" ", "") == text.replace(" ", "")
+
+    words = lambda s: len(s.split())  # Stand-in tokenizer: one token per word
+    chunks = list(iter_chunks(_document(50), chunk_size=40, overlap=10, measure=words))
+    assert chunks and all(words(chunk) <= 40 + 40 // 10 for chunk in chunks)
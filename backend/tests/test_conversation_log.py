@@ -0,0 +1,43 @@
+"""
+Asynchronous conversation logging tests
+"""
+import asyncio
+import uuid
+
+from app.conversation_log import ChatTurn, ConversationLogWriter
+from app.models import Conversation
+
+
+def test_queued_turns_are_written_in_batches(db, make_client):
+    """Turns queued while the writer runs end up as conversations with ordered messages"""
+    client, _ = make_client()
+    writer = ConversationLogWriter(max_queue=100, batch_size=8, full_policy="drop", block_timeout=0.1)
+
+    async def run():
+        writer.start()
+        for i in range(20):
+            await writer.log(ChatTurn(client.id, f"question {i}", f"answer {i}"))
+        await writer.stop()
+
+    asyncio.run(run())
+    conversations = db.query(Conversation).filter(Conversation.client_id == client.id).all()
+    assert len(conversations) == 20
+    assert [m.role for m in conversations[0].messages] == ["user", "assistant"]
+    stats = writer.stats()
+    assert stats["written"] == 20 and stats["dropped"] == 0 and stats["queue_depth"] == 0
+
+
+def test_full_queue_drops_or_blocks():
+    """"drop" discards at once; "block" waits for the writer to make room"""
+    async def run(policy):
+        writer = ConversationLogWriter(max_queue=1, batch_size=8, full_policy=policy, block_timeout=0.05)
+        writer.start()
+        writer._write = lambda turns: None  # Don't touch the database
+        await writer.log(ChatTurn(uuid.uuid4(), "a", "b"))
+        await writer.log(ChatTurn(uuid.uuid4(), "c", "d"))  # Queue full: writer hasn't run yet
+        await writer.stop()
+        return writer.stats()
+
+    assert asyncio.run(run("drop"))["dropped"] == 1
+    blocked = asyncio.run(run("block"))
+    assert blocked["dropped"] == 0 and blocked["enqueued"] == 2
@@ -0,0 +1,95 @@
+"""
+Multi-turn conversation memory tests
+"""
+import asyncio
+import uuid
+
+from app import conversation_memory
+from app.conversation_log import ChatTurn, write_turns
+from app.conversation_memory import ConversationStore
+from app.database import AsyncSessionLocal, dispose_async_engine
+
+
+def test_history_window_is_compacted_into_summary(monkeypatch):
+    """Turns beyond the window are summarized; a failing summarizer falls back to an extract"""
+    monkeypatch.setattr(conversation_memory.settings, "conversation_history_max_messages", 4)
+    store = ConversationStore(max_conversations=10, ttl_seconds=60)
+    calls = []
+
+    async def summarize(summary, messages):
+        calls.append([m["content"] for m in messages])
+        return "Visitor asked about q0"
+
+    async def failing(summary, messages):
+        raise RuntimeError("upstream down")
+
+    async def run():
+        memory = await store.open(None, uuid.uuid4(), None)
+        for i in range(3):
+            store.remember(memory, f"q{i}", f"a{i}", summarize)
+            await asyncio.sleep(0)
+        assert memory.summary == "Visitor asked about q0"
+        assert [m["content"] for m in memory.recent] == ["q1", "a1", "q2", "a2"]
+        store.remember(memory, "q3", "a3", failing)
+        await asyncio.sleep(0)
+        return memory
+
+    memory = asyncio.run(run())
+    assert calls == [["q0", "a0"]]
+    assert memory.summary.startswith("Visitor asked about q0\nuser: q1")
+    assert [m["content"] for m in memory.recent] == ["q2", "a2", "q3", "a3"]
+    assert store.stats()["summary_fallbacks"] == 1
+
+
+def test_conversation_reloaded_from_database_only_for_its_client(make_client):
+    """An evicted conversation is rebuilt from its messages; another client's id starts fresh"""
+    client, _ = make_client()
+    conversation_id = uuid.uuid4()
+    write_turns([ChatTurn(client.id, "Hi, I'm Sam", "Hello Sam", conversation_id)])
+    write_turns([ChatTurn(client.id, "Do you ship?", "Yes", conversation_id)])
+
+    store = ConversationStore(max_conversations=10, ttl_seconds=60)
+
+    async def run():
+        adb = AsyncSessionLocal()
+        try:
+            memory = await store.open(adb, client.id, conversation_id)
+            assert memory.conversation_id == conversation_id
+            assert [m["content"] for m in memory.prompt_messages()] == ["Hi, I'm Sam", "Hello Sam", "Do you ship?", "Yes"]
+            assert await store.open(adb, client.id, conversation_id) is memory  # Served from memory now
+
+            other = await store.open(adb, uuid.uuid4(), conversation_id)
+            assert other.conversation_id != conversation_id and not other.has_history()
+        finally:
+            await adb.close()
+            await dispose_async_engine()
+
+    asyncio.run(run())
+
+
+def test_saved_summary_is_resumed_on_reload(monkeypatch, make_client):
+    """Another worker (or a restart) continues from the LLM summary, not from the last few messages"""
+    monkeypatch.setattr(conversation_memory.settings, "conversation_history_max_messages", 4)
+    client, _ = make_client()
+
+    async def summarize(summary, messages):
+        return "Sam wants a refund for order 42"
+
+    async def run():
+        store = ConversationStore(max_conversations=10, ttl_seconds=60)
+        memory = await store.open(None, client.id, None)
+        for i in range(3):
+            write_turns([ChatTurn(client.id, f"q{i}", f"a{i}", memory.conversation_id)])
+            store.remember(memory, f"q{i}", f"a{i}", summarize)
+        await asyncio.gather(*(task for task in asyncio.all_tasks() if task is not asyncio.current_task()))
+
+        adb = AsyncSessionLocal()
+        try:
+            reloaded = await ConversationStore(max_conversations=10, ttl_seconds=60).open(adb, client.id, memory.conversation_id)
+        finally:
+            await adb.close()
+            await dispose_async_engine()
+        assert reloaded.summary == "Sam wants a refund for order 42" and reloaded.summarized == 2
+        assert [m["content"] for m in reloaded.recent] == ["q1", "a1", "q2", "a2"]
+
+    asyncio.run(run())
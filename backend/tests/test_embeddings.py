@@ -0,0 +1,100 @@
+"""
+Embedding engine tests
+"""
+import asyncio
+import sys
+import uuid
+
+import chromadb
+from chromadb.utils import embedding_functions
+import numpy as np
+import pytest
+
+from app import rag
+from app.chunk_registry import document_chunk_ids
+from app.embeddings import DEFAULT_MODEL, EmbeddingCache, EmbeddingEngine
+from app.models import Document, TierEnum
+
+
+class FakeEncoder:
+    """Stands in for the model: records batch sizes, vector = [len(text), 1]"""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return np.asarray([[float(len(text)), 1.0] for text in texts], dtype=np.float32)
+
+
+def _engine(path, model="test-model", batch_size=2):
+    engine = EmbeddingEngine(model, batch_size=batch_size, cache=EmbeddingCache(str(path)))
+    engine._encode = FakeEncoder()
+    return engine
+
+
+def test_batches_unique_texts_and_reuses_cached_embeddings(tmp_path):
+    path = tmp_path / "embeddings.sqlite3"
+    engine = _engine(path)
+    vectors = engine.embed(["a", "bb", "a", "ccc", "dddd", "eeeee"])
+    assert [v[0] for v in vectors] == [1.0, 2.0, 1.0, 3.0, 4.0, 5.0]
+    assert engine._encode.batches == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+    engine.close()
+
+    # After a restart the cache answers; another model does not share its vectors
+    again = _engine(path)
+    assert again.embed(["eeeee", "a"]) == [[5.0, 1.0], [1.0, 1.0]] and again._encode.batches == []
+    assert again.cache.stats()["hits"] == 2
+    other = _engine(path, model="other-model")
+    other.embed(["a"])
+    assert other._encode.batches == [["a"]]
+
+
+def test_documents_are_stored_with_engine_embeddings(monkeypatch, tmp_path, db, make_client):
+    """Chroma never runs its own (downloading) embedder for document chunks"""
+    engine = _engine(tmp_path / "embeddings.sqlite3", batch_size=4)
+    monkeypatch.setattr(rag, "embedding_engine", engine)
+    monkeypatch.setattr(rag, "chroma_client", chromadb.EphemeralClient())
+    monkeypatch.setattr(rag, "EMBED_BATCH_SIZE", 3)  # Several spool batches
+    document = tmp_path / "handbook.txt"
+    document.write_text("\n\n".join(f"Section {i}. " + "Returns are accepted within thirty days of delivery. " * 20 for i in range(6)))
+
+    client, _ = make_client(tier=TierEnum.PREMIUM)
+    doc = Document(id=uuid.uuid4(), client_id=client.id, filename="handbook.txt", file_type="txt", file_size=1)
+    db.add(doc)
+    db.commit()
+    chunk_count = asyncio.run(rag.process_document(client.id, doc.id, str(document), "txt", "handbook.txt"))
+    stored = rag.chroma_client.get_collection(rag.get_collection_name(client.id)).get(include=["embeddings"])
+    assert chunk_count == len(stored["ids"]) == engine.encoded
+    assert all(len(e) == 2 for e in stored["embeddings"]) and max(len(b) for b in engine._encode.batches) <= 3
+    assert len(document_chunk_ids(db, doc.id)) == chunk_count and not (tmp_path / "handbook.txt.chunks").exists()
+
+
+def test_unloadable_model_fails_instead_of_switching_models(monkeypatch, tmp_path):
+    """Only the default model may fall back to Chroma's ONNX build, and its vectors are cached apart"""
+    monkeypatch.setitem(sys.modules, "sentence_transformers", None)  # Import fails
+    engine = EmbeddingEngine("BAAI/bge-small-en-v1.5", cache=EmbeddingCache(str(tmp_path / "embeddings.sqlite3")))
+    with pytest.raises(RuntimeError):
+        engine.embed(["returns policy"])
+    assert engine.cache.stats()["writes"] == 0
+
+    monkeypatch.setattr(embedding_functions, "DefaultEmbeddingFunction", lambda: lambda texts: [[0.5, 0.5] for _ in texts])
+    fallback = EmbeddingEngine(DEFAULT_MODEL, cache=EmbeddingCache(str(tmp_path / "embeddings.sqlite3")))
+    fallback.embed(["returns policy"])
+    assert fallback.backend == "onnx" and fallback.cache_model != DEFAULT_MODEL
+    with pytest.raises(RuntimeError):
+        EmbeddingEngine(DEFAULT_MODEL, model_dir=str(tmp_path / "model")).warm()
+
+
+def test_failed_startup_warmup_is_logged(capsys):
+    from app.main import _warm_in_background
+
+    def warm():
+        raise RuntimeError("model directory missing")
+
+    async def run():
+        _warm_in_background("Embedding model", warm)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert "[Startup] Embedding model warmup failed: RuntimeError('model directory missing')" in capsys.readouterr().out
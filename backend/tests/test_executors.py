@@ -0,0 +1,58 @@
+"""
+Blocking-work executor tests
+"""
+import asyncio
+import json
+import threading
+
+import pytest
+
+from app.executors import BlockingPool
+from app.rag import spool_chunks
+
+
+def test_saturated_pool_does_not_block_other_pools():
+    """A stuck extraction queues behind its own workers while vector calls still run"""
+    extraction = BlockingPool("test-extraction", 1)
+    vector = BlockingPool("test-vector", 2)
+    release = threading.Event()
+
+    async def run():
+        stuck = [asyncio.ensure_future(extraction.run(release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        stats = extraction.stats()
+        assert stats["in_flight"] == 2 and stats["queued"] == 1 and stats["saturation"] == 2.0
+        assert await asyncio.wait_for(vector.run(sum, [1, 2, 3]), 1) == 6
+        release.set()
+        await asyncio.gather(*stuck)
+
+    try:
+        asyncio.run(run())
+    finally:
+        extraction.shutdown()
+        vector.shutdown()
+    assert extraction.stats()["completed"] == 2 and extraction.stats()["peak_in_flight"] == 2
+    assert vector.stats()["in_flight"] == 0
+
+
+def test_process_pool_extracts_and_counts_failures(tmp_path):
+    pool = BlockingPool("test-processes", 1, processes=True)
+    document, blank = tmp_path / "doc.txt", tmp_path / "blank.txt"
+    document.write_text(("Shipping takes three to five business days for most orders. " * 5 + "\n\n") * 3)
+    blank.write_text("   ")
+
+    spool = tmp_path / "doc.txt.chunks"
+
+    async def run():
+        count = await pool.run(spool_chunks, str(document), "txt", str(spool))
+        with pytest.raises(ValueError):
+            await pool.run(spool_chunks, str(blank), "txt", str(tmp_path / "blank.txt.chunks"))
+        return count
+
+    try:
+        count = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    chunks = [json.loads(line) for line in spool.read_text().splitlines()]
+    assert count == len(chunks) and "Shipping" in chunks[0]
+    assert pool.stats()["completed"] == 1 and pool.stats()["failed"] == 1 and pool.stats()["kind"] == "process"
@@ -0,0 +1,67 @@
+"""
+FAQ fast path tests
+"""
+import asyncio
+from types import SimpleNamespace
+from uuid import uuid4
+
+import chromadb
+
+from app import faq_index, rag
+from app.faq_index import ClientFAQIndex
+
+
+def test_match_accepts_verbatim_lexical_and_semantic_hits():
+    """Verbatim and near-verbatim questions match, and so do paraphrases with a close embedding"""
+    index = ClientFAQIndex(
+        ids=["a", "b", "c"],
+        questions=["What are your opening hours?", "What are your hours?", "Do you ship abroad?"],
+        metadatas=[{"answer": "9-5", "priority": 0}, {"answer": "9-5 weekdays", "priority": 5}, {"answer": "Yes", "priority": 0}],
+        embeddings=[[1.0, 0.0], [0.6, 0.8], [0.0, 1.0]],
+    )
+    assert index.match("what are your hours", None) == "9-5 weekdays"
+    assert index.match("Do you ship abroad", None) == "Yes"
+    assert index.match("Tell me about pricing", [-1.0, 0.2]) is None
+    # Paraphrase: little word overlap, but the embedding is a near-exact hit
+    assert index.match("When are you open?", [1.0, 0.01]) == "9-5"
+
+
+def test_stronger_match_beats_higher_priority():
+    """An exact match on a low-priority FAQ wins over a barely-semantic one; priority only breaks ties"""
+    index = ClientFAQIndex(
+        ids=["a", "b", "c"],
+        questions=["Can I return an item?", "What is the returns policy?", "Can I return an item?"],
+        metadatas=[{"answer": "Yes, within 30 days", "priority": 0}, {"answer": "See our policy page", "priority": 9},
+                   {"answer": "Yes, within 30 days (store credit)", "priority": 3}],
+        embeddings=[[1.0, 0.0], [0.9, 0.436], [1.0, 0.0]],
+    )
+    # b clears the semantic threshold (cosine 0.9) but a and c are verbatim; c outranks a by priority
+    assert index.match("can i return an item", [1.0, 0.0]) == "Yes, within 30 days (store credit)"
+    index.priorities[1] = 0
+    index.priorities[2] = -1
+    assert index.match("can i return an item", [1.0, 0.0]) == "Yes, within 30 days"
+
+
+def test_incremental_updates(monkeypatch):
+    """Create/update/delete keep the client's index in step without a rebuild"""
+    monkeypatch.setattr(rag, "chroma_client", chromadb.EphemeralClient())
+    monkeypatch.setattr(rag, "embed_query", lambda text: [1.0, 0.0] if "refund" in text.lower() else [0.0, 1.0])
+    client_id = uuid4()
+    faq = SimpleNamespace(id=uuid4(), question="How do refunds work?", answer="Within 30 days", priority=0, category=None)
+
+    async def execute(statement):
+        return SimpleNamespace(scalars=lambda: SimpleNamespace(all=lambda: []))
+
+    db = SimpleNamespace(execute=execute)
+
+    async def run():
+        assert await faq_index.match_faq(db, client_id, "How do refunds work?", None) is None  # Backfills an empty index
+        await faq_index.index_faq(client_id, faq)
+        assert await faq_index.match_faq(db, client_id, "how do refunds work", None) == "Within 30 days"
+        faq.answer = "Within 14 days"
+        await faq_index.index_faq(client_id, faq)
+        assert await faq_index.match_faq(db, client_id, "Can I get a refund?", [1.0, 0.0]) == "Within 14 days"
+        await faq_index.remove_faq(client_id, faq.id)
+        assert await faq_index.match_faq(db, client_id, "How do refunds work?", None) is None
+
+    asyncio.run(run())
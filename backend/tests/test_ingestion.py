@@ -0,0 +1,187 @@
+"""
+Document ingestion queue tests
+"""
+import asyncio
+import hashlib
+import io
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app import ingestion, rag
+from app.database import SessionLocal
+from app.main import app
+from app.ingestion import UploadTooLarge, IngestionWorker, claim_job, enqueue_document, retry_delay_seconds, spool_upload
+from app.models import Document, DocumentStatus, IngestionJob, TierEnum
+
+
+def _client_with_documents(db, make_client, count: int):
+    client, _ = make_client(tier=TierEnum.PREMIUM)
+    docs = []
+    for i in range(count):
+        doc = Document(id=uuid.uuid4(), client_id=client.id, filename=f"doc{i}.txt", file_type="txt", file_size=5)
+        db.add(doc)
+        file_path, _, _ = spool_upload(doc.id, io.BytesIO(b"hello"), 100)
+        enqueue_document(db, doc, file_path)
+        docs.append(doc)
+    db.commit()
+    return client, docs
+
+
+class CountingReader(io.BytesIO):
+    """Upload stand-in that records the largest read"""
+    largest = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.largest = max(self.largest, len(data))
+        return data
+
+
+def test_spool_hashes_in_chunks_and_stops_at_the_limit(monkeypatch, tmp_path):
+    monkeypatch.setattr(ingestion, "UPLOAD_CHUNK_SIZE", 1000)
+    monkeypatch.setattr(ingestion.settings, "ingestion_upload_dir", str(tmp_path))
+    data = os.urandom(10_500)
+
+    source = CountingReader(data)
+    path, size, digest = spool_upload(uuid.uuid4(), source, max_bytes=20_000)
+    assert size == len(data) and digest == hashlib.sha256(data).hexdigest()
+    assert open(path, "rb").read() == data and source.largest == 1000
+
+    source = CountingReader(data * 10)
+    try:
+        spool_upload(uuid.uuid4(), source, max_bytes=20_000)
+        raise AssertionError("limit not enforced")
+    except UploadTooLarge:
+        pass
+    assert source.tell() <= 21_000  # Stopped reading right after the limit
+    assert os.listdir(tmp_path) == [os.path.basename(path)]  # No partial file left behind
+
+
+def _drain(worker_id: str) -> list:
+    claimed = []
+    while True:
+        with SessionLocal() as db:
+            job = claim_job(db, worker_id)
+        if job is None:
+            return claimed
+        claimed.append(job)
+
+
+def test_each_job_is_claimed_once_and_abandoned_jobs_are_reclaimed(monkeypatch, tmp_path, db, make_client):
+    monkeypatch.setattr(ingestion.settings, "ingestion_upload_dir", str(tmp_path))
+    client, docs = _client_with_documents(db, make_client, 3)
+    ours = {doc.id for doc in docs}
+    claimed = [job for job in _drain("worker-a") if job.document_id in ours]
+    assert sorted(job.document_id for job in claimed) == sorted(ours)
+    assert all(job.status == "running" and job.attempts == 1 for job in claimed)
+
+    # Worker crashed: its heartbeat goes stale and another worker picks the job up
+    stale = datetime.utcnow() - timedelta(seconds=ingestion.settings.ingestion_stale_after_seconds + 5)
+    db.query(IngestionJob).filter(IngestionJob.id == claimed[0].id).update({"heartbeat_at": stale})
+    db.commit()
+    reclaimed = [job for job in _drain("worker-b") if job.document_id in ours]
+    assert [(job.id, job.attempts, job.locked_by) for job in reclaimed] == [(claimed[0].id, 2, "worker-b")]
+
+
+def test_failed_attempt_is_retried_with_backoff_then_completes(monkeypatch, tmp_path, db, make_client):
+    monkeypatch.setattr(ingestion.settings, "ingestion_upload_dir", str(tmp_path))
+    assert [retry_delay_seconds(n) for n in (1, 2, 3)] == [10.0, 20.0, 40.0]
+    assert retry_delay_seconds(20) == ingestion.settings.ingestion_retry_max_seconds
+
+    client, (doc,) = _client_with_documents(db, make_client, 1)
+    outcomes = [RuntimeError("chroma unavailable"), 7]
+
+    async def fake_process_document(client_id, doc_id, file_path, file_type, filename, on_progress=None):
+        assert open(file_path, "rb").read() == b"hello"
+        await on_progress("embedding", 50)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(rag, "process_document", fake_process_document)
+    worker = IngestionWorker(concurrency=1)
+    job = [j for j in _drain("worker-a") if j.document_id == doc.id][0]
+    asyncio.run(worker.process(job))
+    db.expire_all()
+    row = db.get(IngestionJob, job.id)
+    assert row.status == "queued" and row.run_after > datetime.utcnow() and row.last_error == "chroma unavailable"
+    assert db.get(Document, doc.id).progress_stage == "retrying"
+
+    db.query(IngestionJob).filter(IngestionJob.id == job.id).update({"run_after": datetime.utcnow()})
+    db.commit()
+    job = [j for j in _drain("worker-a") if j.id == job.id][0]
+    asyncio.run(worker.process(job))
+    db.expire_all()
+    finished = db.get(Document, doc.id)
+    assert finished.status == DocumentStatus.COMPLETED and finished.chunk_count == 7
+    assert finished.progress_percent == 100 and db.get(IngestionJob, job.id).status == "succeeded"
+    assert not os.path.exists(job.file_path)
+    assert worker.stats()["retried"] == 1 and worker.stats()["succeeded"] == 1
+
+
+def test_worker_stops_when_its_job_is_reclaimed(monkeypatch, tmp_path, db, make_client):
+    """A worker that lost its claim stops processing and writes neither progress nor status"""
+    monkeypatch.setattr(ingestion.settings, "ingestion_upload_dir", str(tmp_path))
+    monkeypatch.setattr(ingestion.settings, "ingestion_heartbeat_seconds", 0.05)
+    client, (doc,) = _client_with_documents(db, make_client, 1)
+    stages = []
+
+    async def fake_process_document(client_id, doc_id, file_path, file_type, filename, on_progress=None):
+        for stage in ("extracting", "embedding", "storing"):
+            await on_progress(stage, 50)
+            stages.append(stage)
+            if stage == "extracting":
+                # Meanwhile the job looks abandoned and worker-b takes it over
+                stale = datetime.utcnow() - timedelta(seconds=ingestion.settings.ingestion_stale_after_seconds + 5)
+                with SessionLocal() as other:
+                    other.query(IngestionJob).filter(IngestionJob.document_id == doc_id).update({"heartbeat_at": stale})
+                    other.commit()
+                assert doc_id in [j.document_id for j in _drain("worker-b")]
+                await asyncio.sleep(1)
+        return 7
+
+    monkeypatch.setattr(rag, "process_document", fake_process_document)
+    worker = IngestionWorker(concurrency=1)
+    job = [j for j in _drain("worker-a") if j.document_id == doc.id][0]
+    asyncio.run(worker.process(job))
+    db.expire_all()
+    assert stages == ["extracting"] and worker.stats()["reclaimed"] == 1 and worker.stats()["succeeded"] == 0
+    row = db.get(IngestionJob, job.id)
+    assert row.status == "running" and row.locked_by == "worker-b" and os.path.exists(job.file_path)
+    assert db.get(Document, doc.id).status != DocumentStatus.COMPLETED
+
+
+def test_missing_upload_is_retried_for_another_host(monkeypatch, tmp_path, db, make_client):
+    """A worker without the file (upload stored on another host) requeues the job instead of failing it"""
+    monkeypatch.setattr(ingestion.settings, "ingestion_upload_dir", str(tmp_path))
+    client, (doc,) = _client_with_documents(db, make_client, 1)
+    job = [j for j in _drain("worker-a") if j.document_id == doc.id][0]
+    os.remove(job.file_path)
+    worker = IngestionWorker(concurrency=1)
+    asyncio.run(worker.process(job))
+    db.expire_all()
+    row = db.get(IngestionJob, job.id)
+    assert row.status == "queued" and "not found" in row.last_error and worker.stats()["retried"] == 1
+
+
+def test_upload_is_processed_inline_without_app_startup(monkeypatch, tmp_path, make_client):
+    """No lifespan (e.g. Mangum): the upload request runs its own job"""
+    monkeypatch.setattr(ingestion.settings, "ingestion_upload_dir", str(tmp_path))
+
+    async def fake_process_document(client_id, doc_id, file_path, file_type, filename, on_progress=None):
+        assert open(file_path, "rb").read() == b"Opening hours are nine to five."
+        return 3
+
+    monkeypatch.setattr(rag, "process_document", fake_process_document)
+    client, key = make_client(tier=TierEnum.PREMIUM)
+    response = TestClient(app).post(
+        "/api/documents", headers={"X-API-Key": key},
+        files={"file": ("hours.txt", b"Opening hours are nine to five.", "text/plain")},
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "completed" and response.json()["chunk_count"] == 3
+    assert os.listdir(tmp_path) == []
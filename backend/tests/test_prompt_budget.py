@@ -0,0 +1,40 @@
+"""
+Token-budgeted prompt tests
+"""
+from app.main import _upstream_tokens
+from app.prompt_budget import build_chat_messages, count_tokens, message_tokens
+
+
+def test_rag_chunks_packed_in_relevance_order_within_budget():
+    """Chunks go in by relevance; one that doesn't fit is skipped, a smaller later one still fits"""
+    small_a, huge, small_b = "alpha " * 20, "bravo " * 2000, "charlie " * 20
+    fixed = count_tokens("You are a bot.") + message_tokens({"role": "user", "content": "Hi?"})
+    budget = fixed + 3 * count_tokens(small_a) + 100
+    messages, used, chunks_used = build_chat_messages("You are a bot.", "Hi?", budget, rag_chunks=[small_a, huge, small_b])
+
+    system = messages[0]["content"]
+    assert chunks_used == 2 and used <= budget
+    assert system.index("alpha") < system.index("charlie") and "bravo" not in system
+    assert messages[-1] == {"role": "user", "content": "Hi?"}
+
+    _, _, none_used = build_chat_messages("You are a bot.", "Hi?", fixed, rag_chunks=[small_a])
+    assert none_used == 0
+
+
+def test_history_keeps_newest_turns_and_summary():
+    """Older history is dropped first and the kept window starts on a visitor message"""
+    history = []
+    for i in range(10):
+        history += [{"role": "user", "content": f"question {i} " * 30}, {"role": "assistant", "content": f"answer {i} " * 30}]
+    messages, used, _ = build_chat_messages("Sys", "Now?", 800, summary="Visitor is Sam", history=history)
+    kept = messages[1:-1]
+    assert "Visitor is Sam" in messages[0]["content"]
+    assert kept and kept[0]["role"] == "user" and kept[-1] == history[-1]
+    assert len(kept) < len(history) and used <= 800
+
+
+def test_upstream_usage_preferred_over_estimate():
+    payload = {"messages": [{"role": "user", "content": "hello there"}]}
+    assert _upstream_tokens({"prompt_tokens": 12, "completion_tokens": 30, "total_tokens": 42}, payload, "hi") == 42
+    assert _upstream_tokens(None, None, "cached answer") == 0
+    assert _upstream_tokens(None, payload, "hi") == message_tokens(payload["messages"][0]) + count_tokens("hi")
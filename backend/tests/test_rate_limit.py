@@ -0,0 +1,52 @@
+"""
+Rate limiter tests
+"""
+import asyncio
+import threading
+import uuid
+
+from app import rate_limit
+from app.rate_limit import KeyedRateLimiter
+
+
+def test_limit_is_per_key():
+    """Each key gets its own allowance; the over-limit hit is rejected and counted"""
+    limiter = KeyedRateLimiter("test", "3/minute", "memory://", "sliding-window-counter")
+    assert [limiter.hit("a") for _ in range(4)] == [True, True, True, False]
+    assert limiter.hit("b")
+    stats = limiter.stats()
+    assert stats["allowed"] == 4 and stats["rejected"] == 1 and stats["backend"] == "memory"
+
+
+def test_unreachable_store_falls_back_to_process_counters():
+    """A dead shared store degrades to per-worker limiting instead of failing requests"""
+    limiter = KeyedRateLimiter("test", "2/minute", "memory://", "sliding-window-counter")
+
+    class DeadStore:
+        def hit(self, *args):
+            raise ConnectionError("redis down")
+
+    limiter._primary = DeadStore()
+    assert [limiter.hit("a") for _ in range(3)] == [True, True, False]
+    assert limiter.stats()["fallbacks"] == 3
+
+
+def test_shared_store_is_hit_off_the_event_loop(monkeypatch):
+    """A Redis round-trip for the per-client chat limit must not block other requests"""
+    limiter = KeyedRateLimiter("test", "5/minute", "memory://", "sliding-window-counter")
+    limiter.backend = "redis"
+    loop_thread = []
+
+    class RecordingStore:
+        def hit(self, *args):
+            loop_thread.append(threading.get_ident())
+            return True
+
+    limiter._primary = RecordingStore()
+    monkeypatch.setattr(rate_limit, "chat_client_limiter", limiter)
+
+    async def run():
+        assert await rate_limit.check_chat_rate_limit(uuid.uuid4())
+        return threading.get_ident()
+
+    assert asyncio.run(run()) not in loop_thread and limiter.stats()["allowed"] == 1
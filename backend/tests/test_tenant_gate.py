@@ -0,0 +1,93 @@
+"""
+Tenant gate cache tests
+"""
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.main import app
+from app.models import Client, ClientConfig, TierEnum
+from app.tenant_gate import TenantGate, invalidate_tenant_gate
+
+
+def test_origin_and_verdict_checks():
+    """Allowlist keeps the substring semantics; a cached verdict raises the same error"""
+    client = Client(id=uuid.uuid4(), company_name="Acme", tier=TierEnum.BASIC)
+    config = ClientConfig(
+        bot_name="Ace", allowed_domains=[" acme.com ", ""], system_prompt=None,
+        primary_color="#000000", secondary_color="#111111", background_color="#222222", text_color="#FFFFFF",
+        welcome_message="Hi", placeholder_text="Ask", position="bottom-right", auto_open=False, show_branding=True,
+    )
+    gate = TenantGate(client, config, None)
+    gate.check()
+    gate.check_origin("https://shop.acme.com")
+    assert "You are Ace, an AI assistant for Acme." in gate.prompt_header
+    for origin, detail in (("", "Origin required"), ("https://evil.example", "Domain not allowed")):
+        with pytest.raises(HTTPException) as exc:
+            gate.check_origin(origin)
+        assert exc.value.detail == detail
+
+    with pytest.raises(HTTPException) as exc:
+        TenantGate(client, config, (403, "Subscription not active")).check()
+    assert exc.value.status_code == 403
+
+
+def test_widget_config_served_without_queries_until_invalidated(db, make_client):
+    """Only the first request queries; a subscription change shows up after invalidation"""
+    client, _ = make_client(config={"bot_name": "Gatekeeper"})
+    client_id = client.id
+
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    http = TestClient(app)
+    # Every engine: the sync one and each event loop's async engine (widget config reads go through those)
+    event.listen(Engine, "before_cursor_execute", count)
+    try:
+        assert http.get(f"/api/widget/config/{client_id}").json()["botName"] == "Gatekeeper"
+        first = len(statements)
+        assert first > 0  # The uncached request did query
+        assert http.get(f"/api/widget/config/{client_id}").status_code == 200
+        assert len(statements) == first
+    finally:
+        event.remove(Engine, "before_cursor_execute", count)
+
+    client = db.query(Client).filter(Client.id == client_id).first()
+    client.stripe_subscription_status = "canceled"
+    db.commit()
+    assert http.get(f"/api/widget/config/{client_id}").status_code == 200  # Still cached
+    invalidate_tenant_gate(client_id)
+    assert http.get(f"/api/widget/config/{client_id}").status_code == 403
+
+
+def test_widget_config_etag_and_snapshot(monkeypatch, tmp_path, db, make_client):
+    """Same config, same ETag; If-None-Match gets a 304; public configs get a static snapshot"""
+    from app import tenant_gate
+
+    monkeypatch.setattr(tenant_gate.settings, "widget_config_snapshot_dir", str(tmp_path))
+    client, _ = make_client(config={"bot_name": "Tagger"})
+    client_id = client.id
+
+    http = TestClient(app)
+    first = http.get(f"/api/widget/config/{client_id}")
+    etag = first.headers["etag"]
+    assert first.json()["botName"] == "Tagger"
+    assert "max-age" in first.headers["cache-control"] and first.headers["vary"] == "Origin"
+    not_modified = http.get(f"/api/widget/config/{client_id}", headers={"If-None-Match": f'W/"x", {etag}'})
+    assert not_modified.status_code == 304 and not_modified.headers["etag"] == etag
+
+    tenant_gate.refresh_tenant_gate(db, client_id)
+    snapshot = tmp_path / f"{client_id}.json"
+    assert snapshot.read_bytes() == first.content
+    assert http.get(f"/api/widget/config/{client_id}").headers["etag"] == etag
+
+    client.config.allowed_domains = ["acme.com"]
+    db.commit()
+    tenant_gate.refresh_tenant_gate(db, client_id)
+    assert not snapshot.exists()  # A static file cannot enforce the allowlist
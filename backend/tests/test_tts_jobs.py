@@ -0,0 +1,35 @@
+"""
+Deferred TTS job tests
+"""
+import asyncio
+from types import SimpleNamespace
+from uuid import uuid4
+
+from app import main, tts_jobs
+
+
+def test_deferred_audio_falls_back_to_inline_without_app_startup(monkeypatch):
+    """Under Mangum no startup runs and a job could be frozen or fetched from another instance"""
+    async def generate(text, api_key, voice):
+        return b"\x00\x00" * 2400
+
+    async def stream(text, api_key, voice):
+        yield b"\x00\x00" * 2400
+
+    monkeypatch.setattr(main, "generate_tts_audio", generate)
+    monkeypatch.setattr(tts_jobs, "stream_tts_audio", stream)
+    monkeypatch.setattr(tts_jobs, "_loop", None)
+    body = SimpleNamespace(audio_mode="deferred", audio_format=None)
+    config = SimpleNamespace(tts_voice=None, tts_audio_format=None)
+
+    async def run():
+        inline = await main._chat_audio(body, uuid4(), config, "xai-key", "Hello there")
+        tts_jobs.start()  # As app startup does
+        deferred = await main._chat_audio(body, uuid4(), config, "xai-key", "Hello there")
+        await tts_jobs.wait_for_tts_job(tts_jobs.get_tts_job(deferred[1]), 1)
+        return inline, deferred
+
+    (audio_url, job_id, _), (job_url, deferred_id, stream_url) = asyncio.run(run())
+    assert audio_url.startswith("data:audio/wav;base64,") and job_id is None
+    assert deferred_id and job_url.endswith(f"/api/tts/{deferred_id}") and stream_url == f"{job_url}/stream"
+    assert not tts_jobs.deferred_available()  # That loop is gone
@@ -0,0 +1,56 @@
+"""
+Write-behind usage accounting tests
+"""
+import asyncio
+import uuid
+from datetime import date
+
+from app import database
+from app.models import UsageRecord
+from app.usage_aggregator import UsageAggregator
+
+
+def test_flushes_upsert_into_one_row_per_day(db, make_client):
+    """Deltas from several flushes (as from several workers) add up in a single row"""
+    client, _ = make_client()
+    first, second = UsageAggregator(flush_interval=60), UsageAggregator(flush_interval=60)
+
+    first.record(client.id, messages=1, tokens=10)
+    first.record(client.id, rag_queries=1)
+    second.record(client.id, messages=1, tokens=5)
+    assert first.pending_for(client.id) == {date.today(): [1, 10, 1]}
+    assert first.flush() == 1 and second.flush() == 1
+    assert first.flush() == 0
+
+    rows = db.query(UsageRecord).filter(UsageRecord.client_id == client.id).all()
+    assert [(r.message_count, r.token_count, r.rag_query_count) for r in rows] == [(2, 15, 1)]
+
+
+def test_failed_flush_keeps_deltas(monkeypatch):
+    """A flush that cannot reach the database puts its batch back for the next attempt"""
+    class BrokenEngine:
+        def begin(self):
+            raise ConnectionError("database unavailable")
+
+    aggregator = UsageAggregator(flush_interval=60)
+    client_id = uuid.uuid4()
+    aggregator.record(client_id, messages=1, tokens=3)
+    monkeypatch.setattr(database, "engine", BrokenEngine())
+    assert aggregator.flush() == 0
+    aggregator.record(client_id, messages=1)
+    assert aggregator.pending_for(client_id) == {date.today(): [2, 3, 0]}
+    assert aggregator.stats()["flush_errors"] == 1
+
+
+def test_log_writes_through_without_a_flusher(db, make_client):
+    """Without app startup (Mangum lifespan off, scripts) each turn is flushed inline"""
+    client, _ = make_client()
+    aggregator = UsageAggregator(flush_interval=60)
+
+    async def turn():
+        await aggregator.log(client.id, messages=1, tokens=7)
+
+    asyncio.run(turn())
+    assert aggregator.pending_for(client.id) == {}
+    row = db.query(UsageRecord).filter(UsageRecord.client_id == client.id).one()
+    assert (row.message_count, row.token_count) == (1, 7)
@@ -0,0 +1,90 @@
+"""
+Realtime voice session pool tests
+"""
+import asyncio
+import base64
+import json
+
+import app.voice_pool as voice_pool_module
+from app import tts
+from app.voice_pool import VoiceSessionPool
+
+
+class FakeRealtimeSocket:
+    """Answers each response.create with one audio delta followed by the done events"""
+
+    def __init__(self):
+        self.open = True
+        self.sent = []
+        self._inbox = asyncio.Queue()
+
+    async def send(self, message):
+        obj = json.loads(message)
+        self.sent.append(obj["type"])
+        if obj["type"] == "conversation.item.create":
+            await self._inbox.put({"type": "conversation.item.added"})
+        elif obj["type"] == "response.create":
+            await self._inbox.put({"type": "response.output_audio.delta", "delta": base64.b64encode(b"\x01\x02").decode()})
+            await self._inbox.put({"type": "response.output_audio.done"})
+            await self._inbox.put({"type": "response.done"})
+
+    async def recv(self):
+        return json.dumps(await self._inbox.get())
+
+    async def close(self):
+        self.open = False
+
+
+def _pool(**overrides):
+    options = dict(max_sessions=2, idle_timeout=60, max_age=600, max_uses=25, acquire_timeout=0.2, health_check_after=30)
+    options.update(overrides)
+    return VoiceSessionPool(**options)
+
+
+def test_session_reused_across_utterances(monkeypatch):
+    """Two utterances in the same voice share one socket and one handshake"""
+    opened = []
+
+    async def fake_open(api_key, voice):
+        opened.append(voice)
+        return FakeRealtimeSocket()
+
+    pool = _pool()
+    monkeypatch.setattr(voice_pool_module, "open_realtime_session", fake_open)
+    monkeypatch.setattr(voice_pool_module, "voice_pool", pool)
+    monkeypatch.setattr(tts.settings, "tts_cache_enabled", False)
+
+    async def run():
+        first = [chunk async for chunk in tts.stream_tts_audio("Hello", "key", "Ara")]
+        second = [chunk async for chunk in tts.stream_tts_audio("Again", "key", "Ara")]
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == [b"\x01\x02"]
+    assert opened == ["Ara"]
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["reused"] == 1
+    assert stats["idle"] == 1
+
+
+def test_unfinished_session_is_discarded_and_cap_enforced(monkeypatch):
+    """Sessions not marked reusable are closed; the cap frees idle sessions of other keys"""
+    async def fake_open(api_key, voice):
+        return FakeRealtimeSocket()
+
+    pool = _pool(max_sessions=1)
+    monkeypatch.setattr(voice_pool_module, "open_realtime_session", fake_open)
+
+    async def run():
+        async with pool.session("key", "Ara") as session:
+            first_ws = session.ws
+        assert not first_ws.open  # Never marked reusable
+        async with pool.session("key", "Ara") as session:
+            session.reusable = True
+        async with pool.session("other-key", "Leo") as session:
+            assert pool.stats()["open"] == 1  # Idle "key" session was evicted to make room
+            session.reusable = True
+
+    asyncio.run(run())
+    assert pool.stats()["discarded"] == 2
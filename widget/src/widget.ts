@@ -40,6 +40,7 @@ class SnipWidget {
   private container: HTMLElement | null = null
   private isOpen: boolean = false
   private messages: Message[] = []
+  private conversationId: string | null = null // Returned by /api/chat; keeps follow-ups in context
   private isLoading: boolean = false
   private currentAudio: HTMLAudioElement | null = null // Track current audio for cleanup
 
@@ -863,7 +864,8 @@ class SnipWidget {
         },
         body: JSON.stringify({
           client_id: this.clientId,
-          message: message
+          message: message,
+          conversation_id: this.conversationId
         })
       })
       
@@ -872,6 +874,9 @@ class SnipWidget {
       }
       
       const data = await response.json()
+      if (data.conversation_id) {
+        this.conversationId = data.conversation_id
+      }
       
       this.messages.push({
         role: 'assistant',